@@ -0,0 +1,215 @@
+#!/usr/bin/env python
+"""pybackup - Stand-in executables for benchmarks.
+
+Emulates pg_dump, pg_dumpall, mysqldump, mysql and rsync for benchmarking the data
+paths of the backup plugins without database servers. The command is selected
+by the name the script is invoked with or by the first argument (wrapper
+scripts created by run_bench.py) and the generated stream is configured through environment variables:
+
+    PYBACKUP_BENCH_BYTES:   Number of bytes emitted by dump commands.
+    PYBACKUP_BENCH_ENTROPY: Fraction of random data in the stream (0.0 - 1.0);
+                            the rest is repetitive text, so the value controls
+                            the compression ratio.
+    PYBACKUP_BENCH_RATE:    Limit for output rate in bytes per second.
+                            (Unlimited by default.)
+
+The mysql stand-in lists fakeTableCount tables (and a view) and the sizes of
+fakeDatabaseCount databases (db1, db2, ...; growing sizes) for queries on
+information_schema and acknowledges the global read lock of snapshot sessions.
+The rsync stand-in copies the source paths to the destination preserving the
+relative paths (like rsync -R), lists the copied files on stdout and prints the
+total file size with --stats.
+
+"""
+
+import os
+import sys
+import time
+import random
+import shutil
+
+__author__ = "Ali Onur Uyar"
+__copyright__ = "Copyright 2011, Ali Onur Uyar"
+__credits__ = []
+__license__ = "GPL"
+__version__ = "0.5"
+__maintainer__ = "Ali Onur Uyar"
+__email__ = "aouyar at gmail.com"
+__status__ = "Development"
+
+
+# Defaults
+blockSize = 1048576
+defaultBytes = 67108864
+defaultEntropy = 0.3
+fakeTableCount = 8
+fakeDatabaseCount = 4
+
+
+def genBlocks(seed):
+    """Returns list of distinct data blocks for synthetic streams.
+
+    @param seed: Seed for the random generator; the same seed yields the same
+                 stream, so streams are comparable across runs.
+    @return:     List of data blocks.
+
+    """
+    entropy = float(os.environ.get('PYBACKUP_BENCH_ENTROPY', defaultEntropy))
+    entropy = min(max(entropy, 0.0), 1.0)
+    rnd = random.Random(seed)
+    text = ("INSERT INTO bench_table (id, name, value) VALUES "
+            "(%d, 'name-%d', %d);\n")
+    blocks = []
+    for i in range(8):
+        rand_len = int(blockSize * entropy)
+        if rand_len > 0:
+            rand_data = ('%0*x' % (2 * rand_len, 
+                                   rnd.getrandbits(8 * rand_len))).decode('hex')
+        else:
+            rand_data = ''
+        text_data = []
+        text_len = 0
+        row = i * 1000000
+        while text_len < blockSize - rand_len:
+            line = text % (row, row, rnd.randint(0, 1000000))
+            text_data.append(line)
+            text_len += len(line)
+            row += 1
+        text_data = ''.join(text_data)[:blockSize - rand_len]
+        blocks.append(rand_data + text_data)
+    return blocks
+
+def emitStream(fp, seed):
+    """Writes synthetic stream to file.
+
+    @param fp:   Output file object.
+    @param seed: Seed for the random generator.
+
+    """
+    total = int(os.environ.get('PYBACKUP_BENCH_BYTES', defaultBytes))
+    rate = os.environ.get('PYBACKUP_BENCH_RATE')
+    if rate is not None:
+        rate = float(rate)
+    blocks = genBlocks(seed)
+    written = 0
+    start = time.time()
+    idx = 0
+    while written < total:
+        data = blocks[idx % len(blocks)][:total - written]
+        fp.write(data)
+        written += len(data)
+        idx += 1
+        if rate:
+            delay = written / rate - (time.time() - start)
+            if delay > 0:
+                time.sleep(delay)
+    fp.flush()
+
+def fakeDump(args, seed):
+    out_path = None
+    if '-f' in args:
+        out_path = args[args.index('-f') + 1]
+    if '-Fd' in args:
+        # Directory format of pg_dump: table of contents and one file per
+        # table; the tables are split among the parallel jobs.
+        num_jobs = 1
+        if '-j' in args:
+            num_jobs = int(args[args.index('-j') + 1])
+        os.mkdir(out_path)
+        open(os.path.join(out_path, 'toc.dat'), 'wb').close()
+        total = int(os.environ.get('PYBACKUP_BENCH_BYTES', defaultBytes))
+        os.environ['PYBACKUP_BENCH_BYTES'] = str(total // num_jobs)
+        for i in range(num_jobs):
+            fp = open(os.path.join(out_path, "%d.dat" % (3000 + i)), 'wb')
+            try:
+                emitStream(fp, "%s:%d" % (seed, i))
+            finally:
+                fp.close()
+        return 0
+    if out_path is not None:
+        fp = open(out_path, 'wb')
+        try:
+            emitStream(fp, seed)
+        finally:
+            fp.close()
+    else:
+        emitStream(sys.stdout, seed)
+    return 0
+
+def fakeMysql(args):
+    if '-e' in args:
+        query = args[args.index('-e') + 1]
+        if 'GROUP BY TABLE_SCHEMA' in query:
+            total = int(os.environ.get('PYBACKUP_BENCH_BYTES', defaultBytes))
+            for i in range(1, fakeDatabaseCount + 1):
+                sys.stdout.write("db%d\t%d\n" % (i, total * i))
+        elif 'information_schema.TABLES' in query:
+            total = int(os.environ.get('PYBACKUP_BENCH_BYTES', defaultBytes))
+            for i in range(fakeTableCount):
+                sys.stdout.write("table%02d\tBASE TABLE\tInnoDB\t%d\n" 
+                                 % (i, total // (i + 1)))
+            sys.stdout.write("view01\tVIEW\t\t0\n")
+        return 0
+    # Session reading statements from stdin, as used for the global read lock.
+    while True:
+        line = sys.stdin.readline()
+        if not line:
+            break
+        if line.startswith("SELECT 'locked'"):
+            sys.stdout.write("locked\n")
+            sys.stdout.flush()
+    return 0
+
+def fakeRsync(args):
+    paths = [arg for arg in args if not arg.startswith('-')]
+    if len(paths) < 2:
+        sys.stderr.write("rsync: missing source or destination\n")
+        return 1
+    dest = paths[-1]
+    dry_run = '-n' in args
+    total_size = 0
+    for src in paths[:-1]:
+        src = src.lstrip(':')
+        # Paths after /./ are relative to the destination, like rsync -R.
+        if '/./' in src:
+            (base, rel) = src.split('/./', 1)
+        else:
+            (base, rel) = ('/', src.lstrip('/'))
+        for (dirpath, dirnames, filenames) in os.walk(os.path.join(base, rel)): #@UnusedVariable
+            rel_dir = os.path.relpath(dirpath, base)
+            dst_dir = os.path.join(dest, rel_dir)
+            if not dry_run and not os.path.isdir(dst_dir):
+                os.makedirs(dst_dir)
+            for filename in sorted(filenames):
+                rel_path = os.path.join(rel_dir, filename)
+                total_size += os.lstat(os.path.join(dirpath, filename)).st_size
+                if not dry_run:
+                    shutil.copy2(os.path.join(dirpath, filename),
+                                 os.path.join(dst_dir, filename))
+                sys.stdout.write("%s\n" % rel_path)
+    if '--stats' in args:
+        sys.stdout.write("\nTotal file size: %s bytes\n"
+                         "Total transferred file size: %s bytes\n" 
+                         % (format(total_size, ',d'), format(total_size, ',d')))
+    return 0
+
+def main(argv=None):
+    argv = argv or sys.argv
+    name = os.path.basename(argv[0])
+    args = argv[1:]
+    if name.startswith('fakecmd') and args:
+        name = args.pop(0)
+    if name == 'rsync':
+        return fakeRsync(args)
+    elif name == 'mysql':
+        return fakeMysql(args)
+    elif name in ('pg_dump', 'pg_dumpall', 'mysqldump'):
+        db = [arg for arg in args if not arg.startswith('-')][-1:]
+        return fakeDump(args, "%s:%s" % (name, ' '.join(db)))
+    else:
+        sys.stderr.write("Unknown command for benchmark stand-in: %s\n" % name)
+        return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
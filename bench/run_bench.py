@@ -0,0 +1,447 @@
+#!/usr/bin/env python
+"""pybackup - Benchmarks for the data paths of backup plugins.
+
+Generates a synthetic source tree and stand-in executables for pg_dump,
+pg_dumpall, mysqldump and rsync (see fakecmd.py), which are configured for the
+backup jobs through the cmd_* options. Each benchmark scenario runs one backup
+job through JobManager in a separate process; the end-to-end scenario runs all
+jobs in a single process. Wall time, CPU time and peak RSS are measured for
+the process tree, the results are saved as JSON and can be compared with the
+results of a previous run, for example for another commit:
+
+    python bench/run_bench.py -o before.json
+    git checkout other-branch
+    python bench/run_bench.py -o after.json -c before.json
+
+"""
+
+import os
+import sys
+import time
+import json
+import random
+import shutil
+import platform
+import optparse
+import subprocess
+
+benchDir = os.path.dirname(os.path.abspath(__file__))
+repoDir = os.path.dirname(benchDir)
+sys.path.insert(0, repoDir)
+sys.path.insert(0, benchDir)
+
+import fakecmd
+from pybackup import utils
+
+__author__ = "Ali Onur Uyar"
+__copyright__ = "Copyright 2011, Ali Onur Uyar"
+__credits__ = []
+__license__ = "GPL"
+__version__ = "0.5"
+__maintainer__ = "Ali Onur Uyar"
+__email__ = "aouyar at gmail.com"
+__status__ = "Development"
+
+
+# Defaults
+defaultWorkDir = '/tmp/pybackup-bench'
+fakeCmdList = ('pg_dump', 'pg_dumpall', 'mysqldump', 'mysql', 'rsync')
+
+scenarioList = (
+    # (name, plugin, method, job options, input: number of streams or 'tree')
+    ('pg_globals_external', 'postgresql', 'pg_dump_globals',
+     {}, 1),
+    ('pg_globals_internal', 'postgresql', 'pg_dump_globals',
+     {'compress_engine': 'internal'}, 1),
+    ('pg_databases', 'postgresql', 'pg_dump_databases',
+     {'db_list': 'db1 db2 db3 db4', 'dump_workers': '2'}, 4),
+    ('pg_databases_dir', 'postgresql', 'pg_dump_databases',
+     {'db_list': 'db1 db2', 'dump_format': 'directory', 'dump_jobs': '4'}, 2),
+    ('mysql_external', 'mysql', 'mysql_dump_databases',
+     {'db_list': 'db1 db2', 'dump_workers': '2'}, 4),
+    ('mysql_internal', 'mysql', 'mysql_dump_databases',
+     {'db_list': 'db1 db2', 'dump_workers': '2',
+      'compress_engine': 'internal'}, 4),
+    ('mysql_tables', 'mysql', 'mysql_dump_databases',
+     {'db_list': 'db1', 'dump_per_table': 'yes', 'table_workers': '4',
+      'compress_engine': 'internal'}, fakecmd.fakeTableCount + 2),
+    ('archive_tar', 'archive', 'archive',
+     {'filename_archive': 'src', 'backup_index': 'yes'}, 'tree'),
+    ('archive_native', 'archive', 'archive',
+     {'filename_archive': 'src', 'backup_index': 'yes',
+      'archive_engine': 'native', 'compress_engine': 'internal'}, 'tree'),
+    ('archive_shards', 'archive', 'archive',
+     {'filename_archive': 'src', 'backup_index': 'yes', 'shards': '4'}, 
+     'tree'),
+    ('rsync_dirs', 'rsync', 'rsync_dirs',
+     {'backup_index': 'yes'}, 'tree'),
+    ('dedup_cmd', 'dedup', 'dedup_cmd',
+     {}, 1),
+    ('dedup_files', 'dedup', 'dedup_files',
+     {}, 'tree'),
+)
+"""List of benchmark scenarios."""
+
+
+def parseCmdline(argv=None):
+    parser = optparse.OptionParser()
+    parser.add_option('-w', '--workdir', help='Working directory for source '
+                      'tree and backups. (Default: %s)' % defaultWorkDir,
+                      dest='workDir', default=defaultWorkDir, action='store')
+    parser.add_option('-s', '--size', help='Size in MB of each dump stream '
+                      'and of the source tree. (Default: 64)',
+                      dest='size', default=64, type='int', action='store')
+    parser.add_option('-e', '--entropy', help='Fraction of random data in '
+                      'generated data. (Default: %s)' % fakecmd.defaultEntropy,
+                      dest='entropy', default=fakecmd.defaultEntropy,
+                      type='float', action='store')
+    parser.add_option('-j', '--parallel', help='Value of max_parallel_jobs for'
+                      ' the end-to-end scenario. (Default: 1)',
+                      dest='parallel', default=1, type='int', action='store')
+    parser.add_option('-r', '--repeat', help='Number of runs of each scenario;'
+                      ' the fastest run is reported. (Default: 1)',
+                      dest='repeat', default=1, type='int', action='store')
+    parser.add_option('-k', '--scenarios', help='Comma separated list of '
+                      'scenarios to run. (All scenarios by default.)',
+                      dest='scenarios', default=None, action='store')
+    parser.add_option('-o', '--output', help='Path for JSON results file.',
+                      dest='output', default=None, action='store')
+    parser.add_option('-c', '--compare', help='Path for JSON results file of '
+                      'previous run for comparison.',
+                      dest='compare', default=None, action='store')
+    parser.add_option('-l', '--list', help='List benchmark scenarios.',
+                      dest='list', default=False, action='store_true')
+    if argv is None:
+        (opts, args) = parser.parse_args() #@UnusedVariable
+    else:
+        (opts, args) = parser.parse_args(argv[1:]) #@UnusedVariable
+    return opts
+
+def getCommit():
+    """Returns the commit of the repository being benchmarked.
+
+    @return: Commit hash or None if not available.
+
+    """
+    try:
+        cmd = subprocess.Popen(['git', 'rev-parse', '--short', 'HEAD'],
+                               stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                               cwd=repoDir)
+        out, err = cmd.communicate() #@UnusedVariable
+    except OSError:
+        return None
+    if cmd.returncode == 0:
+        return out.strip()
+    return None
+
+def createFakeCmds(bin_dir):
+    """Creates wrapper scripts for stand-in executables.
+
+    @param bin_dir: Directory for wrapper scripts.
+    @return:        Dictionary mapping command names to paths.
+
+    """
+    if not os.path.isdir(bin_dir):
+        os.makedirs(bin_dir)
+    paths = {}
+    for name in fakeCmdList:
+        path = os.path.join(bin_dir, name)
+        fp = open(path, 'w')
+        try:
+            fp.write('#!/bin/sh\nexec "%s" "%s" %s "$@"\n'
+                     % (sys.executable, os.path.join(benchDir, 'fakecmd.py'),
+                        name))
+        finally:
+            fp.close()
+        os.chmod(path, 0755)
+        paths[name] = path
+    return paths
+
+def createSourceTree(src_dir, size):
+    """Generates synthetic source tree with a mix of small and large files.
+
+    @param src_dir: Directory for source tree.
+    @param size:    Total size of files in bytes.
+    @return:        Tuple of number of files and total size in bytes.
+
+    """
+    if os.path.isdir(src_dir):
+        shutil.rmtree(src_dir)
+    rnd = random.Random(0)
+    blocks = fakecmd.genBlocks('tree')
+    data = ''.join(blocks)
+    total = 0
+    num_files = 0
+    while total < size:
+        if rnd.random() < 0.9:
+            file_size = rnd.randint(512, 65536)
+        else:
+            file_size = rnd.randint(1048576, 8388608)
+        file_size = min(file_size, size - total)
+        subdir = os.path.join(src_dir, "dir%02d" % rnd.randint(0, 15),
+                              "sub%02d" % rnd.randint(0, 15))
+        if not os.path.isdir(subdir):
+            os.makedirs(subdir)
+        path = os.path.join(subdir, "file%06d.dat" % num_files)
+        fp = open(path, 'wb')
+        try:
+            written = 0
+            while written < file_size:
+                pos = rnd.randint(0, len(data) - 1)
+                chunk = data[pos:pos + file_size - written]
+                fp.write(chunk)
+                written += len(chunk)
+        finally:
+            fp.close()
+        total += file_size
+        num_files += 1
+    return (num_files, total)
+
+def writeConf(path, backup_root, jobs, plugins, parallel=1):
+    """Writes configuration file for benchmark run.
+
+    @param path:        Path for configuration file.
+    @param backup_root: Backup root directory.
+    @param jobs:        List of (job name, job options) tuples.
+    @param plugins:     List of plugin names.
+    @param parallel:    Value of max_parallel_jobs general option.
+
+    """
+    lines = ["[general]",
+             "backup_root: %s" % backup_root,
+             "console_loglevel: error",
+             "logfile_loglevel: info",
+             "max_parallel_jobs: %d" % parallel,
+             "",
+             "[plugins]",]
+    for plugin in sorted(set(plugins)):
+        lines.append("%s: pybackup.plugins.%s" % (plugin, plugin))
+    for (job_name, job_conf) in jobs:
+        lines.append("")
+        lines.append("[%s]" % job_name)
+        for (k, v) in sorted(job_conf.items()):
+            lines.append("%s: %s" % (k, v))
+    fp = open(path, 'w')
+    try:
+        fp.write("\n".join(lines) + "\n")
+    finally:
+        fp.close()
+
+def getJobConf(scenario, cmd_paths, src_dir):
+    """Returns job options for benchmark scenario.
+
+    @param scenario: Scenario tuple from scenarioList.
+    @param cmd_paths: Dictionary mapping command names to stand-in paths.
+    @param src_dir:   Directory of source tree.
+    @return:          Dictionary of job options.
+
+    """
+    (name, plugin, method, opts, inp) = scenario #@UnusedVariable
+    job_conf = {'method': method}
+    if plugin == 'postgresql':
+        job_conf['cmd_pg_dump'] = cmd_paths['pg_dump']
+        job_conf['cmd_pg_dumpall'] = cmd_paths['pg_dumpall']
+    elif plugin == 'mysql':
+        job_conf['cmd_mysqldump'] = cmd_paths['mysqldump']
+        job_conf['cmd_mysql'] = cmd_paths['mysql']
+    elif plugin == 'rsync':
+        job_conf['cmd_rsync'] = cmd_paths['rsync']
+    if method == 'dedup_cmd':
+        job_conf['source_cmd'] = cmd_paths['pg_dumpall']
+    if inp == 'tree':
+        job_conf['base_dir'] = os.path.dirname(src_dir)
+        job_conf['path_list'] = os.path.basename(src_dir)
+    job_conf.update(opts)
+    return job_conf
+
+def runJobs(work_dir, name, jobs, plugins, env, parallel=1):
+    """Runs backup jobs in a separate process and measures the resource usage
+    of the process tree.
+
+    @param work_dir: Working directory.
+    @param name:     Name of the run.
+    @param jobs:     List of (job name, job options) tuples.
+    @param plugins:  List of plugin names.
+    @param env:      Dictionary of environment variables.
+    @param parallel: Value of max_parallel_jobs general option.
+    @return:         Dictionary of results.
+
+    """
+    backup_root = os.path.join(work_dir, 'root', name)
+    if os.path.isdir(backup_root):
+        shutil.rmtree(backup_root)
+    os.makedirs(backup_root)
+    conf_path = os.path.join(work_dir, "%s.conf" % name)
+    writeConf(conf_path, backup_root, jobs, plugins, parallel)
+    args = [sys.executable, '-m', 'pybackup.jobmgr', '-c', conf_path, '-q']
+    args.extend([job_name for (job_name, job_conf) in jobs]) #@UnusedVariable
+    start = time.time()
+    cmd = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                           env=env)
+    err_tail = utils.OutputTail()
+    utils.pumpStreams(((cmd.stdout, utils.OutputTail()), (cmd.stderr, err_tail)))
+    rusage = utils.waitCmd(cmd)
+    err = err_tail.getText()
+    wall_time = time.time() - start
+    result = {'wall_time': wall_time,
+              'returncode': cmd.returncode,}
+    result.update(utils.getRusageStats([rusage]))
+    result['bytes_written'] = utils.getDirSize(backup_root)
+    if cmd.returncode != 0 or err.strip():
+        result['errors'] = utils.splitMsg(err)
+    report_paths = [os.path.join(dirpath, 'report.json')
+                    for (dirpath, dirnames, filenames) in os.walk(backup_root) #@UnusedVariable
+                    if 'report.json' in filenames]
+    if report_paths:
+        fp = open(report_paths[0], 'r')
+        try:
+            report = json.load(fp)
+        finally:
+            fp.close()
+        result['jobs'] = dict([(job['job'], {'status': job['status'],
+                                             'wall_time': job['wall_time'],
+                                             'bytes_written': job['bytes_written']})
+                               for job in report['jobs']])
+    return result
+
+def runBench(opts):
+    """Runs benchmark scenarios.
+
+    @param opts: Command line options.
+    @return:     Dictionary of results.
+
+    """
+    work_dir = os.path.abspath(opts.workDir)
+    size = opts.size * 1048576
+    cmd_paths = createFakeCmds(os.path.join(work_dir, 'bin'))
+    src_dir = os.path.join(work_dir, 'src')
+    (num_files, tree_size) = createSourceTree(src_dir, size)
+    env = os.environ.copy()
+    env['PYBACKUP_BENCH_BYTES'] = str(size)
+    env['PYBACKUP_BENCH_ENTROPY'] = str(opts.entropy)
+    env['PYTHONPATH'] = os.pathsep.join([repoDir] +
+                                        [path for path in
+                                         [env.get('PYTHONPATH')] if path])
+    if opts.scenarios:
+        selected = opts.scenarios.split(',')
+    else:
+        selected = [scenario[0] for scenario in scenarioList] + ['jobmgr']
+    results = {}
+    all_jobs = []
+    all_plugins = []
+    input_total = 0
+    for scenario in scenarioList:
+        (name, plugin, method, job_opts, inp) = scenario #@UnusedVariable
+        if inp == 'tree':
+            input_bytes = tree_size
+        else:
+            input_bytes = inp * size
+        job_conf = getJobConf(scenario, cmd_paths, src_dir)
+        all_jobs.append((name, job_conf))
+        all_plugins.append(plugin)
+        input_total += input_bytes
+        if name not in selected:
+            continue
+        best = None
+        for i in range(opts.repeat): #@UnusedVariable
+            result = runJobs(work_dir, name, [(name, job_conf)], [plugin], env)
+            if best is None or result['wall_time'] < best['wall_time']:
+                best = result
+        best['input_bytes'] = input_bytes
+        best['throughput'] = input_bytes / best['wall_time']
+        results[name] = best
+        printResult(name, best)
+    if 'jobmgr' in selected:
+        best = None
+        for i in range(opts.repeat): #@UnusedVariable
+            result = runJobs(work_dir, 'jobmgr', all_jobs, all_plugins, env,
+                             opts.parallel)
+            if best is None or result['wall_time'] < best['wall_time']:
+                best = result
+        best['input_bytes'] = input_total
+        best['throughput'] = input_total / best['wall_time']
+        results['jobmgr'] = best
+        printResult('jobmgr', best)
+    return {'commit': getCommit(),
+            'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'hostname': platform.node(),
+            'python': platform.python_version(),
+            'cpus': os.sysconf('SC_NPROCESSORS_ONLN'),
+            'params': {'size': size, 'entropy': opts.entropy,
+                       'parallel': opts.parallel, 'repeat': opts.repeat,
+                       'num_files': num_files, 'tree_size': tree_size},
+            'results': results,}
+
+def printResult(name, result):
+    status = ''
+    if result.get('errors'):
+        status = '  ERROR: %s' % ' / '.join(result['errors'][:2])
+    print "%-22s %8.2f s %9.1f MB/s  CPU %7.2f / %6.2f s  RSS %7d KB%s" % (
+        name, result['wall_time'], result['throughput'] / 1048576.0,
+        result['cpu_user'], result['cpu_system'], result['max_rss_kb'], status)
+    sys.stdout.flush()
+
+def compareResults(results, prev):
+    """Prints comparison of results with the results of a previous run.
+
+    @param results: Dictionary of results.
+    @param prev:    Dictionary of results of previous run.
+
+    """
+    print
+    print "Comparison with commit %s (%s)" % (prev.get('commit'),
+                                             prev.get('date'))
+    for param in ('size', 'entropy', 'parallel'):
+        if prev.get('params', {}).get(param) != results['params'][param]:
+            print "Warning: Different value for parameter %s: %s / %s" % (
+                param, prev.get('params', {}).get(param),
+                results['params'][param])
+    print "%-22s %10s %10s %8s %8s %8s" % ('scenario', 'prev MB/s', 'MB/s',
+                                           'speed', 'CPU', 'RSS')
+    for name in sorted(results['results'].keys()):
+        cur = results['results'][name]
+        old = prev.get('results', {}).get(name)
+        if old is None:
+            continue
+        cur_cpu = cur['cpu_user'] + cur['cpu_system']
+        old_cpu = old['cpu_user'] + old['cpu_system']
+        print "%-22s %10.1f %10.1f %+7.1f%% %+7.1f%% %+7.1f%%" % (
+            name, old['throughput'] / 1048576.0, cur['throughput'] / 1048576.0,
+            100.0 * (cur['throughput'] / old['throughput'] - 1),
+            100.0 * ((cur_cpu / old_cpu) - 1 if old_cpu else 0),
+            100.0 * (float(cur['max_rss_kb']) / old['max_rss_kb'] - 1
+                     if old['max_rss_kb'] else 0))
+
+def main(argv=None):
+    opts = parseCmdline(argv)
+    if opts.list:
+        for scenario in scenarioList:
+            print "%-22s %s" % (scenario[0], scenario[2])
+        print "%-22s %s" % ('jobmgr', 'all jobs, end to end')
+        return 0
+    results = runBench(opts)
+    output = opts.output
+    if output is None:
+        output = os.path.join(os.path.abspath(opts.workDir),
+                              "results-%s.json" % (results['commit'] or
+                                                   time.strftime('%Y%m%d%H%M%S')))
+    fp = open(output, 'w')
+    try:
+        json.dump(results, fp, indent=2, sort_keys=True)
+        fp.write("\n")
+    finally:
+        fp.close()
+    print
+    print "Results saved to: %s" % output
+    if opts.compare:
+        fp = open(opts.compare, 'r')
+        try:
+            prev = json.load(fp)
+        finally:
+            fp.close()
+        compareResults(results, prev)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
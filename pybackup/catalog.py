@@ -0,0 +1,531 @@
+"""pybackup - Catalog of backups.
+
+SQLite database with the backup runs, the jobs executed in each run, the backup
+files generated by the jobs with their sizes and checksums and the entries of
+the archive index files, for fast lookup of backups across runs. The catalog
+is updated by the Job Manager at the end of each run and is queried with the
+pybackup-catalog command.
+
+"""
+
+import sys
+import os
+import re
+import sqlite3
+import optparse
+from datetime import datetime
+from pybackup import errors
+from pybackup import utils
+from pybackup import fsutils
+
+__author__ = "Ali Onur Uyar"
+__copyright__ = "Copyright 2011, Ali Onur Uyar"
+__credits__ = []
+__license__ = "GPL"
+__version__ = "0.5"
+__maintainer__ = "Ali Onur Uyar"
+__email__ = "aouyar at gmail.com"
+__status__ = "Development"
+
+
+# Defaults
+catalogFilename = "catalog.sqlite"
+"""Filename for catalog database in state directory."""
+
+catalogSchema = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    hostname TEXT,
+    backup_path TEXT,
+    start_time TEXT,
+    end_time TEXT,
+    num_jobs INTEGER,
+    num_jobs_error INTEGER
+);
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY,
+    run_id INTEGER REFERENCES runs (id),
+    job_name TEXT,
+    method TEXT,
+    backup_date TEXT,
+    job_path TEXT,
+    status TEXT,
+    start_time TEXT,
+    wall_time REAL,
+    bytes_written INTEGER
+);
+CREATE INDEX IF NOT EXISTS jobs_name ON jobs (job_name, backup_date);
+CREATE INDEX IF NOT EXISTS jobs_path ON jobs (job_path);
+CREATE TABLE IF NOT EXISTS files (
+    id INTEGER PRIMARY KEY,
+    job_id INTEGER REFERENCES jobs (id),
+    path TEXT,
+    size INTEGER,
+    sha256 TEXT
+);
+CREATE INDEX IF NOT EXISTS files_job ON files (job_id);
+CREATE TABLE IF NOT EXISTS entries (
+    file_id INTEGER REFERENCES files (id),
+    path TEXT,
+    size INTEGER,
+    mtime INTEGER,
+    type TEXT
+);
+CREATE INDEX IF NOT EXISTS entries_path ON entries (path);
+CREATE INDEX IF NOT EXISTS entries_file ON entries (file_id);
+"""
+"""Schema of catalog database."""
+
+indexSuffixes = ('.index', '.list', '.recipe')
+"""Filename suffixes of index files whose entries are stored in the catalog.
+(Native archive index, tar / rsync file list, deduplication recipe.)"""
+
+
+def normPath(path):
+    """Normalizes path for lookup in catalog. The leading and trailing slashes
+    are removed, since tar strips leading slashes and marks directories with
+    trailing slashes.
+
+    @param path: Path.
+    @return:     Normalized path.
+
+    """
+    return path.strip('/')
+
+def readIndexEntries(path):
+    """Generator for the entries of index file.
+
+    @param path: Path for native archive index (.index), file list of tar or
+                 rsync (.list) or deduplication recipe (.recipe).
+    @return:     Yields tuples of (path, size, mtime, type). Size, mtime and
+                 type are None if they are not stored in the index.
+
+    """
+    if path.endswith('.recipe'):
+        # The chunk store and multiprocessing are only loaded for recipes.
+        from pybackup import chunkstore
+        (info, streams) = chunkstore.readRecipe(path) #@UnusedVariable
+        for (stream_path, size, digest, chunks) in streams: #@UnusedVariable
+            yield (stream_path, size, None, 'f')
+        return
+    fp = open(path, 'r')
+    try:
+        if path.endswith('.index'):
+            for line in fp:
+                entry = fsutils.parseIndexEntry(line)
+                if entry is not None:
+                    (offset, size, mtime, entry_type, entry_path) = entry #@UnusedVariable
+                    yield (entry_path, size, mtime, entry_type)
+        else:
+            # The file list of rsync is followed by an empty line and the
+            # transfer statistics.
+            for line in fp:
+                line = line.rstrip('\n')
+                if not line:
+                    break
+                if (line == 'sending incremental file list'
+                    or line.startswith('building file list')):
+                    continue
+                yield (line, None, None, None)
+    finally:
+        fp.close()
+
+
+class BackupCatalog:
+    """Class for updating and querying catalog database.
+
+    """
+
+    def __init__(self, path):
+        """Constructor
+
+        @param path: Path for catalog database. The database is created if it
+                     does not exist.
+
+        """
+        self._path = path
+        try:
+            catalog_dir = os.path.dirname(path)
+            if catalog_dir and not os.path.isdir(catalog_dir):
+                os.makedirs(catalog_dir)
+            self._conn = sqlite3.connect(path)
+            self._conn.text_factory = str
+            self._conn.execute("PRAGMA journal_mode = WAL")
+            self._conn.execute("PRAGMA synchronous = NORMAL")
+            self._conn.executescript(catalogSchema)
+        except (sqlite3.Error, OSError), e:
+            raise errors.BackupEnvironmentError("Opening of backup catalog "
+                                                "failed: %s" % path,
+                                                "Error Message: %s" % str(e))
+
+    def close(self):
+        """Closes catalog database.
+
+        """
+        self._conn.close()
+
+    def addRun(self, report):
+        """Adds backup run to catalog. The jobs are replaced if the catalog
+        already has entries for the job directories. (Repeated runs of jobs on
+        the same day.)
+
+        @param report: Dictionary with the report of the run generated by the
+                       Job Manager.
+        @return:       Number of index entries added.
+
+        """
+        num_entries = 0
+        try:
+            cur = self._conn.cursor()
+            cur.execute("INSERT INTO runs (hostname, backup_path, start_time, "
+                        "end_time, num_jobs, num_jobs_error) "
+                        "VALUES (?, ?, ?, ?, ?, ?)",
+                        (report.get('hostname'), report.get('backup_path'),
+                         report.get('start_time'), report.get('end_time'),
+                         report.get('num_jobs'), report.get('num_jobs_error')))
+            run_id = cur.lastrowid
+            for job in report.get('jobs', []):
+                if job.get('status') == 'disabled':
+                    continue
+                num_entries += self._addJob(cur, run_id, job)
+            self._conn.commit()
+        except:
+            self._conn.rollback()
+            raise
+        return num_entries
+
+    def _addJob(self, cur, run_id, job):
+        job_path = job['job_path']
+        self._removeJobs(cur, "job_path = ?", (job_path,))
+        cur.execute("INSERT INTO jobs (run_id, job_name, method, backup_date, "
+                    "job_path, status, start_time, wall_time, bytes_written) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (run_id, job['job'], job.get('method'),
+                     os.path.basename(os.path.dirname(job_path)), job_path,
+                     job.get('status'), job.get('start_time'),
+                     job.get('wall_time'), job.get('bytes_written')))
+        job_id = cur.lastrowid
+        num_entries = 0
+        for output in job.get('outputs', []):
+            cur.execute("INSERT INTO files (job_id, path, size, sha256) "
+                        "VALUES (?, ?, ?, ?)",
+                        (job_id, os.path.relpath(output['path'], job_path),
+                         output.get('size'), output.get('sha256')))
+            file_id = cur.lastrowid
+            if output['path'].endswith(indexSuffixes):
+                try:
+                    entries = [(file_id, normPath(path), size, mtime, entry_type)
+                               for (path, size, mtime, entry_type)
+                               in readIndexEntries(output['path'])]
+                except (EnvironmentError, ValueError):
+                    continue
+                cur.executemany("INSERT INTO entries (file_id, path, size, "
+                                "mtime, type) VALUES (?, ?, ?, ?, ?)", entries)
+                num_entries += len(entries)
+        return num_entries
+
+    def _removeJobs(self, cur, cond, params):
+        job_select = "SELECT id FROM jobs WHERE %s" % cond
+        file_select = "SELECT id FROM files WHERE job_id IN (%s)" % job_select
+        cur.execute("DELETE FROM entries WHERE file_id IN (%s)" % file_select,
+                    params)
+        cur.execute("DELETE FROM files WHERE job_id IN (%s)" % job_select,
+                    params)
+        cur.execute("DELETE FROM jobs WHERE %s" % cond, params)
+
+    def removePaths(self, paths):
+        """Removes the jobs stored in the directories from the catalog.
+        (Expired backups removed from backup root.)
+
+        @param paths: List of paths for dated backup directories or job
+                      directories.
+
+        """
+        try:
+            cur = self._conn.cursor()
+            for path in paths:
+                path = os.path.normpath(path)
+                self._removeJobs(cur, "job_path = ? OR (job_path >= ? AND "
+                                 "job_path < ?)",
+                                 (path, path + '/', path + '0'))
+            self._conn.commit()
+        except:
+            self._conn.rollback()
+            raise
+
+    def listRuns(self, limit=None):
+        """Returns the newest backup runs.
+
+        @param limit: Maximum number of runs.
+        @return:      List of (start_time, end_time, backup_path, num_jobs,
+                      num_jobs_error) tuples.
+
+        """
+        return self._conn.execute("SELECT start_time, end_time, backup_path, "
+                                  "num_jobs, num_jobs_error FROM runs "
+                                  "ORDER BY start_time DESC LIMIT ?",
+                                  (limit or -1,)).fetchall()
+
+    def listJobs(self, job_name=None, status=None, limit=None):
+        """Returns the newest backups of jobs.
+
+        @param job_name: Name of job. (All jobs by default.)
+        @param status:   Only backups with status if defined. (success, error)
+        @param limit:    Maximum number of backups.
+        @return:         List of (backup_date, job_name, status,
+                         bytes_written, job_path) tuples.
+
+        """
+        conds = []
+        params = []
+        if job_name is not None:
+            conds.append("job_name = ?")
+            params.append(job_name)
+        if status is not None:
+            conds.append("status = ?")
+            params.append(status)
+        query = ("SELECT backup_date, job_name, status, bytes_written, job_path "
+                 "FROM jobs")
+        if conds:
+            query += " WHERE %s" % " AND ".join(conds)
+        query += " ORDER BY backup_date DESC, start_time DESC LIMIT ?"
+        params.append(limit or -1)
+        return self._conn.execute(query, params).fetchall()
+
+    def getLatestFiles(self, job_name, pattern=None):
+        """Returns the backup files of the newest successful backup of job.
+
+        @param job_name: Name of job.
+        @param pattern:  Shell wildcard pattern for filenames of backup files.
+        @return:         List of (backup_date, path, size, sha256) tuples.
+
+        """
+        query = ("SELECT j.backup_date, j.job_path, f.path, f.size, f.sha256 "
+                 "FROM files f JOIN jobs j ON f.job_id = j.id "
+                 "WHERE j.id = (SELECT id FROM jobs WHERE job_name = ? AND "
+                 "status = 'success' ")
+        params = [job_name,]
+        if pattern is not None:
+            query += ("AND id IN (SELECT job_id FROM files WHERE path GLOB ?) ")
+            params.append(pattern)
+        query += "ORDER BY backup_date DESC, start_time DESC LIMIT 1)"
+        if pattern is not None:
+            query += " AND f.path GLOB ?"
+            params.append(pattern)
+        query += " ORDER BY f.path"
+        return [(backup_date, os.path.join(job_path, path), size, digest)
+                for (backup_date, job_path, path, size, digest)
+                in self._conn.execute(query, params)]
+
+    def findEntries(self, path, job_name=None, limit=None):
+        """Returns the backups containing path.
+
+        @param path:     Path or shell wildcard pattern for paths. Without
+                         wildcards the path and the paths below it are
+                         matched with a range lookup on the path index.
+                         Patterns are matched with GLOB, which uses the index
+                         only for the prefix before the first wildcard; a
+                         leading wildcard scans all entries.
+        @param job_name: Name of job. (All jobs by default.)
+        @param limit:    Maximum number of entries.
+        @return:         List of (backup_date, job_name, file_path,
+                         entry_path, size, mtime) tuples, newest first.
+
+        """
+        (query, params) = self._getFindQuery(path, job_name, limit)
+        return [(backup_date, name, os.path.join(job_path, file_path),
+                 entry_path, size, mtime)
+                for (backup_date, name, job_path, file_path, entry_path,
+                     size, mtime) in self._conn.execute(query, params)]
+
+    def _getFindQuery(self, path, job_name=None, limit=None):
+        path = normPath(path)
+        if re.search('[*?\[]', path):
+            conds = ["e.path GLOB ?"]
+            params = [path,]
+        else:
+            # The paths below path sort between path + '/' and path + '0',
+            # the character following '/'.
+            conds = ["(e.path = ? OR (e.path >= ? AND e.path < ?))"]
+            params = [path, path + '/', path + '0']
+        if job_name is not None:
+            conds.append("j.job_name = ?")
+            params.append(job_name)
+        params.append(limit or -1)
+        query = ("SELECT j.backup_date, j.job_name, j.job_path, f.path, "
+                 "e.path, e.size, e.mtime "
+                 "FROM entries e JOIN files f ON e.file_id = f.id "
+                 "JOIN jobs j ON f.job_id = j.id "
+                 "WHERE %s ORDER BY j.backup_date DESC, e.path "
+                 "LIMIT ?" % " AND ".join(conds))
+        return (query, params)
+
+
+def importBackups(catalog, backup_base, date_dirs):
+    """Adds existing backups to catalog. The sizes and checksums of backup
+    files are read from the checksum manifests of the jobs. (Backup files of
+    jobs without checksum manifest are added without checksum.)
+
+    @param catalog:     BackupCatalog instance.
+    @param backup_base: Base backup directory.
+    @param date_dirs:   List of dated backup directories.
+    @return:            Number of jobs added.
+
+    """
+    num_jobs = 0
+    for name in date_dirs:
+        date_path = os.path.join(backup_base, name)
+        jobs = []
+        for job_name in sorted(os.listdir(date_path)):
+            job_path = os.path.join(date_path, job_name)
+            if not os.path.isdir(job_path):
+                continue
+            manifest_path = os.path.join(job_path, fsutils.checksumManifestName)
+            if os.path.isfile(manifest_path):
+                outputs = [{'path': os.path.join(job_path, path),
+                            'sha256': digest, 'size': size}
+                           for (path, digest, size)
+                           in fsutils.readChecksumManifest(manifest_path)]
+            else:
+                outputs = []
+                for filename in sorted(os.listdir(job_path)):
+                    path = os.path.join(job_path, filename)
+                    if os.path.isfile(path):
+                        outputs.append({'path': path,
+                                        'size': os.path.getsize(path)})
+            jobs.append({'job': job_name, 'job_path': job_path,
+                         'status': 'success', 'outputs': outputs,
+                         'bytes_written': sum([output['size']
+                                               for output in outputs])})
+        catalog.addRun({'backup_path': date_path, 'num_jobs': len(jobs),
+                        'jobs': jobs})
+        num_jobs += len(jobs)
+    return num_jobs
+
+
+def parseCmdline(argv=None):
+    """Parses command line options of catalog query command.
+
+    @param argv: Simulated list of command line arguments can be passed
+                 explicitly for testing purposes. The arguments are obtained
+                 from the command line by default.
+    @return:     (opts, args) -> opts: Command line options.
+                                 args: List of command and arguments.
+
+    """
+    parser = optparse.OptionParser(usage="%prog [options] COMMAND [ARGS]\n\n"
+        "Commands:\n"
+        "  find PATH         Backups containing path. (Paths below directories"
+        " and\n"
+        "                    shell wildcard patterns are matched.)\n"
+        "  latest JOB [PAT]  Backup files of newest successful backup of job.\n"
+        "  jobs [JOB]        Newest backups of jobs.\n"
+        "  runs              Newest backup runs.\n"
+        "  import [DATES]    Add existing dated backup directories to "
+        "catalog.")
+    parser.add_option('-c', '--conf', help='Path for configuration file.',
+                      dest='confPath', default=None, action='store')
+    parser.add_option('-f', '--file', help='Path for catalog database.',
+                      dest='catalogPath', default=None, action='store')
+    parser.add_option('-j', '--job', help='Limit results to backup job.',
+                      dest='job', default=None, action='store')
+    parser.add_option('-n', '--limit', help='Maximum number of results. '
+                      '(Default: 100)', type='int',
+                      dest='limit', default=100, action='store')
+    if argv is None:
+        (opts, args) = parser.parse_args()
+    else:
+        (opts, args) = parser.parse_args(argv[1:])
+    if not args:
+        parser.error("No command given.")
+    return (opts, args)
+
+def _getCatalogPath(opts):
+    if opts.catalogPath is not None:
+        return (opts.catalogPath, None)
+    from pybackup.jobmgr import JobManager, defaultConfigPaths
+    if opts.confPath:
+        config_path = [opts.confPath,]
+    else:
+        config_path = defaultConfigPaths
+    jobmgr = JobManager({'config_path': config_path, 'help': 'catalog'}, None)
+    jobmgr.parseConfFile()
+    return (jobmgr.getCatalogPath(), jobmgr.getBackupBase())
+
+def _formatTime(mtime):
+    if mtime is None:
+        return '-'
+    return datetime.fromtimestamp(mtime).strftime('%Y-%m-%d %H:%M')
+
+def main(argv=None):
+    """Main block for catalog query command.
+
+    @param argv: Command line arguments to script. By default the arguments are
+                 obtained automatically from the command line. This variable
+                 exists only for testing purposes.
+    @return:     Integer return code for process.
+
+    """
+    (opts, args) = parseCmdline(argv)
+    cmd = args.pop(0)
+    try:
+        (catalog_path, backup_base) = _getCatalogPath(opts)
+        if cmd != 'import' and not os.path.isfile(catalog_path):
+            raise errors.BackupEnvironmentError("Backup catalog not found: %s"
+                                                % catalog_path)
+        catalog = BackupCatalog(catalog_path)
+        try:
+            if cmd == 'find' and len(args) == 1:
+                for (backup_date, job_name, file_path, entry_path, size,
+                     mtime) in catalog.findEntries(args[0], opts.job,
+                                                   opts.limit):
+                    print "%s  %-16s  %12s  %16s  %s  (%s)" % (
+                        backup_date, job_name, size is None and '-' or size,
+                        _formatTime(mtime), entry_path, file_path)
+            elif cmd == 'latest' and len(args) in (1, 2):
+                for (backup_date, path, size, digest) in catalog.getLatestFiles(
+                        args[0], (args[1:] or [None])[0]):
+                    print "%s  %12s  %s  %s" % (backup_date, size,
+                                                digest or '-', path)
+            elif cmd == 'jobs' and len(args) <= 1:
+                for (backup_date, job_name, status, size,
+                     job_path) in catalog.listJobs((args or [opts.job])[0],
+                                                   None, opts.limit):
+                    print "%s  %-16s  %-8s  %14s  %s" % (backup_date, job_name,
+                                                         status, size, job_path)
+            elif cmd == 'runs' and not args:
+                for (start_time, end_time, backup_path, num_jobs,
+                     num_jobs_error) in catalog.listRuns(opts.limit):
+                    print "%s  %s  jobs: %s  failed: %s  %s" % (
+                        start_time, end_time, num_jobs, num_jobs_error,
+                        backup_path)
+            elif cmd == 'import':
+                if backup_base is None:
+                    raise errors.BackupStartupError("The configuration file is "
+                                                    "required for import of "
+                                                    "backups.")
+                date_dirs = utils.getBackupDateDirs(backup_base)
+                if args:
+                    from pybackup import verify
+                    date_dirs = verify.parseDateRanges(args, date_dirs)
+                num_jobs = importBackups(catalog, backup_base, date_dirs)
+                print "Imported %d jobs from %d backup directories." % (
+                    num_jobs, len(date_dirs))
+            else:
+                raise errors.BackupStartupError("Invalid catalog command: %s"
+                                                % ' '.join([cmd,] + args))
+        finally:
+            catalog.close()
+    except errors.BackupError, e:
+        sys.stderr.write("%s\n" % e.desc)
+        for line in e:
+            sys.stderr.write("  %s\n" % line)
+        return 1
+    except sqlite3.Error, e:
+        sys.stderr.write("Query of backup catalog failed: %s\n" % str(e))
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
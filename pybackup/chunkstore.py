@@ -0,0 +1,606 @@
+"""pybackup - Deduplicating store for backup streams.
+
+The data streams are split in chunks at content-defined boundaries, so that an
+insertion or deletion only changes the chunks around the modification. The
+chunks are stored once by their SHA-256 hash in a shared repository and each
+backup is described by a recipe file that lists the chunks of each stream.
+
+Chunking, hashing, compression and storage of chunks are done in parallel by a
+pool of worker processes; the stream is split in segments that are processed
+independently, so chunk boundaries are also forced at segment boundaries.
+Processes running chunk stores in multiple threads start the shared pool
+(workerPool) before the threads, since forking while other threads hold locks
+may leave the workers deadlocked.
+
+The recipes written to a repository are registered in the repository, and the
+chunks that are not referenced by any of the registered recipes are removed by
+collectGarbage once the backups have been removed. Recipes are registered by
+path; recipes moved to another path no longer protect their chunks. Stores hold
+a shared lock on the repository, the collection holds an exclusive lock.
+
+"""
+
+import os
+import errno
+import fcntl
+import hashlib
+import zlib
+import multiprocessing
+from collections import deque
+from pybackup import errors
+from pybackup import fsutils
+
+__author__ = "Ali Onur Uyar"
+__copyright__ = "Copyright 2011, Ali Onur Uyar"
+__credits__ = []
+__license__ = "GPL"
+__version__ = "0.5"
+__maintainer__ = "Ali Onur Uyar"
+__email__ = "aouyar at gmail.com"
+__status__ = "Development"
+
+
+# Defaults
+defaultMinChunkSize = 262144
+"""Default minimum size of chunks in bytes."""
+
+defaultAvgChunkSize = 1048576
+"""Default average size of chunks in bytes. (Must be a power of 2.)"""
+
+defaultMaxChunkSize = 4194304
+"""Default maximum size of chunks in bytes."""
+
+defaultSegmentSize = 16777216
+"""Default size of stream segments processed by a worker in bytes."""
+
+recipeHeader = "# sha256\tsize"
+"""Header line for the chunk lists of recipe files."""
+
+boundaryPattern = '10101101100110000100011110100011'
+"""Bit pattern marking chunk boundaries. (The number of leading bits used is 
+chosen for the average chunk size.)"""
+
+# Maps bytes to bits, half of the byte values to each bit.
+_bitOnes = set(sorted(range(256), 
+                      key=lambda i: hashlib.md5(chr(i)).digest())[:128])
+_bitTable = ''.join(['01'[i in _bitOnes] for i in range(256)])
+
+repoLockName = 'lock'
+"""Name of lock file in chunk repositories."""
+
+repoRefsDir = 'refs'
+"""Name of directory for registered recipes in chunk repositories."""
+
+
+def checkChunkSizes(min_size, avg_size, max_size):
+    """Checks chunk size limits.
+
+    @param min_size: Minimum size of chunks in bytes.
+    @param avg_size: Average size of chunks in bytes.
+    @param max_size: Maximum size of chunks in bytes.
+
+    """
+    if not (len(boundaryPattern) <= min_size <= avg_size <= max_size
+            and avg_size < 1 << len(boundaryPattern)):
+        raise errors.BackupConfigError("Invalid chunk sizes (min: %d, avg: %d, "
+                                       "max: %d)." % (min_size, avg_size,
+                                                      max_size))
+    if avg_size & (avg_size - 1):
+        raise errors.BackupConfigError("The average chunk size must be a "
+                                       "power of 2: %d" % avg_size)
+
+def findChunkBoundaries(data, min_size, avg_size, max_size):
+    """Locates content-defined chunk boundaries. Each byte of the data is
+    mapped to one bit and a boundary is placed after the first occurrence of
+    the boundary pattern in the bits following the minimum size; the length
+    of the pattern is chosen for the average chunk size, so the boundaries
+    depend only on the last few bytes before them. The mapping and the search
+    are done by str.translate and str.find, which is an order of magnitude 
+    faster than rolling hashes computed byte by byte in Python.
+
+    @param data:     Data buffer.
+    @param min_size: Minimum size of chunks in bytes.
+    @param avg_size: Average size of chunks in bytes. (Must be a power of 2.)
+    @param max_size: Maximum size of chunks in bytes.
+    @return:         List of end offsets of chunks. The last offset is always
+                     the length of the buffer.
+
+    """
+    bits = avg_size.bit_length() - 1
+    pattern = boundaryPattern[:bits]
+    sig = data.translate(_bitTable)
+    data_len = len(sig)
+    bounds = []
+    start = 0
+    while start < data_len:
+        end = min(start + max_size, data_len)
+        cut = end
+        if end - start > min_size:
+            pos = sig.find(pattern, start + min_size - bits + 1, end)
+            if pos >= 0:
+                cut = pos + bits
+        bounds.append(cut)
+        start = cut
+    return bounds
+
+def getChunkPath(repo_path, digest):
+    """Returns the path of chunk in repository.
+
+    @param repo_path: Path for chunk repository.
+    @param digest:    SHA-256 hash of chunk in hexadecimal.
+    @return:          Path for chunk file.
+
+    """
+    return os.path.join(repo_path, 'chunks', digest[0:2], digest[2:4], digest)
+
+def storeChunk(repo_path, data, level=6):
+    """Stores chunk in repository compressed with zlib unless it is already
+    stored. The chunk file is created atomically.
+
+    @param repo_path: Path for chunk repository.
+    @param data:      Chunk data.
+    @param level:     Compression level.
+    @return:          Tuple of SHA-256 hash and number of stored bytes. (0 if
+                      the chunk was already stored.)
+
+    """
+    digest = hashlib.sha256(data).hexdigest()
+    chunk_path = getChunkPath(repo_path, digest)
+    if os.path.exists(chunk_path):
+        return (digest, 0)
+    chunk_dir = os.path.dirname(chunk_path)
+    try:
+        os.makedirs(chunk_dir)
+    except OSError, e:
+        if e.errno != errno.EEXIST:
+            raise
+    body = zlib.compress(data, level)
+    tmp_path = "%s.%d.tmp" % (chunk_path, os.getpid())
+    fp = open(tmp_path, 'wb')
+    try:
+        fp.write(body)
+    finally:
+        fp.close()
+    os.rename(tmp_path, chunk_path)
+    return (digest, len(body))
+
+def readChunk(repo_path, digest):
+    """Reads chunk from repository.
+
+    @param repo_path: Path for chunk repository.
+    @param digest:    SHA-256 hash of chunk in hexadecimal.
+    @return:          Chunk data.
+
+    """
+    fp = open(getChunkPath(repo_path, digest), 'rb')
+    try:
+        data = zlib.decompress(fp.read())
+    finally:
+        fp.close()
+    if hashlib.sha256(data).hexdigest() != digest:
+        raise errors.BackupError("Corrupted chunk in repository: %s" % digest)
+    return data
+
+def initRepo(repo_path):
+    """Creates chunk repository. The directory for registered recipes is only
+    created for new repositories, the chunks of repositories created by 
+    earlier versions are never collected.
+
+    @param repo_path: Path for chunk repository.
+
+    """
+    if not os.path.isdir(os.path.join(repo_path, 'chunks')):
+        for path in (os.path.join(repo_path, 'chunks'), 
+                     os.path.join(repo_path, repoRefsDir)):
+            try:
+                os.makedirs(path)
+            except OSError, e:
+                if e.errno != errno.EEXIST:
+                    raise
+
+def lockRepo(repo_path, exclusive=False, blocking=True):
+    """Locks chunk repository. The lock is released when the returned file 
+    object is closed.
+
+    @param repo_path: Path for chunk repository.
+    @param exclusive: Exclusive lock if True, shared lock otherwise.
+    @param blocking:  Wait for the lock if True.
+    @return:          File object or None if the repository is locked and 
+                      blocking is False.
+
+    """
+    fp = open(os.path.join(repo_path, repoLockName), 'a')
+    flags = exclusive and fcntl.LOCK_EX or fcntl.LOCK_SH
+    if not blocking:
+        flags |= fcntl.LOCK_NB
+    try:
+        fcntl.flock(fp.fileno(), flags)
+    except IOError, e:
+        fp.close()
+        if e.errno in (errno.EAGAIN, errno.EACCES):
+            return None
+        raise
+    return fp
+
+def registerRecipe(repo_path, recipe_path):
+    """Registers recipe file as reference for the chunks in the repository.
+    The recipe must be registered while the repository is locked, before the 
+    recipe is created at recipe_path.
+
+    @param repo_path:   Path for chunk repository.
+    @param recipe_path: Path for recipe file.
+
+    """
+    refs_dir = os.path.join(repo_path, repoRefsDir)
+    if not os.path.isdir(refs_dir):
+        return
+    recipe_path = os.path.abspath(recipe_path)
+    ref_path = os.path.join(refs_dir, hashlib.sha1(recipe_path).hexdigest())
+    fp = open(ref_path, 'w')
+    try:
+        fp.write("%s\n" % recipe_path)
+    finally:
+        fp.close()
+
+def collectGarbage(repo_path, dry_run=False):
+    """Removes the chunks that are not referenced by any of the recipes 
+    registered in the repository. The registrations of removed recipes are 
+    removed. Nothing is removed if any of the registered recipes cannot be 
+    read.
+
+    @param repo_path: Path for chunk repository.
+    @param dry_run:   Only count the unreferenced chunks if True.
+    @return:          Tuple of number of removed chunks and removed bytes or 
+                      None if the repository is locked by a running backup or
+                      was created by an earlier version.
+
+    """
+    refs_dir = os.path.join(repo_path, repoRefsDir)
+    if not os.path.isdir(refs_dir):
+        return None
+    lock_fp = lockRepo(repo_path, exclusive=True, blocking=False)
+    if lock_fp is None:
+        return None
+    try:
+        referenced = set()
+        stale_refs = []
+        for ref_name in os.listdir(refs_dir):
+            ref_path = os.path.join(refs_dir, ref_name)
+            fp = open(ref_path, 'r')
+            try:
+                recipe_path = fp.read().rstrip('\n')
+            finally:
+                fp.close()
+            if not os.path.exists(recipe_path):
+                stale_refs.append(ref_path)
+                continue
+            try:
+                (info, streams) = readRecipe(recipe_path) #@UnusedVariable
+            except (EnvironmentError, ValueError), e:
+                raise errors.BackupError("Reading of recipe failed, chunks of "
+                                         "repository %s are not collected: %s"
+                                         % (repo_path, recipe_path),
+                                         "Error Message: %s" % str(e))
+            for (path, size, digest, chunks) in streams: #@UnusedVariable
+                referenced.update([chunk[0] for chunk in chunks])
+        num_removed = 0
+        bytes_removed = 0
+        chunks_dir = os.path.join(repo_path, 'chunks')
+        # Temporary files left by interrupted stores are removed too.
+        for (dirpath, dirnames, filenames) in os.walk(chunks_dir): #@UnusedVariable
+            for filename in filenames:
+                if filename in referenced:
+                    continue
+                path = os.path.join(dirpath, filename)
+                bytes_removed += os.lstat(path).st_size
+                num_removed += 1
+                if not dry_run:
+                    os.unlink(path)
+        if not dry_run:
+            for ref_path in stale_refs:
+                os.unlink(ref_path)
+        return (num_removed, bytes_removed)
+    finally:
+        lock_fp.close()
+
+def _storeSegment(repo_path, data, min_size, avg_size, max_size, level):
+    """Splits segment of stream in chunks and stores them in the repository.
+    Executed by the worker processes.
+
+    @return: Tuple of list of (hash, size) tuples for chunks, number of new
+             chunks and number of stored bytes.
+
+    """
+    chunks = []
+    num_new = 0
+    bytes_stored = 0
+    start = 0
+    for end in findChunkBoundaries(data, min_size, avg_size, max_size):
+        (digest, stored) = storeChunk(repo_path, data[start:end], level)
+        chunks.append((digest, end - start))
+        if stored:
+            num_new += 1
+            bytes_stored += stored
+        start = end
+    return (chunks, num_new, bytes_stored)
+
+def readRecipe(path):
+    """Reads recipe file.
+
+    @param path: Path for recipe file.
+    @return:     Tuple of (info, streams), where info is the dictionary of
+                 informational values in the header and streams is the list of
+                 (path, size, sha256, chunks) tuples, where chunks is the list
+                 of (hash, size) tuples.
+
+    """
+    info = {}
+    streams = []
+    chunks = None
+    fp = open(path, 'r')
+    try:
+        for line in fp:
+            line = line.rstrip('\n')
+            if line.startswith('## '):
+                (key, sep, val) = line[3:].partition(': ') #@UnusedVariable
+                info[key] = val
+            elif line.startswith('@ '):
+                (size, digest, stream_path) = line[2:].split(' ', 2)
+                chunks = []
+                streams.append((fsutils.unescapePath(stream_path), int(size),
+                                digest, chunks))
+            elif line and not line.startswith('#'):
+                (digest, size) = line.split('\t')
+                chunks.append((digest, int(size)))
+    finally:
+        fp.close()
+    return (info, streams)
+
+def restoreStream(repo_path, chunks, out):
+    """Restores stream from chunks in repository.
+
+    @param repo_path: Path for chunk repository.
+    @param chunks:    List of (hash, size) tuples for chunks from recipe file.
+    @param out:       Output file object. (Must implement write method.)
+    @return:          SHA-256 hash of the restored stream in hexadecimal.
+
+    """
+    stream_hash = hashlib.sha256()
+    for (digest, size) in chunks:
+        data = readChunk(repo_path, digest)
+        if len(data) != size:
+            raise errors.BackupError("Size mismatch for chunk in repository: "
+                                     "%s" % digest)
+        stream_hash.update(data)
+        out.write(data)
+    return stream_hash.hexdigest()
+
+
+
+class WorkerPool:
+    """Pool of worker processes shared by the chunk stores of the process.
+
+    """
+
+    def __init__(self):
+        """Constructor
+
+        """
+        self._pool = None
+
+    def start(self, num_workers=None):
+        """Starts the worker processes. Must be called before the threads
+        using the pool are started.
+
+        @param num_workers: Number of worker processes. (Defaults to the
+                            number of CPUs.)
+        @return:            True if the pool was started, False if the pool
+                            is already running.
+
+        """
+        if self._pool is not None:
+            return False
+        self._pool = multiprocessing.Pool(num_workers
+                                          or multiprocessing.cpu_count())
+        return True
+
+    def stop(self):
+        """Stops the worker processes once the pending segments are stored.
+
+        """
+        pool = self._pool
+        if pool is not None:
+            self._pool = None
+            pool.close()
+            pool.join()
+
+    def get(self):
+        """Returns the running pool.
+
+        @return: multiprocessing.Pool instance or None.
+
+        """
+        return self._pool
+
+
+class ChunkStore:
+    """Stores streams in a deduplicating chunk repository using a pool of
+    worker processes and writes the recipe for the streams.
+
+    The streams are written to the recipe file in the order they are opened.
+    The number of segments in flight is bounded, so memory usage is limited to
+    a few segments per worker. The shared pool of workerPool is used if it is
+    running, otherwise the store starts its own pool.
+
+    """
+
+    def __init__(self, repo_path, recipe_fp, num_workers=None,
+                 min_size=None, avg_size=None, max_size=None,
+                 segment_size=None, level=6):
+        """Constructor
+
+        @param repo_path:    Path for chunk repository.
+        @param recipe_fp:    File object for recipe file.
+        @param num_workers:  Number of worker processes. (Defaults to the
+                             number of CPUs.)
+        @param min_size:     Minimum size of chunks in bytes.
+        @param avg_size:     Average size of chunks in bytes.
+        @param max_size:     Maximum size of chunks in bytes.
+        @param segment_size: Size of stream segments processed by a worker.
+        @param level:        Compression level for chunks.
+
+        """
+        self._repoPath = repo_path
+        self._recipe = recipe_fp
+        self._numWorkers = num_workers or multiprocessing.cpu_count()
+        self._minSize = min_size or defaultMinChunkSize
+        self._avgSize = avg_size or defaultAvgChunkSize
+        self._maxSize = max_size or defaultMaxChunkSize
+        self._segmentSize = max(segment_size or defaultSegmentSize,
+                                self._maxSize)
+        self._level = level
+        checkChunkSizes(self._minSize, self._avgSize, self._maxSize)
+        self._pending = deque()
+        self._chunkLines = []
+        self._pool = workerPool.get()
+        self._ownPool = self._pool is None
+        if self._ownPool:
+            self._pool = multiprocessing.Pool(self._numWorkers)
+        self._closed = False
+        self.bytesIn = 0
+        self.bytesStored = 0
+        self.numChunks = 0
+        self.numNewChunks = 0
+        self._recipe.write("## chunker: pattern %d %d %d\n" 
+                           % (self._minSize, self._avgSize, self._maxSize))
+        self._recipe.write(recipeHeader + "\n")
+
+    def openStream(self, path):
+        """Returns file object for writing stream to the store.
+
+        @param path: Path or name of the stream in the recipe.
+        @return:     ChunkStream instance.
+
+        """
+        return ChunkStream(self, path, self._segmentSize)
+
+    def _submit(self, data):
+        result = self._pool.apply_async(_storeSegment,
+                                        (self._repoPath, data, self._minSize,
+                                         self._avgSize, self._maxSize,
+                                         self._level))
+        self._pending.append(('segment', result))
+        self.bytesIn += len(data)
+        while len(self._pending) > 2 * self._numWorkers:
+            self._drain()
+
+    def _endStream(self, path, size, digest):
+        self._pending.append(('end', (path, size, digest)))
+
+    def _drain(self):
+        (kind, item) = self._pending.popleft()
+        if kind == 'segment':
+            try:
+                (chunks, num_new, bytes_stored) = item.get()
+            except EnvironmentError, e:
+                raise errors.BackupError("Storage of chunks in repository "
+                                         "failed.",
+                                         "Error Message: %s" % str(e))
+            for (digest, size) in chunks:
+                self._chunkLines.append("%s\t%d\n" % (digest, size))
+            self.numChunks += len(chunks)
+            self.numNewChunks += num_new
+            self.bytesStored += bytes_stored
+        else:
+            (path, size, digest) = item
+            self._recipe.write("@ %d %s %s\n" % (size, digest,
+                                                  fsutils.escapePath(path)))
+            self._recipe.write(''.join(self._chunkLines))
+            self._chunkLines = []
+
+    def close(self):
+        """Writes out all pending streams and stops the worker processes. The
+        recipe file is not closed.
+
+        """
+        if self._closed:
+            return
+        try:
+            while self._pending:
+                self._drain()
+            if self._ownPool:
+                self._pool.close()
+        finally:
+            self._closed = True
+            if self._ownPool:
+                self._pool.terminate()
+                self._pool.join()
+
+    def abort(self):
+        """Stops the worker processes discarding pending streams.
+
+        """
+        self._closed = True
+        self._pending.clear()
+        if self._ownPool:
+            self._pool.terminate()
+            self._pool.join()
+
+
+class ChunkStream:
+    """File object for writing a stream to ChunkStore.
+
+    """
+
+    def __init__(self, store, path, segment_size):
+        """Constructor
+
+        @param store:        ChunkStore instance.
+        @param path:         Path or name of the stream in the recipe.
+        @param segment_size: Size of stream segments processed by a worker.
+
+        """
+        self._store = store
+        self._path = path
+        self._segmentSize = segment_size
+        self._buf = []
+        self._bufLen = 0
+        self._hash = hashlib.sha256()
+        self._closed = False
+        self.size = 0
+
+    def write(self, data):
+        """Writes data to stream.
+
+        @param data: Data.
+
+        """
+        self._hash.update(data)
+        self.size += len(data)
+        self._buf.append(data)
+        self._bufLen += len(data)
+        if self._bufLen >= self._segmentSize:
+            buf = ''.join(self._buf)
+            pos = 0
+            while len(buf) - pos >= self._segmentSize:
+                self._store._submit(buf[pos:pos + self._segmentSize])
+                pos += self._segmentSize
+            self._buf = [buf[pos:]]
+            self._bufLen = len(buf) - pos
+
+    def close(self):
+        """Submits the remaining data and closes the stream in the recipe.
+
+        """
+        if self._closed:
+            return
+        self._closed = True
+        if self._bufLen > 0:
+            self._store._submit(''.join(self._buf))
+            self._buf = []
+            self._bufLen = 0
+        self._store._endStream(self._path, self.size, self._hash.hexdigest())
+
+
+workerPool = WorkerPool()
+"""Pool of worker processes shared by the chunk stores of the process."""
@@ -0,0 +1,260 @@
+"""pybackup - Multi-threaded block compression of backup streams.
+
+The data stream is split in blocks that are compressed in parallel by a pool
+of worker threads. Each block is written out as an independent member (gzip)
+or stream (bzip2, xz), the concatenated output can be decompressed with the
+standard command line tools (gzip -d, bzip2 -d, xz -d).
+
+"""
+
+import os
+import sys
+import time
+import struct
+import zlib
+import bz2
+import threading
+import Queue
+from collections import deque
+from pybackup import errors
+
+try:
+    import lzma
+except ImportError:
+    try:
+        from backports import lzma
+    except ImportError:
+        lzma = None
+
+
+__author__ = "Ali Onur Uyar"
+__copyright__ = "Copyright 2011, Ali Onur Uyar"
+__credits__ = []
+__license__ = "GPL"
+__version__ = "0.5"
+__maintainer__ = "Ali Onur Uyar"
+__email__ = "aouyar at gmail.com"
+__status__ = "Development"
+
+
+# Defaults
+defaultBlockSize = 1048576
+"""Default size of uncompressed blocks in bytes."""
+
+codecList = ('zlib', 'bz2', 'lzma')
+"""List of supported compression codecs."""
+
+codecSuffix = {'zlib': 'gz', 'bz2': 'bz2', 'lzma': 'xz'}
+"""Dictionary mapping codecs to filename suffixes for compressed files."""
+
+codecDefaultLevel = {'zlib': 6, 'bz2': 9, 'lzma': 6}
+"""Dictionary mapping codecs to default compression levels."""
+
+
+def getNumCPUs():
+    """Returns the number of online CPUs.
+
+    @return: Number of CPUs.
+
+    """
+    try:
+        return max(1, os.sysconf('SC_NPROCESSORS_ONLN'))
+    except (AttributeError, ValueError, OSError):
+        return 1
+
+def compressGzipMember(data, level):
+    """Compresses data block as a standalone gzip member.
+
+    @param data:  Uncompressed data.
+    @param level: Compression level. (1-9)
+    @return:      Compressed data.
+
+    """
+    comp = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+    body = comp.compress(data) + comp.flush()
+    if level == 9:
+        xfl = '\x02'
+    elif level == 1:
+        xfl = '\x04'
+    else:
+        xfl = '\x00'
+    header = '\x1f\x8b\x08\x00%s%s\x03' % (struct.pack('<I', int(time.time())),
+                                           xfl)
+    trailer = struct.pack('<II', zlib.crc32(data) & 0xffffffffL,
+                          len(data) & 0xffffffffL)
+    return header + body + trailer
+
+def compressBz2Stream(data, level):
+    """Compresses data block as a standalone bzip2 stream.
+
+    @param data:  Uncompressed data.
+    @param level: Compression level. (1-9)
+    @return:      Compressed data.
+
+    """
+    return bz2.compress(data, level)
+
+def compressXzStream(data, level):
+    """Compresses data block as a standalone xz stream.
+
+    @param data:  Uncompressed data.
+    @param level: Compression preset. (0-9)
+    @return:      Compressed data.
+
+    """
+    return lzma.compress(data, preset=level)
+
+codecFuncs = {'zlib': compressGzipMember,
+              'bz2': compressBz2Stream,
+              'lzma': compressXzStream}
+"""Dictionary mapping codecs to block compression functions."""
+
+
+def checkCodec(codec, level=None):
+    """Checks codec and compression level.
+
+    @param codec: Compression codec. (zlib, bz2 or lzma)
+    @param level: Compression level. The default level for the codec is
+                  returned if None.
+    @return:      Compression level.
+
+    """
+    if codec not in codecList:
+        raise errors.BackupConfigError("Invalid compression codec: %s" % codec)
+    if codec == 'lzma' and lzma is None:
+        raise errors.BackupConfigError("Compression codec lzma requires the "
+                                       "lzma module (backports.lzma).")
+    if level is None:
+        return codecDefaultLevel[codec]
+    try:
+        level = int(level)
+    except ValueError:
+        level = -1
+    if not 0 <= level <= 9 or (level == 0 and codec != 'lzma'):
+        raise errors.BackupConfigError("Invalid compression level for codec "
+                                       "%s: %s" % (codec, level))
+    return level
+
+
+
+class _Block:
+    """Block of data queued for compression.
+
+    """
+
+    def __init__(self, data):
+        self.data = data
+        self.result = None
+        self.error = None
+        self.done = threading.Event()
+
+
+class BlockCompressor:
+    """Compresses data stream in blocks using a pool of worker threads.
+
+    The compressed blocks are written to the output in the original order. The
+    number of blocks in flight is bounded, so memory usage is limited to a few
+    blocks per thread.
+
+    """
+
+    def __init__(self, out, codec='zlib', level=None, num_threads=None,
+                 block_size=None):
+        """Constructor
+
+        @param out:         Output file object. (Must implement write method.)
+        @param codec:       Compression codec. (zlib, bz2 or lzma)
+        @param level:       Compression level. (Default level of codec if None.)
+        @param num_threads: Number of compression threads. (Defaults to the
+                            number of CPUs.)
+        @param block_size:  Size of uncompressed blocks in bytes.
+
+        """
+        self._out = out
+        self._level = checkCodec(codec, level)
+        self._func = codecFuncs[codec]
+        self._numThreads = num_threads or getNumCPUs()
+        self._blockSize = block_size or defaultBlockSize
+        self._buf = []
+        self._bufLen = 0
+        self._numBlocks = 0
+        self._pending = deque()
+        self._queue = Queue.Queue()
+        self._threads = []
+        self._closed = False
+        self.bytesIn = 0
+        self.bytesOut = 0
+        for i in range(self._numThreads):
+            thread = threading.Thread(target=self._worker,
+                                      name="compress-%d" % i)
+            thread.setDaemon(True)
+            thread.start()
+            self._threads.append(thread)
+
+    def _worker(self):
+        while True:
+            block = self._queue.get()
+            if block is None:
+                return
+            try:
+                block.result = self._func(block.data, self._level)
+            except:
+                block.error = sys.exc_info()[1]
+            block.data = None
+            block.done.set()
+
+    def _submit(self, data):
+        block = _Block(data)
+        self._pending.append(block)
+        self._queue.put(block)
+        self._numBlocks += 1
+        while len(self._pending) > 2 * self._numThreads:
+            self._writeBlock()
+
+    def _writeBlock(self):
+        block = self._pending.popleft()
+        block.done.wait()
+        if block.error is not None:
+            raise errors.BackupError("Compression of backup failed.",
+                                     "Error Message: %s" % str(block.error))
+        self._out.write(block.result)
+        self.bytesOut += len(block.result)
+
+    def write(self, data):
+        """Writes data to compression stream.
+
+        @param data: Uncompressed data.
+
+        """
+        self.bytesIn += len(data)
+        self._buf.append(data)
+        self._bufLen += len(data)
+        if self._bufLen >= self._blockSize:
+            buf = ''.join(self._buf)
+            pos = 0
+            while len(buf) - pos >= self._blockSize:
+                self._submit(buf[pos:pos + self._blockSize])
+                pos += self._blockSize
+            self._buf = [buf[pos:]]
+            self._bufLen = len(buf) - pos
+
+    def close(self):
+        """Compresses the remaining data, writes out all pending blocks and
+        stops the worker threads. The output file is not closed.
+
+        """
+        if self._closed:
+            return
+        try:
+            if self._bufLen > 0 or self._numBlocks == 0:
+                self._submit(''.join(self._buf))
+                self._buf = []
+                self._bufLen = 0
+            while self._pending:
+                self._writeBlock()
+        finally:
+            self._closed = True
+            for thread in self._threads: #@UnusedVariable
+                self._queue.put(None)
+            for thread in self._threads:
+                thread.join()
@@ -0,0 +1,255 @@
+"""pybackup - Reading and caching of configuration files.
+
+The sections of the configuration files are read into dictionaries of general
+options, plugins and jobs. The configuration files in the directory defined by
+the include_dir general option are parsed separately and the parsed sections
+of unchanged files are taken from a file cache, so only new and modified files
+are parsed. Long-running processes keep the parsed configuration in a ConfCache
+and read the files again only when they change.
+
+"""
+
+import os
+import glob
+import threading
+import ConfigParser
+from pybackup import errors
+from pybackup.logmgr import logger
+
+__author__ = "Ali Onur Uyar"
+__copyright__ = "Copyright 2011, Ali Onur Uyar"
+__credits__ = []
+__license__ = "GPL"
+__version__ = "0.5"
+__maintainer__ = "Ali Onur Uyar"
+__email__ = "aouyar at gmail.com"
+__status__ = "Development"
+
+
+includePattern = '*.conf'
+"""Pattern for configuration files in include directories."""
+
+
+def encodeStrings(obj, encoding='utf-8'):
+    """Converts the unicode strings in data loaded from JSON to byte strings,
+    so cached sections are the same as the sections of parsed files.
+
+    @param obj:      Data loaded from JSON.
+    @param encoding: Encoding of byte strings.
+    @return:         Data with byte strings.
+
+    """
+    if isinstance(obj, unicode):
+        return obj.encode(encoding)
+    elif isinstance(obj, dict):
+        return dict([(encodeStrings(key, encoding),
+                      encodeStrings(val, encoding))
+                     for (key, val) in obj.items()])
+    elif isinstance(obj, list):
+        return [encodeStrings(item, encoding) for item in obj]
+    return obj
+
+def getFileStamps(paths):
+    """Returns the modification times and sizes of files.
+
+    @param paths: List of paths for files.
+    @return:      List of [path, mtime, size] lists. Mtime and size are None
+                  for missing files.
+
+    """
+    stamps = []
+    for path in paths:
+        try:
+            st = os.stat(path)
+            stamps.append([path, st.st_mtime, st.st_size])
+        except OSError:
+            stamps.append([path, None, None])
+    return stamps
+
+def getIncludePaths(general, base_dir):
+    """Returns the configuration files in the include directories defined by
+    the include_dir general option, sorted by name within each directory.
+
+    @param general:  Dictionary of general options.
+    @param base_dir: Base directory for relative include directories.
+    @return:         List of paths.
+
+    """
+    paths = []
+    for include_dir in general.get('include_dir', '').split():
+        include_dir = os.path.join(base_dir, include_dir)
+        paths.extend(sorted(glob.glob(os.path.join(include_dir,
+                                                   includePattern))))
+    return paths
+
+def parseFile(path):
+    """Parses configuration file.
+
+    @param path: Path for configuration file.
+    @return:     Dictionary mapping section names to dictionaries of options.
+
+    """
+    confmgr = ConfigParser.SafeConfigParser()
+    try:
+        if not confmgr.read([path]):
+            raise errors.BackupFatalConfigError("Reading of configuration "
+                                                "file failed: %s" % path)
+        sections = {}
+        for section in confmgr.sections():
+            sections[section] = dict(confmgr.items(section))
+    except ConfigParser.Error, e:
+        raise errors.BackupFatalConfigError("Parsing of configuration file "
+                                            "failed.",
+                                            "Error Message: %s" % str(e))
+    return sections
+
+def readConfFile(config_path, file_cache_func=None):
+    """Reads the configuration files. All existing files in the list are read,
+    options in later files override options in earlier files. The files in the
+    include directories are read next; the general section can only be defined
+    in the main configuration files.
+
+    @param config_path:     List of paths for configuration files.
+    @param file_cache_func: Function returning the file cache for the general
+                            options of the main configuration files. The file
+                            cache is a dictionary mapping paths of included
+                            files to dictionaries with the entries stamp
+                            ([mtime, size]) and sections; it is updated with
+                            the parsed files. (No caching by default.)
+    @return:                Dictionary with the entries paths (list of files
+                            read), stamps (list of [path, mtime, size] for
+                            the main and the included files), general
+                            (dictionary of general options), plugins
+                            (dictionary mapping plugin names to modules), jobs
+                            (dictionary mapping job names to dictionaries of
+                            job options), sources (dictionary mapping job
+                            names to files defining the job), validated
+                            (dictionary for caching validation results of
+                            jobs) and cache_changed (True if the file cache
+                            was updated).
+
+    """
+    stamps = getFileStamps(config_path)
+    confmgr = ConfigParser.SafeConfigParser()
+    try:
+        read_paths = confmgr.read(config_path)
+    except ConfigParser.Error, e:
+        raise errors.BackupFatalConfigError("Parsing of configuration file "
+                                            "failed.",
+                                            "Error Message: %s" % str(e))
+    if not read_paths:
+        raise errors.BackupFatalConfigError("Configuration file not found in any"
+                                            " of the following locations: %s"
+                                            % ' '.join(config_path))
+    logger.debug("Parsing configuration file: %s" % ', '. join(read_paths))
+    if not confmgr.has_section('general'):
+        raise errors.BackupFatalConfigError("Missing mandatory section 'general' "
+                                            "in configuration file(s): %s"
+                                            % ' '.join(read_paths))
+    conf = {'paths': list(read_paths), 'stamps': stamps,
+            'general': {}, 'plugins': {}, 'jobs': {}, 'sources': {},
+            'validated': {}, 'cache_changed': False}
+    for section in confmgr.sections():
+        if section == 'general':
+            conf['general'] = dict(confmgr.items('general'))
+        elif section == 'plugins':
+            conf['plugins'] = dict(confmgr.items('plugins'))
+        else:
+            conf['jobs'][section] = dict(confmgr.items(section))
+            conf['sources'][section] = list(read_paths)
+    if not conf['general'].get('include_dir'):
+        return conf
+    include_paths = getIncludePaths(conf['general'],
+                                    os.path.dirname(read_paths[0]))
+    if file_cache_func is not None:
+        file_cache = file_cache_func(conf['general'])
+    else:
+        file_cache = {}
+    num_parsed = 0
+    for stamp in getFileStamps(include_paths):
+        path = stamp[0]
+        entry = file_cache.get(path)
+        if entry is None or entry.get('stamp') != stamp[1:]:
+            entry = {'stamp': stamp[1:], 'sections': parseFile(path)}
+            file_cache[path] = entry
+            conf['cache_changed'] = True
+            num_parsed += 1
+        conf['paths'].append(path)
+        stamps.append(stamp)
+        for (section, options) in entry['sections'].items():
+            if section == 'general':
+                raise errors.BackupFatalConfigError("Section 'general' is not "
+                                                    "allowed in included "
+                                                    "configuration file: %s"
+                                                    % path)
+            elif section == 'plugins':
+                conf['plugins'].update(options)
+            else:
+                conf['jobs'].setdefault(section, {}).update(options)
+                conf['sources'].setdefault(section, []).append(path)
+    include_set = set(include_paths)
+    for path in file_cache.keys():
+        if path not in include_set:
+            del file_cache[path]
+            conf['cache_changed'] = True
+    logger.debug("Read %d included configuration files, parsed %d changed "
+                 "files.", len(include_paths), num_parsed)
+    return conf
+
+
+class ConfCache:
+    """Parsed configuration of a long-running process. The configuration files
+    are read again when any of the main or included files is created, modified
+    or removed; only the changed included files are parsed again.
+
+    """
+
+    def __init__(self, config_path, file_cache=None):
+        """Constructor
+
+        @param config_path: List of paths for configuration files.
+        @param file_cache:  Initial file cache of parsed included files.
+
+        """
+        self._configPath = config_path
+        self._stamps = None
+        self._conf = None
+        self._fileCache = dict(file_cache or {})
+        self._lock = threading.Lock()
+
+    def invalidate(self):
+        """Forces reading of the configuration files on next access.
+
+        """
+        self._lock.acquire()
+        try:
+            self._stamps = None
+        finally:
+            self._lock.release()
+
+    def get(self):
+        """Returns the parsed configuration, reading the configuration files if
+        they have changed since the last call.
+
+        @return: Tuple of (configuration dictionary returned by readConfFile,
+                 True if the files were read again).
+
+        """
+        self._lock.acquire()
+        try:
+            paths = list(self._configPath)
+            if self._conf is not None:
+                paths.extend(getIncludePaths(self._conf['general'],
+                                 os.path.dirname(self._conf['paths'][0])))
+            stamps = getFileStamps(paths)
+            if self._conf is not None and stamps == self._stamps:
+                return (self._conf, False)
+            # Invalid files are not read again until they change.
+            self._stamps = stamps
+            conf = readConfFile(self._configPath,
+                                lambda general: self._fileCache)
+            self._conf = conf
+            self._stamps = conf['stamps']
+            return (conf, True)
+        finally:
+            self._lock.release()
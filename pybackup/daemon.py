@@ -0,0 +1,514 @@
+"""pybackup - Scheduler daemon for backup jobs.
+
+The daemon keeps the backup plugins loaded and the parsed configuration
+cached between runs. Jobs with a schedule job option are run on their
+cron-style schedules and runs of jobs can be requested at any time through a
+local Unix socket. Runs are executed one at a time in the order in which they
+are requested; jobs that are already queued or running are not queued again.
+
+Requests and replies are single lines of JSON:
+    {"command": "run", "jobs": ["job1", "job2"], "dry_run": false}
+    {"command": "status"}
+    {"command": "reload"}
+
+"""
+
+import os
+import time
+import json
+import errno
+import select
+import signal
+import socket
+import logging
+import threading
+from datetime import datetime, timedelta
+from pybackup import errors
+from pybackup import config
+from pybackup import schedule
+from pybackup.logmgr import logger, logmgr
+
+__author__ = "Ali Onur Uyar"
+__copyright__ = "Copyright 2011, Ali Onur Uyar"
+__credits__ = []
+__license__ = "GPL"
+__version__ = "0.5"
+__maintainer__ = "Ali Onur Uyar"
+__email__ = "aouyar at gmail.com"
+__status__ = "Development"
+
+
+# Defaults
+defaultSocketName = 'pybackup.sock'
+"""Filename for the Unix socket of the daemon in the state directory."""
+
+socketTimeout = 30
+"""Timeout in seconds for requests through the Unix socket."""
+
+maxRequestSize = 65536
+"""Maximum size of requests in bytes."""
+
+
+def logError(e, msg=None):
+    """Logs backup error with the detail lines.
+
+    @param e:   BackupError exception.
+    @param msg: Optional message logged before the error.
+
+    """
+    if e.fatal:
+        level = logging.CRITICAL
+    else:
+        level = logging.ERROR
+    if msg is not None:
+        logger.log(level, msg)
+    logger.log(level, e.desc)
+    for line in e:
+        logger.log(level, "  %s", line)
+
+def readLine(conn):
+    """Reads a line from socket connection.
+
+    @param conn: Socket object.
+    @return:     Line without newline.
+
+    """
+    buf = []
+    size = 0
+    while True:
+        data = conn.recv(4096)
+        if not data:
+            break
+        buf.append(data)
+        size += len(data)
+        if '\n' in data or size > maxRequestSize:
+            break
+    return ''.join(buf).split('\n', 1)[0]
+
+def submitRequest(socket_path, request):
+    """Sends request to the daemon through the Unix socket.
+
+    @param socket_path: Path for Unix socket of the daemon.
+    @param request:     Dictionary with the command and its arguments.
+    @return:            Dictionary of reply.
+
+    """
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(socketTimeout)
+    try:
+        try:
+            sock.connect(socket_path)
+            sock.sendall(json.dumps(request) + '\n')
+            reply = json.loads(readLine(sock))
+        except (socket.error, ValueError), e:
+            raise errors.BackupFatalEnvironmentError("Communication with "
+                                                     "backup daemon failed. "
+                                                     "Socket: %s" % socket_path,
+                                                     "Error Message: %s" 
+                                                     % str(e))
+    finally:
+        sock.close()
+    if reply.get('status') != 'ok':
+        raise errors.BackupStartupError("Request rejected by backup daemon.",
+                                        reply.get('message', ''))
+    return reply
+
+
+class BackupDaemon:
+    """Long-running process for running backup jobs on schedules and on
+    request.
+
+    """
+
+    def __init__(self, jobmgr_cls, opts, jobs=None, file_cache=None):
+        """Constructor
+
+        @param jobmgr_cls: Job Manager class for executing the runs.
+        @param opts:       Dictionary of options passed from command line.
+        @param jobs:       List of jobs run on schedules. (All jobs with a
+                           schedule by default.)
+        @param file_cache: Initial file cache of parsed included
+                           configuration files.
+
+        """
+        self._jobmgrCls = jobmgr_cls
+        self._opts = dict(opts)
+        self._opts.pop('daemon', None)
+        self._jobs = jobs
+        self._confCache = config.ConfCache(opts['config_path'], file_cache)
+        self._conf = None
+        self._schedules = {}
+        self._socketPath = None
+        self._socket = None
+        self._queue = []
+        self._running = None
+        self._cond = threading.Condition()
+        self._stop = False
+        self._reload = False
+        self._startTime = time.time()
+
+    def loadConf(self, force=False):
+        """Loads the configuration if the configuration files have changed.
+        If the new configuration is invalid, the previous configuration is
+        kept.
+
+        @param force: Read the configuration files even if they have not
+                      changed.
+        @return:      True if a new configuration was loaded.
+
+        """
+        if force:
+            self._confCache.invalidate()
+        try:
+            (conf, reloaded) = self._confCache.get()
+            if not reloaded:
+                return False
+            jobmgr = self._jobmgrCls(self._opts, self._jobs, conf)
+            jobmgr.parseConfFile()
+            jobmgr.loadPlugins()
+            schedules = jobmgr.getSchedules()
+            socket_path = jobmgr.getDaemonSocket()
+        except errors.BackupError, e:
+            if self._conf is None:
+                raise
+            logError(e, "Loading of changed configuration failed, the "
+                        "previous configuration is kept.")
+            return False
+        if self._socketPath is not None and socket_path != self._socketPath:
+            logger.warning("Change of daemon socket requires restart: %s",
+                           socket_path)
+        else:
+            self._socketPath = socket_path
+        self._cond.acquire()
+        try:
+            self._conf = conf
+            self._schedules = schedules
+        finally:
+            self._cond.release()
+        logger.info("Configuration loaded: %s   Files: %d   Scheduled jobs: %d",
+                    conf['paths'][0], len(conf['paths']), len(schedules))
+        now = datetime.now()
+        for job_name in sorted(schedules.keys()):
+            logger.debug("Schedule for job %s: %s   Next run: %s", job_name,
+                         schedules[job_name],
+                         schedules[job_name].getNextTime(now))
+        return True
+
+    def openSocket(self):
+        """Creates the Unix socket for requests. The socket is only accessible
+        by the user of the daemon.
+
+        """
+        path = self._socketPath
+        if os.path.exists(path):
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                try:
+                    probe.connect(path)
+                except socket.error:
+                    os.unlink(path)
+                else:
+                    raise errors.BackupFatalEnvironmentError(
+                        "Backup daemon is already running. Socket: %s" % path)
+            finally:
+                probe.close()
+        sock_dir = os.path.dirname(path)
+        try:
+            if sock_dir and not os.path.isdir(sock_dir):
+                os.makedirs(sock_dir)
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            umask = os.umask(0177)
+            try:
+                sock.bind(path)
+            finally:
+                os.umask(umask)
+            sock.listen(5)
+        except EnvironmentError, e:
+            raise errors.BackupFatalEnvironmentError("Creation of socket for "
+                                                     "backup daemon failed: %s"
+                                                     % path,
+                                                     "Error Message: %s"
+                                                     % str(e))
+        self._socket = sock
+        logger.info("Listening for requests on socket: %s", path)
+
+    def closeSocket(self):
+        """Closes and removes the Unix socket.
+
+        """
+        if self._socket is not None:
+            self._socket.close()
+            self._socket = None
+            try:
+                os.unlink(self._socketPath)
+            except OSError:
+                pass
+
+    def queueRun(self, jobs, dry_run=False, resume=False, source='schedule'):
+        """Queues run of backup jobs. Jobs that are already queued or running
+        are skipped.
+
+        @param jobs:    List of job names.
+        @param dry_run: Execute test run.
+        @param resume:  Resume jobs from checkpoints.
+        @param source:  Origin of the run for log messages.
+        @return:        Tuple of (queued jobs, skipped jobs).
+
+        """
+        self._cond.acquire()
+        try:
+            busy = set()
+            for run in self._queue + [self._running]:
+                if run is not None:
+                    busy.update(run['jobs'])
+            queued = [job for job in jobs if job not in busy]
+            skipped = [job for job in jobs if job in busy]
+            if queued:
+                self._queue.append({'jobs': queued,
+                                    'dry_run': dry_run,
+                                    'resume': resume,
+                                    'source': source,
+                                    'queue_time': time.time()})
+                self._cond.notify()
+        finally:
+            self._cond.release()
+        if queued:
+            logger.info("Queued run of jobs (%s): %s", source,
+                        ', '.join(queued))
+        if skipped:
+            logger.warning("Jobs already queued or running, skipped (%s): %s",
+                           source, ', '.join(skipped))
+        return (queued, skipped)
+
+    def execRun(self, run):
+        """Executes queued run of backup jobs with a new Job Manager
+        instance using the cached configuration.
+
+        @param run: Dictionary of queued run.
+
+        """
+        opts = dict(self._opts)
+        opts['dry_run'] = self._opts.get('dry_run', False) or run['dry_run']
+        opts['resume'] = self._opts.get('resume', False) or run['resume']
+        logger.info("Starting run of jobs (%s): %s", run['source'],
+                    ', '.join(run['jobs']))
+        try:
+            jobmgr = self._jobmgrCls(opts, list(run['jobs']), self._conf)
+            jobmgr.run()
+        except errors.BackupError, e:
+            logError(e, "Run of jobs failed: %s" % ', '.join(run['jobs']))
+        except Exception:
+            logger.exception("Run of jobs failed with unexpected error: %s",
+                             ', '.join(run['jobs']))
+
+    def runQueue(self):
+        """Executes the queued runs until the daemon is stopped.
+
+        """
+        logmgr.setContext('DAEMON')
+        while True:
+            self._cond.acquire()
+            try:
+                while not self._queue and not self._stop:
+                    self._cond.wait(1.0)
+                if self._stop:
+                    return
+                run = self._queue.pop(0)
+                self._running = run
+            finally:
+                self._cond.release()
+            try:
+                self.execRun(run)
+            finally:
+                self._cond.acquire()
+                try:
+                    self._running = None
+                finally:
+                    self._cond.release()
+                logmgr.setContext('DAEMON')
+
+    def getStatus(self):
+        """Returns the status of the daemon.
+
+        @return: Dictionary.
+
+        """
+        now = datetime.now()
+        self._cond.acquire()
+        try:
+            schedules = {}
+            for (job_name, sched) in self._schedules.items():
+                next_time = sched.getNextTime(now)
+                schedules[job_name] = {'schedule': str(sched),
+                                       'next_run': next_time and
+                                                   next_time.isoformat()}
+            return {'status': 'ok',
+                    'pid': os.getpid(),
+                    'start_time': datetime.fromtimestamp(
+                                    self._startTime).isoformat(),
+                    'config_paths': self._conf['paths'],
+                    'running': self._running and self._running['jobs'],
+                    'queued': [run['jobs'] for run in self._queue],
+                    'schedules': schedules,}
+        finally:
+            self._cond.release()
+
+    def handleRequest(self, request):
+        """Handles request received through the Unix socket.
+
+        @param request: Dictionary with the command and its arguments.
+        @return:        Dictionary of reply.
+
+        """
+        command = request.get('command')
+        if command == 'run':
+            jobs = request.get('jobs')
+            if jobs is None:
+                jobs = sorted(self._conf['jobs'].keys())
+            unknown = [job for job in jobs
+                       if not self._conf['jobs'].has_key(job)]
+            if unknown:
+                return {'status': 'error',
+                        'message': "Unknown backup jobs: %s"
+                                   % ', '.join(unknown)}
+            (queued, skipped) = self.queueRun(jobs,
+                                              bool(request.get('dry_run')),
+                                              bool(request.get('resume')),
+                                              'request')
+            return {'status': 'ok', 'queued': queued, 'skipped': skipped,
+                    'message': "Queued: %s   Already queued or running: %s"
+                               % (', '.join(queued) or '-',
+                                  ', '.join(skipped) or '-')}
+        elif command == 'status':
+            return self.getStatus()
+        elif command == 'reload':
+            if self.loadConf(force=True):
+                return {'status': 'ok', 'message': "Configuration reloaded."}
+            else:
+                return {'status': 'error',
+                        'message': "Loading of configuration failed."}
+        else:
+            return {'status': 'error',
+                    'message': "Invalid command: %s" % command}
+
+    def serveSocket(self):
+        """Handles requests on the Unix socket until the daemon is stopped.
+
+        """
+        logmgr.setContext('DAEMON')
+        while not self._stop:
+            try:
+                (readable, w, x) = select.select([self._socket], [], [], #@UnusedVariable
+                                                 1.0)
+            except select.error, e:
+                if e.args[0] == errno.EINTR:
+                    continue
+                raise
+            if not readable or self._stop:
+                continue
+            try:
+                (conn, addr) = self._socket.accept() #@UnusedVariable
+            except socket.error:
+                continue
+            try:
+                conn.settimeout(socketTimeout)
+                line = readLine(conn)
+                if not line:
+                    continue
+                try:
+                    request = json.loads(line)
+                    if not isinstance(request, dict):
+                        raise ValueError("Request is not an object.")
+                    reply = self.handleRequest(request)
+                except ValueError, e:
+                    reply = {'status': 'error',
+                             'message': "Invalid request: %s" % str(e)}
+                except errors.BackupError, e:
+                    reply = {'status': 'error',
+                             'message': ' '.join([e.desc] + list(e))}
+                conn.sendall(json.dumps(reply) + '\n')
+            except socket.error, e:
+                logger.warning("Handling of request on daemon socket "
+                               "failed: %s", str(e))
+            finally:
+                conn.close()
+
+    def checkSchedules(self, start, end):
+        """Queues the runs of the jobs scheduled in the time interval.
+
+        @param start: Datetime of the last checked minute. (Excluded.)
+        @param end:   Datetime of the current minute. (Included.)
+
+        """
+        if end - start > timedelta(minutes=schedule.maxCatchUpMinutes):
+            start = end - timedelta(minutes=schedule.maxCatchUpMinutes)
+        due = []
+        for (job_name, sched) in sorted(self._schedules.items()):
+            next_time = sched.getNextTime(start)
+            if next_time is not None and next_time <= end:
+                due.append(job_name)
+        if due:
+            self.queueRun(due, source='schedule')
+
+    def stop(self, signum=None, frame=None): #@UnusedVariable
+        """Stops the daemon. The running backup jobs are finished, queued runs
+        are discarded.
+
+        """
+        self._stop = True
+
+    def requestReload(self, signum=None, frame=None): #@UnusedVariable
+        """Requests reloading of the configuration at the next check.
+
+        """
+        self._reload = True
+
+    def run(self):
+        """Runs the daemon until it is stopped by SIGTERM or SIGINT. SIGHUP
+        forces reloading of the configuration.
+
+        """
+        logmgr.setContext('DAEMON', self._opts.get('dry_run', False))
+        self.loadConf()
+        self.openSocket()
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        signal.signal(signal.SIGHUP, self.requestReload)
+        threads = []
+        for (target, name) in ((self.runQueue, 'daemon-runner'),
+                               (self.serveSocket, 'daemon-socket')):
+            thread = threading.Thread(target=target, name=name)
+            thread.setDaemon(True)
+            thread.start()
+            threads.append(thread)
+        logger.info("Backup daemon started. PID: %d", os.getpid())
+        last_check = datetime.now().replace(second=0, microsecond=0)
+        try:
+            while not self._stop:
+                time.sleep(1.0)
+                now = datetime.now().replace(second=0, microsecond=0)
+                if self._reload:
+                    self._reload = False
+                    self.loadConf(force=True)
+                if now == last_check:
+                    continue
+                if now < last_check:
+                    logger.warning("System clock moved backwards, checking "
+                                   "schedules from: %s", now)
+                else:
+                    self.loadConf()
+                    self.checkSchedules(last_check, now)
+                last_check = now
+        finally:
+            self._stop = True
+            self.closeSocket()
+            logger.info("Stopping backup daemon, waiting for running jobs.")
+            self._cond.acquire()
+            try:
+                self._cond.notifyAll()
+            finally:
+                self._cond.release()
+            for thread in threads:
+                while thread.isAlive():
+                    thread.join(1.0)
+        logger.info("Backup daemon stopped.")
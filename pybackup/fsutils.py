@@ -0,0 +1,480 @@
+"""pybackup - Filesystem utilities for file based backups.
+
+Walking of source paths with exclude patterns and handling of archive index
+files and file state manifests.
+
+"""
+
+import os
+import stat
+import json
+import heapq
+import fnmatch
+import threading
+import Queue
+from pybackup import errors
+
+__author__ = "Ali Onur Uyar"
+__copyright__ = "Copyright 2011, Ali Onur Uyar"
+__credits__ = []
+__license__ = "GPL"
+__version__ = "0.5"
+__maintainer__ = "Ali Onur Uyar"
+__email__ = "aouyar at gmail.com"
+__status__ = "Development"
+
+
+indexHeader = "# offset\tsize\tmtime\ttype\tpath"
+"""Header line for archive index files."""
+
+manifestHeader = "# inode\tsize\tmtime\tctime\ttype\tpath"
+"""Header line for file state manifests."""
+
+checksumManifestName = "MANIFEST.sha256"
+"""Filename for checksum manifests of backup files in job directories."""
+
+checkpointName = "CHECKPOINT.json"
+"""Filename for checkpoints of the completed units of backup jobs in job 
+directories."""
+
+defaultScanWorkers = 8
+"""Default number of worker threads for scanning source paths."""
+
+
+def readExcludeFile(path):
+    """Reads list of exclude patterns from file. Empty lines are skipped.
+
+    @param path: Path for file with one pattern per line.
+    @return:     List of patterns.
+
+    """
+    try:
+        fp = open(path, 'r')
+        try:
+            return [line.strip() for line in fp if len(line.strip()) > 0]
+        finally:
+            fp.close()
+    except IOError, e:
+        raise errors.BackupConfigError("Reading of exclude patterns file "
+                                       "failed: %s" % path,
+                                       "Error Message: %s" % str(e))
+
+def isExcluded(path, patterns):
+    """Checks path against exclude patterns using the default matching rules of
+    GNU tar; the patterns are matched against the full path and against each
+    trailing subpath starting at a path component.
+
+    @param path:     Relative path.
+    @param patterns: List of shell wildcard patterns.
+    @return:         True if path matches any of the patterns.
+
+    """
+    if not patterns:
+        return False
+    subpath = path
+    while True:
+        for pattern in patterns:
+            if fnmatch.fnmatchcase(subpath, pattern):
+                return True
+        pos = subpath.find('/')
+        if pos < 0:
+            return False
+        subpath = subpath[pos + 1:]
+
+def walkPaths(path_list, base_dir=None, exclude_patterns=None, onerror=None):
+    """Generator for walking the list of source paths recursively. Excluded
+    directories are not descended into. Symbolic links are not followed.
+
+    @param path_list:        List of paths. Relative paths are relative to
+                             base_dir.
+    @param base_dir:         Base directory for relative paths.
+    @param exclude_patterns: List of filename patterns to exclude.
+    @param onerror:          Function called with (path, error) arguments for
+                             paths that cannot be read. Errors are raised by
+                             default.
+    @return:                 Yields tuples of (path, fs_path, stat) for each
+                             entry, where path is the path as given in
+                             path_list and fs_path is the filesystem path.
+
+    """
+    stack = []
+    for path in reversed(path_list):
+        stack.append(os.path.normpath(path))
+    while stack:
+        path = stack.pop()
+        if isExcluded(path.lstrip('/'), exclude_patterns):
+            continue
+        if base_dir is not None:
+            fs_path = os.path.join(base_dir, path)
+        else:
+            fs_path = path
+        try:
+            st = os.lstat(fs_path)
+        except OSError, e:
+            if onerror is None:
+                raise
+            onerror(path, e)
+            continue
+        yield (path, fs_path, st)
+        if stat.S_ISDIR(st.st_mode):
+            try:
+                names = os.listdir(fs_path)
+            except OSError, e:
+                if onerror is None:
+                    raise
+                onerror(path, e)
+                continue
+            names.sort(reverse=True)
+            for name in names:
+                stack.append(os.path.join(path, name))
+
+def scanPaths(path_list, base_dir=None, exclude_patterns=None, 
+              num_workers=defaultScanWorkers, onerror=None):
+    """Scans the list of source paths recursively for the number and the 
+    size of the files, with the same rules as walkPaths. The directories are 
+    listed in parallel by a pool of worker threads.
+    
+    @param path_list:        List of paths. Relative paths are relative to
+                             base_dir.
+    @param base_dir:         Base directory for relative paths.
+    @param exclude_patterns: List of filename patterns to exclude.
+    @param num_workers:      Number of worker threads.
+    @param onerror:          Function called with (path, error) arguments for
+                             paths that cannot be read. Errors are ignored by 
+                             default.
+    @return:                 Tuple of (number of files, number of directories,
+                             total size of regular files in bytes).
+    
+    """
+    queue = Queue.Queue()
+    lock = threading.Lock()
+    totals = [0, 0, 0]
+    
+    def scan_entries(paths):
+        num_files = 0
+        num_dirs = 0
+        num_bytes = 0
+        for path in paths:
+            if isExcluded(path.lstrip('/'), exclude_patterns):
+                continue
+            if base_dir is not None:
+                fs_path = os.path.join(base_dir, path)
+            else:
+                fs_path = path
+            try:
+                st = os.lstat(fs_path)
+            except OSError, e:
+                if onerror is not None:
+                    onerror(path, e)
+                continue
+            if stat.S_ISDIR(st.st_mode):
+                num_dirs += 1
+                queue.put((path, fs_path))
+            else:
+                num_files += 1
+                if stat.S_ISREG(st.st_mode):
+                    num_bytes += st.st_size
+        lock.acquire()
+        try:
+            totals[0] += num_files
+            totals[1] += num_dirs
+            totals[2] += num_bytes
+        finally:
+            lock.release()
+    
+    def worker():
+        while True:
+            item = queue.get()
+            try:
+                if item is None:
+                    return
+                (path, fs_path) = item
+                try:
+                    names = os.listdir(fs_path)
+                except OSError, e:
+                    if onerror is not None:
+                        onerror(path, e)
+                    continue
+                scan_entries([os.path.join(path, name) for name in names])
+            finally:
+                queue.task_done()
+    
+    threads = []
+    for i in range(max(1, num_workers)):
+        thread = threading.Thread(target=worker, name="scan-%d" % i)
+        thread.setDaemon(True)
+        thread.start()
+        threads.append(thread)
+    scan_entries([os.path.normpath(path) for path in path_list])
+    queue.join()
+    for thread in threads:
+        queue.put(None)
+    for thread in threads:
+        thread.join()
+    return tuple(totals)
+
+def splitEntries(entries, num_groups, entry_overhead=512):
+    """Splits the list of entries returned by walkPaths in groups of roughly
+    equal total size, for archiving the groups in parallel. Directory trees 
+    are kept in the same group, unless they are larger than a fraction of the
+    total size; large trees are split at their subdirectories. The parts are
+    assigned to the groups largest first.
+    
+    @param entries:        List of (path, fs_path, stat) tuples in the order
+                           of walkPaths.
+    @param num_groups:     Number of groups.
+    @param entry_overhead: Size in bytes added to the size of each entry, for
+                           the cost of archiving small files.
+    @return:               List of non-empty groups. Each group is a list of 
+                           entries in the original order.
+    
+    """
+    index = {}
+    children = {}
+    sizes = []
+    roots = []
+    for (idx, (path, fs_path, st)) in enumerate(entries): #@UnusedVariable
+        index[path] = idx
+        parent = index.get(os.path.dirname(path))
+        if parent is not None and parent != idx:
+            children.setdefault(parent, []).append(idx)
+        else:
+            roots.append(idx)
+        if stat.S_ISREG(st.st_mode):
+            sizes.append(st.st_size + entry_overhead)
+        else:
+            sizes.append(entry_overhead)
+    tree_sizes = list(sizes)
+    for idx in reversed(range(len(entries))):
+        for child in children.get(idx, ()):
+            tree_sizes[idx] += tree_sizes[child]
+    max_part = sum(sizes) / (num_groups * 4) + 1
+    # Parts are (size, entry index, whole tree) tuples.
+    parts = []
+    stack = list(roots)
+    while stack:
+        idx = stack.pop()
+        if tree_sizes[idx] > max_part and children.has_key(idx):
+            parts.append((sizes[idx], idx, False))
+            stack.extend(children[idx])
+        else:
+            parts.append((tree_sizes[idx], idx, True))
+    parts.sort(reverse=True)
+    heap = [(0, group) for group in range(num_groups)]
+    members = [[] for group in range(num_groups)] #@UnusedVariable
+    for (size, idx, whole_tree) in parts:
+        (load, group) = heapq.heappop(heap)
+        members[group].append(idx)
+        if whole_tree:
+            tree = list(children.get(idx, ()))
+            while tree:
+                child = tree.pop()
+                members[group].append(child)
+                tree.extend(children.get(child, ()))
+        heapq.heappush(heap, (load + size, group))
+    return [[entries[idx] for idx in sorted(group_members)] 
+            for group_members in members if group_members]
+
+def getEntryType(mode):
+    """Returns single character code for the type of filesystem entry used in
+    index files.
+
+    @param mode: File mode from stat.
+    @return:     f (regular file), d (directory), l (symbolic link) or
+                 o (other).
+
+    """
+    if stat.S_ISREG(mode):
+        return 'f'
+    elif stat.S_ISDIR(mode):
+        return 'd'
+    elif stat.S_ISLNK(mode):
+        return 'l'
+    else:
+        return 'o'
+
+def escapePath(path):
+    """Escapes backslashes, tabs and newlines in path for index files.
+
+    @param path: Path.
+    @return:     Escaped path.
+
+    """
+    return path.replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n')
+
+def unescapePath(path):
+    """Reverts the escaping of paths in index files.
+
+    @param path: Escaped path.
+    @return:     Path.
+
+    """
+    parts = path.split('\\\\')
+    return '\\'.join([part.replace('\\t', '\t').replace('\\n', '\n')
+                      for part in parts])
+
+def formatIndexEntry(offset, size, mtime, entry_type, path):
+    """Returns line for archive index file.
+
+    @param offset:     Offset of the entry in the uncompressed archive.
+    @param size:       Size of the entry in bytes.
+    @param mtime:      Modification time of the entry. (Unix time.)
+    @param entry_type: Type code of the entry. (See getEntryType.)
+    @param path:       Path of the entry in the archive.
+    @return:           Tab separated line.
+
+    """
+    return "%d\t%d\t%d\t%s\t%s\n" % (offset, size, mtime, entry_type,
+                                      escapePath(path))
+
+def parseIndexEntry(line):
+    """Parses line of archive index file.
+
+    @param line: Line generated by formatIndexEntry.
+    @return:     Tuple of (offset, size, mtime, type, path) or None for header
+                 or empty lines.
+
+    """
+    line = line.rstrip('\n')
+    if not line or line.startswith('#'):
+        return None
+    (offset, size, mtime, entry_type, path) = line.split('\t', 4)
+    return (int(offset), int(size), int(mtime), entry_type, unescapePath(path))
+
+def getFileState(st):
+    """Returns the state of filesystem entry that is stored in file state
+    manifests for detecting changes between backups.
+
+    @param st: Stat result for the entry.
+    @return:   Tuple of (inode, size, mtime, ctime, type).
+
+    """
+    return (st.st_ino, st.st_size, st.st_mtime, st.st_ctime,
+            getEntryType(st.st_mode))
+
+def writeManifest(path, entries, info=None):
+    """Writes file state manifest atomically.
+
+    @param path:    Path for manifest file.
+    @param entries: Iterable of (path, state) tuples where state is the tuple
+                    returned by getFileState.
+    @param info:    Dictionary of informational values stored in the header of
+                    the manifest.
+
+    """
+    tmp_path = "%s.tmp" % path
+    fp = open(tmp_path, 'w')
+    try:
+        if info:
+            for (key, val) in sorted(info.items()):
+                fp.write("## %s: %s\n" % (key, val))
+        fp.write(manifestHeader + "\n")
+        for (entry_path, (ino, size, mtime, ctime, entry_type)) in entries:
+            fp.write("%d\t%d\t%r\t%r\t%s\t%s\n" % (ino, size, mtime, ctime,
+                                                     entry_type,
+                                                     escapePath(entry_path)))
+    finally:
+        fp.close()
+    os.rename(tmp_path, path)
+
+def readManifest(path):
+    """Reads file state manifest.
+
+    @param path: Path for manifest file.
+    @return:     Tuple of (info, states), where info is the dictionary of
+                 informational values in the header and states is the
+                 dictionary mapping paths to file states.
+
+    """
+    info = {}
+    states = {}
+    fp = open(path, 'r')
+    try:
+        for line in fp:
+            line = line.rstrip('\n')
+            if line.startswith('## '):
+                (key, sep, val) = line[3:].partition(': ') #@UnusedVariable
+                info[key] = val
+            elif line and not line.startswith('#'):
+                (ino, size, mtime, ctime, entry_type, 
+                 entry_path) = line.split('\t', 5)
+                states[unescapePath(entry_path)] = (int(ino), int(size),
+                                                    float(mtime), float(ctime),
+                                                    entry_type)
+    finally:
+        fp.close()
+    return (info, states)
+
+def writeChecksumManifest(path, entries):
+    """Writes checksum manifest atomically. Each line lists the SHA-256 hash,
+    the size and the path of a file separated by spaces.
+
+    @param path:    Path for manifest file.
+    @param entries: Iterable of (path, sha256, size) tuples. The paths are 
+                    relative to the directory of the manifest.
+
+    """
+    tmp_path = "%s.tmp" % path
+    fp = open(tmp_path, 'w')
+    try:
+        for (entry_path, digest, size) in entries:
+            fp.write("%s %d %s\n" % (digest, size, escapePath(entry_path)))
+    finally:
+        fp.close()
+    os.rename(tmp_path, path)
+
+def readChecksumManifest(path):
+    """Reads checksum manifest.
+
+    @param path: Path for manifest file.
+    @return:     List of (path, sha256, size) tuples.
+
+    """
+    entries = []
+    fp = open(path, 'r')
+    try:
+        for line in fp:
+            line = line.rstrip('\n')
+            if line and not line.startswith('#'):
+                (digest, size, entry_path) = line.split(' ', 2)
+                entries.append((unescapePath(entry_path), digest, int(size)))
+    finally:
+        fp.close()
+    return entries
+
+def writeCheckpoint(path, units):
+    """Writes checkpoint of the completed units of backup job atomically.
+    
+    @param path:  Path for checkpoint file.
+    @param units: Dictionary mapping unit names to lists of (path, sha256, 
+                  size) tuples for the backup files of the units. The paths 
+                  are relative to the directory of the checkpoint.
+    
+    """
+    tmp_path = "%s.tmp" % path
+    fp = open(tmp_path, 'w')
+    try:
+        json.dump(dict([(unit, [list(entry) for entry in entries]) 
+                        for (unit, entries) in units.items()]), 
+                  fp, indent=1, sort_keys=True)
+        fp.write("\n")
+    finally:
+        fp.close()
+    os.rename(tmp_path, path)
+
+def readCheckpoint(path):
+    """Reads checkpoint of the completed units of backup job.
+    
+    @param path: Path for checkpoint file.
+    @return:     Dictionary mapping unit names to lists of (path, sha256, 
+                 size) tuples.
+    
+    """
+    fp = open(path, 'r')
+    try:
+        data = json.load(fp)
+    finally:
+        fp.close()
+    return dict([(str(unit), [(str(entry_path), str(digest), int(size))
+                              for (entry_path, digest, size) in entries])
+                 for (unit, entries) in data.items()])
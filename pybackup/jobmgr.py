@@ -7,15 +7,22 @@ for executing them.
 
 import sys
 import os
+import re
+import time
+import json
 import platform
-import ConfigParser
+import threading
 import optparse
 import logging
 import subprocess
-from datetime import date
+from datetime import date, datetime
 from pybackup import errors
 from pybackup import utils
+from pybackup import fsutils
+from pybackup import compress
+from pybackup import config
 from pybackup.logmgr import logger, logmgr
+from pybackup import plugins
 from pybackup.plugins import backupPluginRegistry
 from pysysinfo.util import parse_value
 
@@ -32,6 +39,12 @@ __status__ = "Development"
 # Defaults
 bufferSize = 8192
 defaultConfigPaths = ['./pybackup.conf', '/etc/pybackup.conf']
+confCacheFilename = 'config_cache.json'
+"""Filename for the cache of parsed included configuration files and job
+validation results in the state directory."""
+confCacheVersion = 1
+"""Format version of the configuration cache. Caches with other versions are
+discarded."""
 
 
 def parseCmdline(argv=None):
@@ -78,6 +91,39 @@ def parseCmdline(argv=None):
     parser.add_option('-i', '--help-method', 
                       help='Print help text for plugin method.',
                       dest='helpMethod', default=False, action='store_true')
+    parser.add_option('-v', '--verify', 
+                      help='Verify backup files in dated backup directories '
+                           'against checksum manifests. Dates (YYYY-MM-DD) or '
+                           'date ranges (YYYY-MM-DD:YYYY-MM-DD) are passed as '
+                           'arguments. (Newest backup by default.)',
+                      dest='verify', default=False, action='store_true')
+    parser.add_option('-r', '--prune', 
+                      help='Remove backups expired by the retention policy.',
+                      dest='prune', default=False, action='store_true')
+    parser.add_option('-G', '--collect-garbage', 
+                      help='Remove the data of storage shared by backup jobs '
+                           '(chunks of deduplication repositories) that is no '
+                           'longer referenced by any backup.',
+                      dest='collectGarbage', default=False, 
+                      action='store_true')
+    parser.add_option('-R', '--resume', 
+                      help='Resume jobs of failed run, skipping the units '
+                           '(databases, archive shards) completed in the '
+                           'checkpoints of the jobs with valid backup files.',
+                      dest='resume', default=False, action='store_true')
+    parser.add_option('-D', '--daemon', 
+                      help='Run as daemon executing the jobs with schedules '
+                           'and the jobs requested through the daemon socket. '
+                           'Jobs passed as arguments restrict the scheduled '
+                           'jobs.',
+                      dest='daemon', default=False, action='store_true')
+    parser.add_option('-s', '--submit', 
+                      help='Request run of jobs from the running daemon '
+                           'instead of running the jobs.',
+                      dest='submit', default=False, action='store_true')
+    parser.add_option('--daemon-status', 
+                      help='Print status of the running daemon.',
+                      dest='daemonStatus', default=False, action='store_true')
     if argv is None:
         (cmdopts, args) = parser.parse_args()
     else:
@@ -86,6 +132,7 @@ def parseCmdline(argv=None):
         errors.setTrace()
     opts = {}
     opts['dry_run'] = cmdopts.dryRun
+    opts['resume'] = cmdopts.resume
     if cmdopts.debug:
         opts['console_loglevel'] = 'debug'
         opts['logfile_loglevel'] = 'debug'
@@ -111,7 +158,19 @@ def parseCmdline(argv=None):
         else:
             raise errors.BackupStartupError("Name of backup method must be "
                                             "passed as the first argument.")
+    elif cmdopts.verify:
+        opts['verify'] = args
+    elif cmdopts.prune or cmdopts.collectGarbage:
+        opts['prune'] = cmdopts.prune
+        opts['collect_garbage'] = cmdopts.collectGarbage
+    elif cmdopts.daemonStatus:
+        opts['daemon_status'] = True
+    elif cmdopts.daemon:
+        opts['daemon'] = True
+        if len(args) > 0:
+            jobs = args
     else:
+        opts['submit'] = cmdopts.submit
         if cmdopts.allJobs:
             pass
         elif len(args) > 0:
@@ -132,7 +191,9 @@ def execExternalCmd(args, env=None, dry_run=False):
     @param dry_run: If True, execute a Test Run without actually executing the 
                     external script. Used for testing purposes. 
                     (Default: False)
-    @return:        Tuple of standard output text, standard error text.
+    @return:        Tuple of standard output text, standard error text. Only
+                    the tail of the output is kept, the output lines are 
+                    logged in debug mode.
                      
     """
     if dry_run:
@@ -144,12 +205,21 @@ def execExternalCmd(args, env=None, dry_run=False):
                                stdout=subprocess.PIPE, 
                                stderr=subprocess.PIPE, 
                                bufsize=bufferSize,
+                               close_fds=True,
                                env = env)
     except Exception, e:
         raise errors.ExternalCmdError("External script execution failed.",
                                       "Command: %s" % ' '.join(args),
                                       "Error Message: %s" % str(e))
-    out, err = cmd.communicate(None) #@UnusedVariable
+    name = os.path.basename(args[0])
+    out_tail = utils.OutputTail(line_func=lambda line: 
+                                logger.debug("%s stdout: %s", name, line))
+    err_tail = utils.OutputTail(line_func=lambda line: 
+                                logger.debug("%s stderr: %s", name, line))
+    utils.pumpStreams(((cmd.stdout, out_tail), (cmd.stderr, err_tail)))
+    cmd.wait()
+    out = out_tail.getText()
+    err = err_tail.getText()
     if not cmd.returncode == 0:
         raise errors.ExternalCmdError("Execution of external command failed"
                                       " with error code: %s" 
@@ -171,7 +241,81 @@ class JobManager:
                    'logfile_loglevel': 'Logging level for log file.',
                    'filename_logfile': 'Filename for log file.',
                    'pre_exec': 'Script to be executed before starting running jobs.',
-                   'post_exec': 'Script to be executed after finishing running jobs.', }
+                   'post_exec': 'Script to be executed after finishing running jobs.',
+                   'cmd_compress': 'Path for compression command executable. '
+                                   '(Default: gzip)',
+                   'cmd_tar': 'Path for tar command executable. (Default: tar)',
+                   'cmd_nice': 'Path for nice command executable, for the '
+                               'nice_level option. (Default: nice)',
+                   'cmd_ionice': 'Path for ionice command executable, for the '
+                                 'ionice_class option. (Default: ionice)',
+                   'cmd_taskset': 'Path for taskset command executable, for '
+                                  'the cpu_affinity option. (Default: taskset)',
+                   'state_dir': 'Directory for storing the state of backup jobs '
+                                'between runs. (Default: .pybackup directory '
+                                'in backup root directory.)',
+                   'max_parallel_jobs': 'Maximum number of backup jobs to run in '
+                                        'parallel. (Default: 1)',
+                   'filename_report': 'Filename for JSON report with resource '
+                                      'usage statistics of backup jobs.',
+                   'verify_workers': 'Number of worker processes for '
+                                     'verification of backups. (Number of '
+                                     'CPUs by default.)',
+                   'retain_daily': 'Number of daily backups to retain. '
+                                   '(Default: 0)',
+                   'retain_weekly': 'Number of weekly backups to retain. '
+                                    '(Default: 0)',
+                   'retain_monthly': 'Number of monthly backups to retain. '
+                                     '(Default: 0)',
+                   'prune_after_run': 'Remove backups expired by the retention '
+                                      'policy after running the backup jobs, '
+                                      'if all jobs succeed. (Default: no)',
+                   'collect_after_run': 'Remove the data of storage shared by '
+                                        'backup jobs that is no longer '
+                                        'referenced after running the backup '
+                                        'jobs and the removal of expired '
+                                        'backups, if all jobs succeed. '
+                                        '(Default: no)',
+                   'catalog': 'Enable / disable catalog of backups. '
+                              '(Default: yes)',
+                   'catalog_path': 'Path for catalog database. (Default: '
+                                   'catalog.sqlite in state_dir.)',
+                   'prune_workers': 'Number of worker threads for removal of '
+                                    'expired backups. (Number of CPUs by '
+                                    'default.)',
+                   'nice_level': 'Nice level for backup commands. (-20 - 19)',
+                   'ionice_class': 'I/O scheduling class for backup commands. '
+                                   '(realtime, best-effort or idle)',
+                   'ionice_level': 'I/O scheduling priority level for backup '
+                                   'commands. (0 - 7)',
+                   'cpu_affinity': 'List of CPUs for backup commands. '
+                                   '(Example: 0-3,6)',
+                   'throttle_load': 'Delay the start of backup commands while '
+                                    'the load average is above the limit.',
+                   'throttle_disk_latency': 'Delay the start of backup '
+                                            'commands while the average '
+                                            'latency of disk I/O in '
+                                            'milliseconds is above the limit.',
+                   'throttle_interval': 'Interval in seconds between checks of '
+                                        'the load while tasks are delayed. '
+                                        '(Default: 10)',
+                   'throttle_max_wait': 'Maximum delay in seconds for the start '
+                                        'of a task. (No limit if 0.) '
+                                        '(Default: 3600)',
+                   'concurrency_limits': 'List of limits for the number of jobs '
+                                         'run in parallel for each concurrency '
+                                         'group in group:limit format. (The '
+                                         'limit defaults to 1 for groups that '
+                                         'are not listed.)',
+                   'daemon_socket': 'Path for Unix socket of the daemon. '
+                                    '(Default: pybackup.sock in state_dir.)',
+                   'include_dir': 'Directories with additional configuration '
+                                  'files (*.conf) defining plugins and jobs. '
+                                  '(Relative to the directory of the '
+                                  'configuration file.)',
+                   'config_cache': 'Enable / disable cache of parsed included '
+                                   'configuration files and job validation '
+                                   'results in state_dir. (Default: yes)', }
     """Dictionary of valid general configuration file options and corresponding 
     textual descriptions of the options."""
     _reqGlobalOpts = ('backup_root',)
@@ -185,27 +329,46 @@ class JobManager:
                    'suffix_compress': 'gz',
                    'cmd_tar': 'tar',
                    'suffix_tar': 'tar',
-                   'suffix_tgz': 'tgz',}
+                   'suffix_tgz': 'tgz',
+                   'filename_report': 'report.json',
+                   'max_parallel_jobs': '1',}
     """Dictionary mapping global configuration options to default values. Only
     the configuration options with default values are included."""
     
-    def __init__(self, opts, jobs):
+    def __init__(self, opts, jobs, conf=None):
         """Constructor for the Job Manager.
         
         @param opts: Dictionary of options passed from command line.
         @param jobs: List of items (jobs, plugins, etc.) to be processed.
+        @param conf: Parsed configuration returned by config.readConfFile.
+                     The configuration files are read by default.
         
         """
         self._plugins = {}
         self._jobsConf = None
         self._jobs = jobs
+        self._reqJobs = jobs
+        self._conf = conf
+        self._confCache = None
+        self._confCachePath = None
+        self._pluginStamps = {}
         self._cmdConf = opts
+        self._globalConf = dict(self._globalConf)
         self._globalConf.update(opts)
         self._help = opts.get('help')
+        self._verify = opts.get('verify')
+        self._prune = opts.get('prune', False)
+        self._collect = opts.get('collect_garbage', False)
+        self._daemon = opts.get('daemon', False)
+        self._daemonStatus = opts.get('daemon_status', False)
+        self._submit = opts.get('submit', False)
         self._numJobs = 0
         self._numJobsDisabled = 0
         self._numJobsSuccess = 0
         self._numJobsError = 0
+        self._jobStats = []
+        self._startTime = time.time()
+        self._lock = threading.Lock()
         
     @classmethod
     def getHelpText(cls):
@@ -226,21 +389,39 @@ class JobManager:
         process.
         
         """
-        if self._help is None:
-            logmgr.setContext('STARTUP', self._globalConf.get('dry_run', False))
-        else:
+        if self._help is not None:
             logmgr.setContext('HELP')
+        elif self._daemon or self._daemonStatus or self._submit:
+            logmgr.setContext('DAEMON', self._globalConf.get('dry_run', False))
+        elif self._verify is not None:
+            logmgr.setContext('VERIFY')
+        elif self._prune:
+            logmgr.setContext('PRUNE', self._globalConf.get('dry_run', False))
+        elif self._collect:
+            logmgr.setContext('COLLECT', self._globalConf.get('dry_run', False))
+        else:
+            logmgr.setContext('STARTUP', self._globalConf.get('dry_run', False))
         level = logmgr.getLogLevel(self._globalConf['console_loglevel'])
         logmgr.configConsole(level)
-        if self._help is None:
+        if self.isBackupRun():
             logger.info("Start Execution of Backup Jobs.")
+            
+    def isBackupRun(self):
+        """Returns True if the backup jobs are executed by this instance.
+        
+        @return: Boolean
+        
+        """
+        return (self._help is None and self._verify is None 
+                and not self._prune and not self._collect and not self._daemon 
+                and not self._daemonStatus and not self._submit)
         
     def loggingEnd(self):
         """Writes-out the final log message before finalizing the execution of
         the backup process. 
         
         """
-        if self._help is None:
+        if self.isBackupRun():
             logmgr.setContext('FINAL')    
             logger.info("Finished Execution of %s Backup Jobs."
                         "    Enabled/Disabled: %s / %s"
@@ -251,10 +432,13 @@ class JobManager:
                         self._numJobsSuccess, 
                         self._numJobsError)
         
-    def loggingConfig(self):
+    def loggingConfig(self, log_file=True):
         """Configures logging depending on the settings from configuration
         files and command line options.
         
+        @param log_file: Logging to file in backup directory is activated if 
+                         True.
+        
         """
         console_level = logmgr.getLogLevel(self._globalConf['console_loglevel'])
         if console_level is None:
@@ -267,6 +451,8 @@ class JobManager:
                                                 "configuration file for option: "
                                                 "logfile_loglevel")
         logmgr.configConsole(console_level)
+        if not log_file:
+            return
         backup_path = self._globalConf['backup_path']
         self.createBaseDir()
         filename_logfile = self._globalConf['filename_logfile']
@@ -278,27 +464,16 @@ class JobManager:
         """Parses and validates configuration file.
         
         """
-        confmgr = ConfigParser.SafeConfigParser()
-        read_paths = confmgr.read(self._globalConf['config_path'])
-        if not read_paths:
-            raise errors.BackupFatalConfigError("Configuration file not found in any"
-                                                " of the following locations: %s" 
-                                                % ' '.join(self._globalConf['config_path']))
-        logger.debug("Parsing configuration file: %s" % ', '. join(read_paths))
-        if not confmgr.has_section('general'):
-            raise errors.BackupFatalConfigError("Missing mandatory section 'general' "
-                                                "in configuration file(s): %s" 
-                                                % ' '.join(self._configPath))
-        self._jobsConf = {}
-        for section in confmgr.sections():
-            if section == 'general':
-                options = confmgr.items('general')
-                global_conf = dict(options)
-            elif section == 'plugins':
-                self._plugins = dict(confmgr.items('plugins'))
-            else:
-                options = confmgr.items(section)
-                self._jobsConf[section] = dict(options)
+        if self._conf is None:
+            self._conf = config.readConfFile(self._globalConf['config_path'],
+                                             self.readConfCache)
+            if self._confCache is not None:
+                self._conf['validated'] = self._confCache['validated']
+                if self._conf['cache_changed']:
+                    self.writeConfCache()
+        global_conf = self._conf['general']
+        self._plugins = dict(self._conf['plugins'])
+        self._jobsConf = dict(self._conf['jobs'])
         if self._jobs is None:
             self._jobs = self._jobsConf.keys()
         for (k,v) in global_conf.items():
@@ -314,18 +489,209 @@ class JobManager:
                                                     "file.", k)
         self._globalConf['backup_root'] = os.path.normpath(
                                             self._globalConf['backup_root'])
-        backup_path_elem = [self._globalConf['backup_root'], ]
-        if self._globalConf.has_key('hostname_dir'):
+        self._globalConf['backup_base'] = self.resolveBackupBase(
+                                                            self._globalConf)
+        self._globalConf['backup_path'] = os.path.join(
+            self._globalConf['backup_base'], date.today().strftime('%Y-%m-%d'))
+        if not self._globalConf.has_key('state_dir'):
+            self._globalConf['state_dir'] = os.path.join(
+                self._globalConf['backup_base'], '.pybackup')
+            
+    def resolveBackupBase(self, general):
+        """Returns the base backup directory for general options. (Backup 
+        root directory or hostname subdirectory of backup root.)
+        
+        @param general: Dictionary of general options.
+        @return:        Path.
+        
+        """
+        backup_path_elem = [os.path.normpath(general['backup_root']), ]
+        if general.has_key('hostname_dir'):
             backup_path_elem.append(str(platform.node()).split('.')[0])
-        backup_path_elem.append(date.today().strftime('%Y-%m-%d'))
-        self._globalConf['backup_path'] = os.path.join(*backup_path_elem)
+        return os.path.join(*backup_path_elem)
+    
+    def readConfCache(self, general):
+        """Reads the cache of parsed included configuration files and job
+        validation results. Called by config.readConfFile with the general
+        options of the main configuration files.
+        
+        @param general: Dictionary of general options.
+        @return:        Dictionary mapping paths of included files to parsed
+                        files.
+        
+        """
+        if (not parse_value(general.get('config_cache', 'yes'), True)
+            or not general.has_key('backup_root')):
+            return {}
+        state_dir = general.get('state_dir')
+        if state_dir is None:
+            state_dir = os.path.join(self.resolveBackupBase(general), 
+                                     '.pybackup')
+        self._confCachePath = os.path.join(state_dir, confCacheFilename)
+        try:
+            fp = open(self._confCachePath, 'r')
+            try:
+                cache = config.encodeStrings(json.load(fp))
+            finally:
+                fp.close()
+        except (EnvironmentError, ValueError):
+            cache = None
+        if (not isinstance(cache, dict) 
+            or cache.get('version') != confCacheVersion):
+            cache = {'version': confCacheVersion, 'files': {}, 'validated': {}}
+        self._confCache = cache
+        return cache['files']
+    
+    def writeConfCache(self):
+        """Saves the cache of parsed included configuration files and job
+        validation results. Failures are ignored.
         
+        """
+        if self._confCache is None or self._globalConf.get('dry_run', False):
+            return
+        path = self._confCachePath
+        tmp_path = "%s.tmp" % path
+        try:
+            cache_dir = os.path.dirname(path)
+            if not os.path.isdir(cache_dir):
+                os.makedirs(cache_dir)
+            fp = open(tmp_path, 'w')
+            try:
+                json.dump(self._confCache, fp)
+            finally:
+                fp.close()
+            os.rename(tmp_path, path)
+        except EnvironmentError, e:
+            logger.debug("Saving of configuration cache failed: %s", str(e))
+        else:
+            logger.debug("Configuration cache saved: %s", path)
+            
+    def validateJobs(self):
+        """Validates the options of the requested jobs for their backup 
+        methods. The validation results are cached with the stamps of the
+        configuration files defining the jobs and of the plugin modules, so
+        jobs are only validated again after changes. Jobs failing validation
+        are not cached, the errors are reported on execution of the jobs.
+        
+        """
+        validated = self._conf['validated']
+        stamps = dict([(stamp[0], stamp[1:]) for stamp in self._conf['stamps']])
+        valid_jobs = set()
+        changed = False
+        for job_name in validated.keys():
+            if not self._jobsConf.has_key(job_name):
+                del validated[job_name]
+                changed = True
+        for job_name in self._jobs:
+            job_conf = self._jobsConf.get(job_name)
+            if job_conf is None:
+                continue
+            plugin = backupPluginRegistry.getMethodPlugin(job_conf.get('method'))
+            if plugin is None:
+                continue
+            key = [[path] + stamps.get(path, [None, None]) 
+                   for path in self._conf['sources'].get(job_name, [])]
+            key.append(self._pluginStamps.get(plugin))
+            if validated.get(job_name) != key:
+                try:
+                    BackupJob(job_name, self._globalConf, job_conf).validate()
+                except errors.BackupConfigError:
+                    if validated.pop(job_name, None) is not None:
+                        changed = True
+                    continue
+                validated[job_name] = key
+                changed = True
+            valid_jobs.add(job_name)
+        self._globalConf['validated_jobs'] = valid_jobs
+        if changed:
+            self.writeConfCache()
+        
+    def getPluginMapPath(self):
+        """Returns the path for the map of backup methods to plugin modules.
+        
+        @return: Path.
+        
+        """
+        return os.path.join(self._globalConf['state_dir'], 
+                            plugins.pluginMapFilename)
+    
+    def readPluginMap(self):
+        """Reads the map of backup methods to plugin modules saved by previous
+        runs.
+        
+        @return: Dictionary mapping plugin names to dictionaries of plugin 
+                 info with the stamp (path, mtime, size) of the module file.
+        
+        """
+        path = self.getPluginMapPath()
+        try:
+            fp = open(path, 'r')
+            try:
+                plugin_map = json.load(fp)
+            finally:
+                fp.close()
+        except (EnvironmentError, ValueError):
+            return {}
+        if not isinstance(plugin_map, dict):
+            return {}
+        return plugin_map
+    
+    def writePluginMap(self, plugin_map):
+        """Saves the map of backup methods to plugin modules. Failures are 
+        ignored, the plugins are imported on startup until the map is saved.
+        
+        @param plugin_map: Dictionary returned by readPluginMap.
+        
+        """
+        path = self.getPluginMapPath()
+        tmp_path = "%s.tmp" % path
+        try:
+            state_dir = os.path.dirname(path)
+            if not os.path.isdir(state_dir):
+                os.makedirs(state_dir)
+            fp = open(tmp_path, 'w')
+            try:
+                json.dump(plugin_map, fp, indent=2, sort_keys=True)
+                fp.write("\n")
+            finally:
+                fp.close()
+            os.rename(tmp_path, path)
+        except EnvironmentError, e:
+            logger.debug("Saving of backup plugin map failed: %s", str(e))
+        else:
+            logger.debug("Backup plugin map saved: %s", path)
+    
     def loadPlugins(self):
-        """Loads all backup plugins listed in configuration file.
+        """Registers all backup plugins listed in configuration file. The 
+        methods of plugins with unchanged module files are registered from the
+        plugin map saved by previous runs and the plugin modules are only 
+        imported when the methods are used by the jobs. 
         
         """
+        plugin_map = self.readPluginMap()
+        changed = False
+        for plugin in plugin_map.keys():
+            if not self._plugins.has_key(plugin):
+                del plugin_map[plugin]
+                changed = True
         for (plugin, module) in self._plugins.items():
+            stamp = plugins.getModuleStamp(module)
+            self._pluginStamps[plugin] = stamp
+            info = plugin_map.get(plugin)
+            if (isinstance(info, dict) and info.get('module') == module
+                and info.get('stamp') == stamp):
+                try:
+                    backupPluginRegistry.addPluginInfo(plugin, info)
+                    continue
+                except (KeyError, TypeError):
+                    pass
             backupPluginRegistry.loadPlugin(plugin, module)
+            info = backupPluginRegistry.getPluginInfo(plugin)
+            info['stamp'] = stamp
+            plugin_map[plugin] = info
+            changed = True
+        if changed and not self._globalConf.get('dry_run', False):
+            self.writePluginMap(plugin_map)
     
     def listJobs(self):
         """Lists all jobs defined in configuration file.
@@ -444,78 +810,638 @@ class JobManager:
             logger.info("Executing general post-execution script.")
             execExternalCmd(post_exec.split(), None, dry_run)
         
-    def runJobs(self):
-        """Runs the requested backup jobs. Backup jobs are either explicitly
-        listed on the command line or all active backup jobs in configuration
-        file are run.
+    def countJob(self, status):
+        """Updates job counters with the final status of a backup job. 
+        
+        @param status: Job status. (success, error or disabled)
         
         """
-        dry_run = self._globalConf.get('dry_run', False)
-        for job_name in self._jobs:
+        self._lock.acquire()
+        try:
             self._numJobs += 1
-            logmgr.setContext(job_name)
+            if status == 'success':
+                self._numJobsSuccess += 1
+            elif status == 'disabled':
+                self._numJobsDisabled += 1
+            else:
+                self._numJobsError += 1
+        finally:
+            self._lock.release()
+            
+    def recordJob(self, job_name, status, start_time, method_stats=None):
+        """Updates job counters and records the resource usage statistics for
+        the run report with the final status of a backup job.
+        
+        @param job_name:     Name of the backup job.
+        @param status:       Job status. (success, error or disabled)
+        @param start_time:   Start time of the job. (Unix time.)
+        @param method_stats: Dictionary of statistics returned by the backup
+                             method.
+        
+        """
+        wall_time = time.time() - start_time
+        cmd_stats = (method_stats or {}).get('commands', [])
+        outputs = [{'path': path, 'sha256': digest, 'size': size}
+                   for (path, digest, size) 
+                   in (method_stats or {}).get('outputs', [])]
+        job_path = os.path.join(self._globalConf['backup_path'], job_name)
+        stats = {'job': job_name,
+                 'method': (self._jobsConf.get(job_name) or {}).get('method'),
+                 'job_path': job_path,
+                 'status': status,
+                 'start_time': datetime.fromtimestamp(start_time).isoformat(),
+                 'wall_time': wall_time,
+                 'cpu_user': sum([cmd['cpu_user'] for cmd in cmd_stats]),
+                 'cpu_system': sum([cmd['cpu_system'] for cmd in cmd_stats]),
+                 'max_rss_kb': max([cmd['max_rss_kb'] for cmd in cmd_stats] 
+                                   or [0]),
+                 'bytes_written': 0,
+                 'throughput': None,
+                 'input_bytes': (method_stats or {}).get('input_bytes'),
+                 'commands': cmd_stats,
+                 'outputs': outputs,}
+        if status != 'disabled':
+            # Backup files reused from earlier runs and files hardlinked to
+            # previous backups are not included.
+            stats['bytes_written'] = (method_stats or {}).get('bytes_written', 
+                                                              0)
+            if wall_time > 0:
+                stats['throughput'] = stats['bytes_written'] / wall_time
+        if status != 'disabled':
+            logger.info("Job statistics - Time: %.1f s   CPU user/system: "
+                        "%.1f / %.1f s   Max RSS: %d KB   Bytes written: %d",
+                        wall_time, stats['cpu_user'], stats['cpu_system'],
+                        stats['max_rss_kb'], stats['bytes_written'])
+        self._lock.acquire()
+        try:
+            self._jobStats.append(stats)
+        finally:
+            self._lock.release()
+        self.countJob(status)
+        
+    def getReport(self):
+        """Returns the report of the backup run with the status, the resource 
+        usage statistics and the backup files of the backup jobs.
+        
+        @return: Dictionary.
+        
+        """
+        end_time = time.time()
+        return {'hostname': platform.node(),
+                  'backup_path': self._globalConf['backup_path'],
+                  'start_time': datetime.fromtimestamp(self._startTime).isoformat(),
+                  'end_time': datetime.fromtimestamp(end_time).isoformat(),
+                  'wall_time': end_time - self._startTime,
+                  'num_jobs': self._numJobs,
+                  'num_jobs_disabled': self._numJobsDisabled,
+                  'num_jobs_success': self._numJobsSuccess,
+                  'num_jobs_error': self._numJobsError,
+                  'jobs': self._jobStats,}
+        
+    def writeReport(self, report):
+        """Writes the JSON report with the resource usage statistics of the
+        backup jobs to the backup directory.
+        
+        @param report: Dictionary returned by getReport.
+        
+        """
+        if self._globalConf.get('dry_run', False):
+            return
+        report_path = os.path.join(self._globalConf['backup_path'],
+                                   self._globalConf['filename_report'])
+        tmp_path = "%s.tmp" % report_path
+        try:
+            fp = open(tmp_path, 'w')
+            try:
+                json.dump(report, fp, indent=2, sort_keys=True)
+                fp.write("\n")
+            finally:
+                fp.close()
+            os.rename(tmp_path, report_path)
+        except EnvironmentError, e:
+            logger.error("Writing of run report failed: %s", str(e))
+        else:
+            logger.debug("Run report written to file: %s", report_path)
+    
+    def getBackupBase(self):
+        """Returns the base backup directory. (Backup root directory or 
+        hostname subdirectory of backup root.)
+        
+        @return: Path.
+        
+        """
+        return self._globalConf['backup_base']
+    
+    def getCatalogPath(self):
+        """Returns the path for the catalog database.
+        
+        @return: Path.
+        
+        """
+        from pybackup import catalog
+        return (self._globalConf.get('catalog_path') 
+                or os.path.join(self._globalConf['state_dir'], 
+                                catalog.catalogFilename))
+        
+    def openCatalog(self):
+        """Opens the catalog database if the catalog is enabled.
+        
+        @return: BackupCatalog instance or None if the catalog is disabled.
+        
+        """
+        if (self._globalConf.get('dry_run', False)
+            or not parse_value(self._globalConf.get('catalog', 'yes'), True)):
+            return None
+        # The catalog and sqlite3 are only loaded by the runs that use them.
+        from pybackup import catalog
+        return catalog.BackupCatalog(self.getCatalogPath())
+        
+    def updateCatalog(self, report):
+        """Adds the backup run to the catalog.
+        
+        @param report: Dictionary returned by getReport.
+        
+        """
+        import sqlite3
+        try:
+            backup_catalog = self.openCatalog()
+            if backup_catalog is None:
+                return
+            try:
+                num_entries = backup_catalog.addRun(report)
+            finally:
+                backup_catalog.close()
+        except (errors.BackupError, sqlite3.Error, EnvironmentError), e:
+            logger.error("Update of backup catalog failed: %s", str(e))
+        else:
+            logger.debug("Backup catalog updated. Index entries: %d", 
+                         num_entries)
+    
+    def getSchedules(self):
+        """Returns the schedules of the active jobs with the schedule job 
+        option. Only the requested jobs are included, if jobs are requested.
+        
+        @return: Dictionary mapping job names to CronSchedule objects.
+        
+        """
+        from pybackup import schedule
+        schedules = {}
+        for job_name in self._jobs:
             job_conf = self._jobsConf.get(job_name)
-            if job_conf is not None:
-                active = parse_value(job_conf.get('active', 'yes'), True)
-                if active:       
-                    job_pre_exec = job_conf.get('job_pre_exec')
-                    job_post_exec = job_conf.get('job_post_exec')
-                    if job_pre_exec is not None:
-                        logger.info("Executing job pre-execution script.")
-                        try:
-                            execExternalCmd(job_pre_exec.split(), None, dry_run)
-                            job_pre_exec_ok = True
-                        except errors.ExternalCmdError, e:
-                            job_pre_exec_ok = False
-                            job_ok = False
-                            logger.error("Job pre-execution script failed.")
-                            logger.error(e.desc)
-                            for line in e:
-                                logger.error("  %s" , line)
-                            
-                    else:
+            if job_conf is None:
+                raise errors.BackupFatalConfigError("No configuration found "
+                                                    "for backup job: %s" 
+                                                    % job_name)
+            spec = job_conf.get('schedule')
+            if spec is None:
+                continue
+            if not parse_value(job_conf.get('active', 'yes'), True):
+                continue
+            try:
+                schedules[job_name] = schedule.CronSchedule(spec)
+            except errors.BackupConfigError, e:
+                raise errors.BackupFatalConfigError("Invalid schedule for "
+                                                    "backup job %s." % job_name,
+                                                    *list(e))
+        return schedules
+    
+    def getDaemonSocket(self):
+        """Returns the path for the Unix socket of the daemon.
+        
+        @return: Path.
+        
+        """
+        from pybackup import daemon
+        return self._globalConf.get('daemon_socket',
+                                    os.path.join(self._globalConf['state_dir'],
+                                                 daemon.defaultSocketName))
+    
+    def runDaemon(self):
+        """Runs the daemon for executing the jobs on their schedules and on
+        request, keeping the plugins and the parsed configuration loaded.
+        
+        """
+        from pybackup import daemon
+        if not self.getSchedules():
+            logger.warning("No active backup jobs with schedule defined, only "
+                           "jobs requested through the daemon socket are run.")
+        if self._confCache is not None:
+            file_cache = self._confCache['files']
+        else:
+            file_cache = None
+        backup_daemon = daemon.BackupDaemon(self.__class__, self._cmdConf, 
+                                            self._reqJobs, file_cache)
+        started = self.startPluginWorkers(self._jobsConf.keys())
+        try:
+            backup_daemon.run()
+        finally:
+            self.stopPluginWorkers(started)
+    
+    def submitJobs(self):
+        """Requests the run of the jobs from the running daemon.
+        
+        """
+        from pybackup import daemon
+        reply = daemon.submitRequest(self.getDaemonSocket(),
+                                     {'command': 'run',
+                                      'jobs': self._reqJobs,
+                                      'dry_run': self._globalConf.get('dry_run',
+                                                                      False),
+                                      'resume': self._globalConf.get('resume',
+                                                                     False),})
+        logger.info("Run of jobs requested from backup daemon. %s", 
+                    reply.get('message'))
+    
+    def printDaemonStatus(self):
+        """Prints the status of the running daemon.
+        
+        """
+        from pybackup import daemon
+        reply = daemon.submitRequest(self.getDaemonSocket(), 
+                                     {'command': 'status'})
+        print "PID: %s   Started: %s" % (reply['pid'], reply['start_time'])
+        print "Running: %s" % ', '.join(reply['running'] or ['-'])
+        for jobs in reply['queued']:
+            print "Queued: %s" % ', '.join(jobs)
+        for job_name in sorted(reply['schedules'].keys()):
+            sched = reply['schedules'][job_name]
+            print "Job Name: %s   Schedule: %s    Next Run: %s" % (
+                job_name, sched['schedule'], sched['next_run'])
+    
+    def getConcurrencyLimits(self):
+        """Returns the limits for the number of jobs run in parallel for 
+        concurrency groups defined by the concurrency_limits general option.
+        
+        @return: Dictionary mapping concurrency groups to job limits.
+        
+        """
+        limits = {}
+        conf = self._globalConf.get('concurrency_limits')
+        if conf is not None:
+            for item in re.split('\s*,\s*|\s+', conf.strip()):
+                try:
+                    (group, limit) = item.rsplit(':', 1)
+                    limits[group] = int(limit)
+                except ValueError:
+                    raise errors.BackupFatalConfigError("Invalid entry in "
+                                                        "concurrency_limits "
+                                                        "general option: %s"
+                                                        % item)
+        return limits
+    
+    def runJob(self, job_name):
+        """Runs a single backup job including job pre / post execution scripts
+        and updates the job counters.
+        
+        @param job_name: Name of the backup job.
+        
+        """
+        dry_run = self._globalConf.get('dry_run', False)
+        start_time = time.time()
+        method_stats = None
+        logmgr.setContext(job_name)
+        job_conf = self._jobsConf.get(job_name)
+        if job_conf is not None:
+            active = parse_value(job_conf.get('active', 'yes'), True)
+            if active:       
+                job_pre_exec = job_conf.get('job_pre_exec')
+                job_post_exec = job_conf.get('job_post_exec')
+                if job_pre_exec is not None:
+                    logger.info("Executing job pre-execution script.")
+                    try:
+                        execExternalCmd(job_pre_exec.split(), None, dry_run)
                         job_pre_exec_ok = True
-                    if job_pre_exec_ok:
-                        try:
-                            logger.info("Starting execution of backup job.")
-                            job = BackupJob(job_name, self._globalConf, job_conf)
-                            job.run()
-                            logger.info("Finished execution of backup job.")
-                            job_ok = True
-                        except errors.BackupError, e:
-                            logger.error("Execution of backup job failed.")
-                            job_ok = False
-                            if e.trace or e.fatal:
-                                raise
+                    except errors.ExternalCmdError, e:
+                        job_pre_exec_ok = False
+                        job_ok = False
+                        logger.error("Job pre-execution script failed.")
+                        logger.error(e.desc)
+                        for line in e:
+                            logger.error("  %s" , line)
+                        
+                else:
+                    job_pre_exec_ok = True
+                if job_pre_exec_ok:
+                    try:
+                        logger.info("Starting execution of backup job.")
+                        job = BackupJob(job_name, self._globalConf, job_conf)
+                        method_stats = job.run()
+                        logger.info("Finished execution of backup job.")
+                        job_ok = True
+                    except errors.BackupError, e:
+                        logger.error("Execution of backup job failed.")
+                        job_ok = False
+                        if e.trace or e.fatal:
+                            self.recordJob(job_name, 'error', start_time)
+                            raise
+                        else:
+                            if e.fatal:
+                                level = logging.CRITICAL
                             else:
-                                if e.fatal:
-                                    level = logging.CRITICAL
-                                else:
-                                    level = logging.ERROR
-                                logger.log(level, e.desc)
-                                for line in e:
-                                    logger.log(level, "  %s" , line)
-                    if job_post_exec is not None and job_pre_exec_ok:
-                        logger.info("Executing job post-execution script.")
-                        try:
-                            execExternalCmd(job_post_exec.split(), None, dry_run)
-                        except errors.ExternalCmdError, e:
-                            job_ok = False
-                            logger.error("Job pre-execution script failed.")
-                            logger.error(e.desc)
+                                level = logging.ERROR
+                            logger.log(level, e.desc)
                             for line in e:
-                                logger.error("  %s" , line)
-                    if job_ok:
-                        self._numJobsSuccess += 1
-                    else:
-                        self._numJobsError += 1
+                                logger.log(level, "  %s" , line)
+                if job_post_exec is not None and job_pre_exec_ok:
+                    logger.info("Executing job post-execution script.")
+                    try:
+                        execExternalCmd(job_post_exec.split(), None, dry_run)
+                    except errors.ExternalCmdError, e:
+                        job_ok = False
+                        logger.error("Job pre-execution script failed.")
+                        logger.error(e.desc)
+                        for line in e:
+                            logger.error("  %s" , line)
+                if job_ok:
+                    self.recordJob(job_name, 'success', start_time, 
+                                   method_stats)
                 else:
-                    logger.warn("Backup job disabled by configuration.")
-                    self._numJobsDisabled += 1
+                    self.recordJob(job_name, 'error', start_time, method_stats)
             else:
-                logger.error("No configuration found for backup job.")
-                self._numJobsError += 1
+                logger.warn("Backup job disabled by configuration.")
+                self.recordJob(job_name, 'disabled', start_time)
+        else:
+            logger.error("No configuration found for backup job.")
+            self.recordJob(job_name, 'error', start_time)
+            
+    def runJobsParallel(self, max_parallel_jobs):
+        """Runs the requested backup jobs in parallel. At most max_parallel_jobs
+        jobs are run at the same time and the jobs in each concurrency group 
+        (concurrency_group job option) are limited by the concurrency_limits 
+        general option. The jobs are started in the order in which they are 
+        requested. No new jobs are started after a fatal error, the error is 
+        raised once the running jobs are finished.
+        
+        @param max_parallel_jobs: Maximum number of jobs run in parallel.
+        
+        """
+        group_limits = self.getConcurrencyLimits()
+        pending = list(self._jobs)
+        group_count = {}
+        state = {'running': 0, 'error': None}
+        cond = threading.Condition()
+        
+        def get_group(job_name):
+            job_conf = self._jobsConf.get(job_name) or {}
+            return job_conf.get('concurrency_group')
+        
+        def run_job(job_name, group):
+            try:
+                try:
+                    self.runJob(job_name)
+                except:
+                    state['error'] = state['error'] or sys.exc_info()
+            finally:
+                cond.acquire()
+                try:
+                    state['running'] -= 1
+                    if group is not None:
+                        group_count[group] -= 1
+                    cond.notify()
+                finally:
+                    cond.release()
+        
+        cond.acquire()
+        try:
+            while (pending and state['error'] is None) or state['running'] > 0:
+                started = False
+                if state['error'] is None and state['running'] < max_parallel_jobs:
+                    for job_name in pending:
+                        group = get_group(job_name)
+                        if (group is None or group_count.get(group, 0) 
+                            < group_limits.get(group, 1)):
+                            pending.remove(job_name)
+                            state['running'] += 1
+                            if group is not None:
+                                group_count[group] = group_count.get(group, 0) + 1
+                            thread = threading.Thread(target=run_job, 
+                                                      name="job-%s" % job_name,
+                                                      args=(job_name, group))
+                            thread.setDaemon(True)
+                            thread.start()
+                            started = True
+                            break
+                if not started:
+                    cond.wait(1.0)
+        finally:
+            cond.release()
+        if state['error'] is not None:
+            (exc_type, exc_value, exc_tb) = state['error']
+            raise exc_type, exc_value, exc_tb
+        
+    def runJobs(self):
+        """Runs the requested backup jobs. Backup jobs are either explicitly
+        listed on the command line or all active backup jobs in configuration
+        file are run.
+        
+        """
+        try:
+            max_parallel_jobs = int(self._globalConf['max_parallel_jobs'])
+        except ValueError:
+            raise errors.BackupFatalConfigError("Invalid value for general option"
+                                                " max_parallel_jobs: %s" 
+                                                % self._globalConf['max_parallel_jobs'])
+        if max_parallel_jobs > 1 and len(self._jobs) > 1:
+            self.runJobsParallel(max_parallel_jobs)
+        else:
+            for job_name in self._jobs:
+                self.runJob(job_name)
     
+    def verifyBackups(self):
+        """Verifies the backup files in the dated backup directories selected
+        by the command line arguments against the checksum manifests of the 
+        backup jobs.
+        
+        """
+        from pybackup import verify
+        backup_base = self._globalConf['backup_base']
+        date_dirs = utils.getBackupDateDirs(backup_base)
+        if self._verify:
+            date_dirs = verify.parseDateRanges(self._verify, date_dirs)
+        else:
+            date_dirs = date_dirs[:1]
+        if not date_dirs:
+            raise errors.BackupFatalEnvironmentError("No backup directories "
+                                                     "found for verification "
+                                                     "in: %s" % backup_base)
+        num_workers = self._globalConf.get('verify_workers')
+        if num_workers is not None:
+            if not re.match('\d+$', num_workers) or int(num_workers) < 1:
+                raise errors.BackupFatalConfigError("Invalid value for general "
+                                                    "option verify_workers: %s"
+                                                    % num_workers)
+            num_workers = int(num_workers)
+        logger.info("Starting verification of backups: %s", 
+                    ', '.join(date_dirs))
+        def log_result(path, size, error):
+            if error is None:
+                logger.debug("Verified backup file: %s (%d bytes)", path, size)
+            else:
+                logger.error("Verification of backup file failed: %s  %s",
+                             path, error)
+        start_time = time.time()
+        (num_files, total_size, failures) = verify.verifyBackups(
+            [os.path.join(backup_base, name) for name in date_dirs],
+            num_workers, log_result)
+        wall_time = time.time() - start_time
+        logger.info("Finished verification of backups. Files: %d   "
+                    "Failed: %d   Bytes read: %d   Time: %.1f s",
+                    num_files, len(failures), total_size, wall_time)
+        if failures:
+            raise errors.BackupFatalEnvironmentError(
+                "Verification of %d backup files failed." % len(failures),
+                *["%s: %s" % failure for failure in failures])
+            
+    def getRetentionPolicy(self, job_name):
+        """Returns the retention policy for the backups of a job. The job 
+        options retain_daily, retain_weekly and retain_monthly override the
+        general options with the same names.
+        
+        @param job_name: Name of the backup job.
+        @return:         Tuple of (daily, weekly, monthly) number of backups to
+                         retain or None if no retention policy is defined and 
+                         backups are retained indefinitely.
+        
+        """
+        from pybackup import retention
+        job_conf = self._jobsConf.get(job_name) or {}
+        defined = False
+        policy = []
+        for opt in retention.retentionOpts:
+            val = job_conf.get(opt, self._globalConf.get(opt))
+            if val is None:
+                val = '0'
+            else:
+                defined = True
+            if not re.match('\d+$', val):
+                raise errors.BackupFatalConfigError("Invalid value for option "
+                                                    "%s of job %s: %s" 
+                                                    % (opt, job_name, val))
+            policy.append(int(val))
+        if not defined:
+            return None
+        if sum(policy) == 0:
+            raise errors.BackupFatalConfigError("The retention policy for job "
+                                                "%s does not retain any "
+                                                "backups." % job_name)
+        return tuple(policy)
+            
+    def pruneBackups(self):
+        """Removes the backups expired by the retention policy. Dated backup
+        directories are removed when the backups of all jobs in the directory
+        have expired, otherwise only the expired job directories are removed.
+        
+        """
+        from pybackup import retention
+        logmgr.setContext('PRUNE')
+        dry_run = self._globalConf.get('dry_run', False)
+        backup_base = self._globalConf['backup_base']
+        date_dirs = utils.getBackupDateDirs(backup_base)
+        (expired_dirs, expired_paths) = retention.getExpired(
+            backup_base, date_dirs, self.getRetentionPolicy)
+        paths = expired_dirs + expired_paths
+        if not paths:
+            logger.info("No expired backups found in: %s", backup_base)
+            return
+        for path in paths:
+            logger.info("Removing expired backup: %s", path)
+        if dry_run:
+            return
+        num_workers = self._globalConf.get('prune_workers')
+        if num_workers is None:
+            num_workers = compress.getNumCPUs()
+        elif re.match('\d+$', num_workers) and int(num_workers) > 0:
+            num_workers = int(num_workers)
+        else:
+            raise errors.BackupFatalConfigError("Invalid value for general "
+                                                "option prune_workers: %s"
+                                                % num_workers)
+        start_time = time.time()
+        failed = retention.removeTrees(paths, num_workers)
+        backup_catalog = self.openCatalog()
+        if backup_catalog is not None:
+            try:
+                backup_catalog.removePaths([path for path in paths
+                                            if not os.path.exists(path)])
+            finally:
+                backup_catalog.close()
+        logger.info("Finished removal of %d expired backups. Failures: %d   "
+                    "Time: %.1f s", len(paths), len(failed), 
+                    time.time() - start_time)
+        if failed:
+            raise errors.BackupEnvironmentError(
+                "Removal of %d expired backup paths failed." % len(failed),
+                *["%s: %s" % failure for failure in failed])
+    
+    def getPluginJobs(self, job_names):
+        """Returns the configuration of jobs grouped by the plugin classes 
+        implementing their backup methods. Jobs with unknown methods are 
+        skipped; their errors are reported on execution of the jobs.
+        
+        @param job_names: List of job names.
+        @return:          Dictionary of lists of job configuration 
+                          dictionaries indexed by plugin class.
+        
+        """
+        plugin_jobs = {}
+        for job_name in job_names:
+            job_conf = self._jobsConf.get(job_name)
+            if not job_conf:
+                continue
+            try:
+                cls = backupPluginRegistry.getMethodClass(job_conf.get('method'))
+            except errors.BackupConfigError:
+                cls = None
+            if cls is not None:
+                conf = dict(job_conf)
+                conf['job_name'] = job_name
+                plugin_jobs.setdefault(cls, []).append(conf)
+        return plugin_jobs
+    
+    def startPluginWorkers(self, job_names):
+        """Starts the worker processes shared by the active jobs of each 
+        plugin. Must be called from the main thread before the threads running
+        the jobs are started; processes are not forked safely once other 
+        threads may hold locks.
+        
+        @param job_names: List of job names.
+        @return:          List of plugin classes that started workers.
+        
+        """
+        started = []
+        plugin_jobs = self.getPluginJobs(job_names)
+        for (cls, jobs_conf) in plugin_jobs.items():
+            jobs_conf = [job_conf for job_conf in jobs_conf
+                         if parse_value(job_conf.get('active', 'yes'), True)]
+            if cls.startWorkers(self._globalConf, jobs_conf):
+                started.append(cls)
+        return started
+    
+    def stopPluginWorkers(self, started):
+        """Stops the worker processes started by startPluginWorkers.
+        
+        @param started: List of plugin classes that started workers.
+        
+        """
+        for cls in started:
+            try:
+                cls.stopWorkers()
+            except Exception, e:
+                logger.error("Stopping the workers of plugin class %s failed: "
+                             "%s", cls.__name__, str(e))
+    
+    def collectGarbage(self):
+        """Removes the data of the storage shared by the backup jobs, like the
+        chunks of deduplication repositories, that is no longer referenced by
+        any backup. The collection is done by the plugins of all configured 
+        jobs.
+        
+        """
+        logmgr.setContext('COLLECT')
+        plugin_jobs = self.getPluginJobs(self._jobsConf.keys())
+        for (cls, jobs_conf) in plugin_jobs.items():
+            cls.collectGarbage(self._globalConf, jobs_conf)
+            
     def run(self):
         """Runs backup process.
         
@@ -534,14 +1460,57 @@ class JobManager:
                 self.helpJob()
             elif self._help == 'help-method':
                 self.helpMethod(self._jobs[0])
+        elif self._verify is not None:
+            self.checkUser()
+            self.loggingConfig(log_file=False)
+            self.verifyBackups()
+        elif self._prune or self._collect:
+            self.checkUser()
+            self.loggingConfig(log_file=False)
+            if self._prune:
+                self.pruneBackups()
+            if self._collect:
+                self.collectGarbage()
+        elif self._daemonStatus:
+            self.printDaemonStatus()
+        elif self._submit:
+            self.loggingConfig(log_file=False)
+            self.submitJobs()
+        elif self._daemon:
+            self.checkUser()
+            self.initUmask()
+            self.loggingConfig(log_file=False)
+            self.runDaemon()
         else:
             self.checkUser()
             self.initUmask()
             self.createBaseDir()
             self.loggingConfig()
-            self.preExec()
-            self.runJobs()
-            self.postExec()
+            self.validateJobs()
+            try:
+                self.preExec()
+                started = self.startPluginWorkers(self._jobs)
+                try:
+                    self.runJobs()
+                finally:
+                    self.stopPluginWorkers(started)
+                self.postExec()
+                if parse_value(self._globalConf.get('prune_after_run'), True):
+                    if self._numJobsError > 0:
+                        logger.warning("Removal of expired backups skipped "
+                                       "because of failed backup jobs.")
+                    else:
+                        self.pruneBackups()
+                if parse_value(self._globalConf.get('collect_after_run'), True):
+                    if self._numJobsError > 0:
+                        logger.warning("Collection of unreferenced data skipped "
+                                       "because of failed backup jobs.")
+                    else:
+                        self.collectGarbage()
+            finally:
+                report = self.getReport()
+                self.writeReport(report)
+                self.updateCatalog(report)
         self.loggingEnd()
         
 
@@ -603,14 +1572,29 @@ class BackupJob:
                                                     % path)
             logger.debug("Backup job directory (%s) created.", path)
     
+    def validate(self):
+        """Validates the job options for the backup method defined in the 
+        configuration file for the backup job.
+        
+        """
+        method = self._jobConf.get('method')
+        if backupPluginRegistry.hasMethod(method):
+            backupPluginRegistry.validateJobConf(method, self._jobConf)
+        else:
+            raise errors.BackupConfigError("Invalid backup method. "
+                                           "Backup method %s not registered." 
+                                           % method)
+            
     def runMethod(self):
         """Runs backup method defined in the configuration file for the backup 
         job.
         
+        @return: Dictionary of resource usage statistics.
+        
         """
         method = self._jobConf.get('method')
         if backupPluginRegistry.hasMethod(method):
-            backupPluginRegistry.runMethod(method,
+            return backupPluginRegistry.runMethod(method,
                                            self._globalConf, 
                                            self._jobConf)
         else:
@@ -618,13 +1602,39 @@ class BackupJob:
                                            "Backup method %s not registered." 
                                            % method)
             
+    def writeChecksumManifest(self, outputs):
+        """Writes the checksum manifest for the backup files generated by the
+        job to the job directory.
+        
+        @param outputs: List of (path, sha256, size) tuples for backup files.
+        
+        """
+        if self._globalConf.get('dry_run', False):
+            return
+        job_path = self._jobConf['job_path']
+        manifest_path = os.path.join(job_path, fsutils.checksumManifestName)
+        entries = [(os.path.relpath(path, job_path), digest, size)
+                   for (path, digest, size) in outputs]
+        try:
+            fsutils.writeChecksumManifest(manifest_path, entries)
+        except EnvironmentError, e:
+            raise errors.BackupError("Writing of checksum manifest failed: %s"
+                                     % manifest_path,
+                                     "Error Message: %s" % str(e))
+        logger.debug("Checksum manifest for %d backup files written: %s",
+                     len(entries), manifest_path)
+            
     def run(self):
         """Runs backup job.
+        
+        @return: Dictionary of resource usage statistics.
 
         """
         self.checkUser()
         self.initJobDir()
-        self.runMethod()
+        stats = self.runMethod()
+        self.writeChecksumManifest(stats.get('outputs', []))
+        return stats
 
 
 
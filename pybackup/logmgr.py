@@ -2,7 +2,9 @@
 
 """
 
+import os
 import logging
+import threading
 
 
 __author__ = "Ali Onur Uyar"
@@ -31,19 +33,35 @@ class LogContext(logging.Filter):
     def __init__(self, context, test_run=None):
         if test_run is None:
             test_run = False
+        self._local = threading.local()
+        self._context = None
         self.setContext(context, test_run)
         logging.Filter.__init__(self)
     
     def setContext(self, context, test_run=None):
+        """Sets the context for log entries. The context set from the main 
+        thread is the default context for all threads, the context set from 
+        other threads (parallel backup jobs) is local to the thread.
+        
+        """
         if test_run is not None:
             self._testRun = test_run
-        if self._testRun:
-            self._context = "TEST-%s" % context
-        else:
-            self._context = context    
+        if (self._context is None 
+            or threading.currentThread().getName() == 'MainThread'):
+            self._context = context
+        self._local.context = context
+        
+    def getContext(self):
+        """Returns the context for log entries of the current thread.
+        
+        """
+        return getattr(self._local, 'context', self._context)
     
     def filter(self, record):
-        record.context = self._context
+        if self._testRun:
+            record.context = "TEST-%s" % self.getContext()
+        else:
+            record.context = self.getContext()
         return True
 
 
@@ -67,6 +85,9 @@ class LogManager:
         
     def setContext(self, context, test_run=None):
         self._logContext.setContext(context, test_run)
+        
+    def getContext(self):
+        return self._logContext.getContext()
     
     def configConsole(self, level):
         if level < self._minLevel:
@@ -78,6 +99,12 @@ class LogManager:
         if level < self._minLevel:
             self._minLevel = level
             self._logger.setLevel(level)
+        if (self._handlerLogFile is not None and path is not None
+            and self._handlerLogFile.baseFilename != os.path.abspath(path)):
+            # Long-running processes switch to the log file of the new run.
+            self._logger.removeHandler(self._handlerLogFile)
+            self._handlerLogFile.close()
+            self._handlerLogFile = None
         if self._handlerLogFile is None and path is not None:
             self._handlerLogFile = logging.FileHandler(path)
             self._handlerLogFile.setLevel(level)
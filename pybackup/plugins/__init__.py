@@ -5,11 +5,19 @@
 import imp
 import sys
 import os
+import re
+import time
+import json
 import types
+import threading
+import Queue
 import subprocess
 from pybackup import errors
 from pybackup import utils
-from pybackup.logmgr import logger
+from pybackup import compress
+from pybackup import fsutils
+from pybackup import priority
+from pybackup.logmgr import logger, logmgr
 
 __author__ = "Ali Onur Uyar"
 __copyright__ = "Copyright 2011, Ali Onur Uyar"
@@ -23,6 +31,11 @@ __status__ = "Development"
 
 # Defaults
 bufferSize = 8192
+estimateHistoryRuns = 5
+"""Number of previous runs of job used for predicting the duration of runs."""
+pluginMapFilename = 'plugin_map.json'
+"""Filename for the map of backup methods to plugin modules in the state
+directory."""
 
 
 def loadModule(module):
@@ -66,6 +79,33 @@ def loadModule(module):
         
     return load_module(module)
 
+def getModuleStamp(module):
+    """Returns the path, the modification time and the size of the file of a 
+    module without importing the module. The parent packages are imported.
+    
+    @param module: Module name.
+    @return:       List of [path, mtime, size].
+    
+    """
+    (parent, sep, name) = module.rpartition('.') #@UnusedVariable
+    fp = None
+    try:
+        try:
+            if parent:
+                path = loadModule(parent).__path__
+            else:
+                path = None
+            (fp, pathname, description) = imp.find_module(name, path)
+            if description[2] == imp.PKG_DIRECTORY:
+                pathname = os.path.join(pathname, '__init__.py')
+            st = os.stat(pathname)
+        except (ImportError, AttributeError, OSError), e:
+            raise errors.BackupConfigError("Failed locating backup plugin "
+                                           "module: %s" % module, str(e))
+    finally:
+        if fp:
+            fp.close()
+    return [pathname, st.st_mtime, st.st_size]
     
     
 class BackupPluginRegistry:
@@ -79,6 +119,68 @@ class BackupPluginRegistry:
         """
         self._plugins = {}
         self._methodDict = {}
+        self._lazyMethods = {}
+        self._lock = threading.RLock()
+        
+    def addPluginInfo(self, plugin, info):
+        """Registers the backup methods of a plugin from cached plugin info 
+        without importing the plugin module. The module is imported on the 
+        first use of any of the methods.
+        
+        @param plugin: Plugin name.
+        @param info:   Dictionary returned by getPluginInfo.
+        
+        """
+        self._lock.acquire()
+        try:
+            if self._plugins.has_key(plugin):
+                return
+            self._plugins[plugin] = {'module': info['module'],
+                                     'description': info['description'],
+                                     'methods': list(info['methods']),
+                                     'loaded': False}
+            for name in info['methods']:
+                self._lazyMethods[name] = plugin
+        finally:
+            self._lock.release()
+        logger.debug("Backup plugin registered: %s    Module: %s" 
+                     % (plugin, info['module']))
+        
+    def getPluginInfo(self, plugin):
+        """Returns the plugin info for caching the registration of a loaded
+        plugin.
+        
+        @param plugin: Plugin name.
+        @return:       Dictionary with the entries module, description and 
+                       methods.
+        
+        """
+        entry = self._plugins[plugin]
+        return {'module': entry['module'],
+                'description': entry['description'],
+                'methods': entry['methods'],}
+        
+    def _getMethod(self, name):
+        """Returns the class and the function name for backup method, 
+        importing the plugin module if the method was registered from cached
+        plugin info.
+        
+        @param name: Name of method.
+        @return:     Tuple of (class, function name) or None.
+        
+        """
+        self._lock.acquire()
+        try:
+            if not self._methodDict.has_key(name) and self._lazyMethods.has_key(name):
+                plugin = self._lazyMethods[name]
+                self.loadPlugin(plugin, self._plugins[plugin]['module'])
+                if not self._methodDict.has_key(name):
+                    raise errors.BackupConfigError(
+                        "Backup method %s is no longer defined by plugin %s."
+                        % (name, plugin))
+            return self._methodDict.get(name)
+        finally:
+            self._lock.release()
         
     def loadPlugin(self, plugin, module):
         """
@@ -88,7 +190,14 @@ class BackupPluginRegistry:
         @return:       Module object.
               
         """
-        if not self._plugins.has_key(module):
+        self._lock.acquire()
+        try:
+            return self._loadPlugin(plugin, module)
+        finally:
+            self._lock.release()
+        
+    def _loadPlugin(self, plugin, module):
+        if not self._plugins.get(plugin, {}).get('loaded', False):
             # Fast path: see if the module has already been imported.
             if sys.modules.has_key(module):
                 modobj = sys.modules[module]
@@ -100,8 +209,9 @@ class BackupPluginRegistry:
                         "Failed loading backup plugin: %s   Module: %s" 
                         % (plugin, module), str(e))
             self._plugins[plugin] = {'module': module,
-                                     'desc': '', 
-                                     'methods': []}
+                                     'description': '', 
+                                     'methods': [],
+                                     'loaded': True}
             logger.debug("Backup plugin loaded: %s    Module: %s" % (plugin, 
                                                                      module))
             if hasattr(modobj, 'methodList'):
@@ -172,6 +282,32 @@ class BackupPluginRegistry:
             raise errors.BackupConfigError("Invalid backup plugin name: %s"
                                            % plugin)
     
+    def getMethodPlugin(self, name):
+        """Returns the name of the plugin registering a backup method.
+        
+        @param name: Name of method.
+        @return:     Plugin name or None.
+        
+        """
+        if self._lazyMethods.has_key(name):
+            return self._lazyMethods[name]
+        for (plugin, entry) in self._plugins.items():
+            if name in entry['methods']:
+                return plugin
+        return None
+    
+    def getMethodClass(self, name):
+        """Returns the plugin class implementing a backup method.
+        
+        @param name: Name of method.
+        @return:     Class or None.
+        
+        """
+        method = self._getMethod(name)
+        if method is not None:
+            return method[0]
+        return None
+    
     def hasMethod(self, name):
         """Returns True if method with name is registered.
         
@@ -179,7 +315,7 @@ class BackupPluginRegistry:
         @return:     Boolean
         
         """
-        return self._methodDict.has_key(name)
+        return self._methodDict.has_key(name) or self._lazyMethods.has_key(name)
     
     def runMethod(self, name, global_conf, job_conf):
         """Runs method.
@@ -187,12 +323,30 @@ class BackupPluginRegistry:
         @param name:        Backup method name.
         @param global_conf: Dictionary of general configuration options.
         @param job_conf:    Dictionary of job configuration options.
+        @return:            Dictionary of resource usage statistics.
         
         """
-        if self._methodDict.has_key(name):
-            (cls, func) = self._methodDict[name]
+        method = self._getMethod(name)
+        if method is not None:
+            (cls, func) = method
             obj = cls(global_conf, job_conf)
             getattr(obj, func)()
+            return obj.getStats()
+        else:
+            raise errors.BackupConfigError("Invalid backup method name: %s"
+                                           % name)
+    
+    def validateJobConf(self, name, job_conf):
+        """Validates the job options for backup method.
+        
+        @param name:     Backup method name.
+        @param job_conf: Dictionary of job configuration options.
+        
+        """
+        method = self._getMethod(name)
+        if method is not None:
+            (cls, func) = method #@UnusedVariable
+            cls.validateJobConf(job_conf)
         else:
             raise errors.BackupConfigError("Invalid backup method name: %s"
                                            % name)
@@ -204,8 +358,9 @@ class BackupPluginRegistry:
         @return:     Multi-line help text for method.
         
         """
-        if self._methodDict.has_key(name):
-            (cls, func) = self._methodDict[name] #@UnusedVariable
+        method = self._getMethod(name)
+        if method is not None:
+            (cls, func) = method #@UnusedVariable
             return cls.getHelpText()
         else:
             None
@@ -228,7 +383,54 @@ class BackupPluginBase:
                  'method': 'Backup plugin method name.',
                  'user': 'If defined, check if script is being run by user.',
                  'job_pre_exec': 'Script to be executed before backup job.',
-                 'job_post_exec': 'Script to be executed after backup job.',}
+                 'job_post_exec': 'Script to be executed after backup job.',
+                 'concurrency_group': 'Concurrency group for limiting the number '
+                                      'of jobs run in parallel.',
+                 'schedule': 'Schedule for running the job in daemon mode '
+                             'in crontab format. (Example: 30 2 * * *)',
+                 'compress_engine': 'Engine for compression of backup files. '
+                                    '(external: cmd_compress, internal: '
+                                    'multi-threaded in-process compression) '
+                                    '(Default: external)',
+                 'compress_codec': 'Codec for internal compression engine. '
+                                   '(zlib, bz2 or lzma) (Default: zlib)',
+                 'compress_level': 'Compression level. (Default level of the '
+                                   'codec by default.)',
+                 'compress_threads': 'Number of threads for internal compression '
+                                     'engine. (Number of CPUs by default.)',
+                 'compress_blocksize': 'Block size in bytes for internal '
+                                       'compression engine. (Default: 1048576)',
+                 'retain_daily': 'Number of daily backups of job to retain. '
+                                 '(General option by default.)',
+                 'retain_weekly': 'Number of weekly backups of job to retain. '
+                                  '(General option by default.)',
+                 'retain_monthly': 'Number of monthly backups of job to '
+                                   'retain. (General option by default.)',
+                 'nice_level': 'Nice level for backup commands. (-20 - 19) '
+                               '(General option by default.)',
+                 'ionice_class': 'I/O scheduling class for backup commands. '
+                                 '(realtime, best-effort or idle) (General '
+                                 'option by default.)',
+                 'ionice_level': 'I/O scheduling priority level for backup '
+                                 'commands. (0 - 7) (General option by '
+                                 'default.)',
+                 'cpu_affinity': 'List of CPUs for backup commands. '
+                                 '(Example: 0-3,6) (General option by '
+                                 'default.)',
+                 'throttle_load': 'Delay the start of backup commands while '
+                                  'the load average is above the limit. '
+                                  '(General option by default.)',
+                 'throttle_disk_latency': 'Delay the start of backup commands '
+                                          'while the average latency of disk '
+                                          'I/O in milliseconds is above the '
+                                          'limit. (General option by '
+                                          'default.)',
+                 'throttle_interval': 'Interval in seconds between checks of '
+                                      'the load while tasks are delayed. '
+                                      '(Default: 10)',
+                 'throttle_max_wait': 'Maximum delay in seconds for the start '
+                                      'of a task. (No limit if 0.) '
+                                      '(Default: 3600)',}
     """Configuration options common to all plugins."""
     
     _extOpts = {}
@@ -245,7 +447,8 @@ class BackupPluginBase:
                          'cmd_tar', 'suffix_tar', 'suffix_tgz',)
     """List of required general configuration options common to all plugins."""
     
-    _baseDefaults = {}
+    _baseDefaults = {'compress_engine': 'external',
+                     'compress_codec': 'zlib',}
     """Dictionary of defaults for all plugins."""
     
     _extDefaults = {}
@@ -262,23 +465,256 @@ class BackupPluginBase:
         """
         self._conf = {}
         self._env = None
+        self._cmdStats = []
+        self._outputHashes = {}
+        self._inputBytes = None
+        self._bytesWritten = 0
+        self._statsLock = threading.Lock()
         self._dryRun = global_conf.get('dry_run', False)
+        self._resume = global_conf.get('resume', False)
+        self._units = {}
+        self._unitOutputs = {}
+        self._unitLocal = threading.local()
         for k in self._globalReqOptList:
             if not global_conf.has_key(k):
                 raise errors.BackupFatalConfigError("Required global configuration "
                                                     "option %s not defined." % k)
-        for k in self._baseReqOptList + self._extReqOptList:
+        if job_conf.get('job_name') not in global_conf.get('validated_jobs', ()):
+            self.validateJobConf(job_conf)
+        self._conf.update(self._baseDefaults)
+        self._conf.update(self._extDefaults)
+        self._conf.update(global_conf)
+        self._conf.update(job_conf)
+        self._initCompress()
+        self._initPriority()
+        self._initCheckpoint()
+        
+    @classmethod
+    def validateJobConf(cls, job_conf):
+        """Checks that the required job options are defined and that all job 
+        options are valid for the backup method. The Job Manager caches the
+        results of the validation and passes the validated jobs in the 
+        validated_jobs general option, the options of these jobs are not 
+        checked again on execution.
+        
+        @param job_conf: Dictionary of job configuration options.
+        
+        """
+        for k in cls._baseReqOptList + cls._extReqOptList:
             if not job_conf.has_key(k):
                 raise errors.BackupConfigError("Required job configuration "
                                                "option %s not defined." % k)
+        cmd_opts = cls.getCmdOpts()
         for k in job_conf:
-            if not (self._baseOpts.has_key(k) or self._extOpts.has_key(k)):
+            if not (cls._baseOpts.has_key(k) or cls._extOpts.has_key(k)
+                    or cmd_opts.has_key(k)):
                 raise errors.BackupConfigError("Invalid job option: %s" % k)
-        self._conf.update(self._baseDefaults)
-        self._conf.update(self._extDefaults)
-        self._conf.update(global_conf)
-        self._conf.update(job_conf)
         
+    def _initCompress(self):
+        """Validates the compression options of the job and sets the suffix
+        for compressed files depending on the compression codec.
+        
+        """
+        engine = self._conf['compress_engine']
+        codec = self._conf['compress_codec']
+        level = self._conf.get('compress_level')
+        if engine not in ('internal', 'external'):
+            raise errors.BackupConfigError("Invalid compression engine: %s"
+                                           % engine)
+        if engine == 'external' and codec != 'zlib':
+            raise errors.BackupConfigError("Compression codec %s is only "
+                                           "supported by the internal "
+                                           "compression engine." % codec)
+        self._compressLevel = compress.checkCodec(codec, level)
+        self._compressThreads = self._getPosIntOpt('compress_threads', 
+                                                   compress.getNumCPUs())
+        self._compressBlockSize = self._getPosIntOpt('compress_blocksize',
+                                                     compress.defaultBlockSize)
+        if engine == 'internal':
+            self._conf['suffix_compress'] = compress.codecSuffix[codec]
+            
+    def _getCompressor(self, out):
+        """Returns multi-threaded block compressor configured by the 
+        compression options of the job.
+        
+        @param out: Output file object.
+        @return:    BlockCompressor instance.
+        
+        """
+        return compress.BlockCompressor(out, 
+                                        self._conf['compress_codec'],
+                                        self._compressLevel,
+                                        self._compressThreads,
+                                        self._compressBlockSize)
+    
+    def _initPriority(self):
+        """Validates the scheduling priority and throttling options of the job.
+        
+        """
+        opts = {}
+        try:
+            for (opt, conv) in (('nice_level', int), 
+                                ('ionice_level', int),
+                                ('throttle_load', float),
+                                ('throttle_disk_latency', float),
+                                ('throttle_interval', float),
+                                ('throttle_max_wait', float)):
+                if self._conf.get(opt) is not None:
+                    opts[opt] = conv(self._conf[opt])
+        except ValueError:
+            raise errors.BackupConfigError("Invalid value for job option %s: %s" 
+                                           % (opt, self._conf[opt]))
+        cpu_list = None
+        if self._conf.get('cpu_affinity') is not None:
+            cpu_list = priority.parseCpuList(self._conf['cpu_affinity'])
+        self._priority = priority.ProcessPriority(opts.get('nice_level'),
+                                                  self._conf.get('ionice_class'),
+                                                  opts.get('ionice_level'),
+                                                  cpu_list,
+                                                  self._conf.get('cmd_nice'),
+                                                  self._conf.get('cmd_ionice'),
+                                                  self._conf.get('cmd_taskset'))
+        self._throttle = None
+        if (opts.has_key('throttle_load') 
+            or opts.has_key('throttle_disk_latency')):
+            interval = opts.get('throttle_interval', 
+                                priority.defaultThrottleInterval)
+            max_wait = opts.get('throttle_max_wait', 
+                                priority.defaultThrottleMaxWait)
+            if interval <= 0 or max_wait < 0:
+                raise errors.BackupConfigError("Invalid throttle interval or "
+                                               "maximum delay.")
+            self._throttle = priority.Throttle(opts.get('throttle_load'),
+                                               opts.get('throttle_disk_latency'),
+                                               interval, max_wait)
+    
+    def _initCheckpoint(self):
+        """Loads the checkpoint of the completed units of the job for resumed
+        runs. The checkpoint of earlier runs is removed otherwise.
+        
+        """
+        if self._dryRun:
+            return
+        self._checkpointPath = os.path.join(self._conf['job_path'], 
+                                            fsutils.checkpointName)
+        if not os.path.isfile(self._checkpointPath):
+            return
+        if self._resume:
+            try:
+                self._units = fsutils.readCheckpoint(self._checkpointPath)
+            except (EnvironmentError, ValueError, TypeError), e:
+                logger.warning("Reading of checkpoint failed, job will be "
+                               "run from the start: %s  Error Message: %s",
+                               self._checkpointPath, str(e))
+            else:
+                logger.info("Resuming job from checkpoint. Completed units: "
+                            "%d", len(self._units))
+        else:
+            try:
+                os.unlink(self._checkpointPath)
+            except OSError, e:
+                raise errors.BackupError("Removal of checkpoint failed: %s" 
+                                         % self._checkpointPath,
+                                         "Error Message: %s" % str(e))
+    
+    def _checkUnit(self, unit):
+        """Checks if unit of resumed job is complete. The backup files of 
+        the unit must match the sizes and the hashes in the checkpoint. The 
+        backup files of complete units are recorded for the checksum manifest
+        of the job.
+        
+        @param unit: Unit name.
+        @return:     True if the unit is complete.
+        
+        """
+        if not self._units.has_key(unit):
+            return False
+        outputs = []
+        for (rel_path, digest, size) in self._units[unit]:
+            path = os.path.join(self._conf['job_path'], rel_path)
+            try:
+                (file_digest, file_size) = utils.hashFile(path)
+            except IOError, e:
+                logger.info("Running unit %s again, backup file cannot be "
+                            "read: %s", unit, str(e))
+                return False
+            if file_size != size or file_digest != digest:
+                logger.info("Running unit %s again, backup file does not "
+                            "match checkpoint: %s", unit, path)
+                return False
+            outputs.append((path, digest, size))
+        for (path, digest, size) in outputs:
+            self._outputHashes[path] = (digest, size)
+        return True
+    
+    def _runUnit(self, unit, func, *args):
+        """Runs a unit of the backup job, like the dump of a database, and
+        records the unit with its backup files in the checkpoint of the job 
+        on success. Units completed in earlier runs are skipped in resumed
+        runs. (See _checkUnit.)
+        
+        @param unit: Unit name. (Unique within job.)
+        @param func: Function to be called with args.
+        
+        """
+        if self._resume and self._checkUnit(unit):
+            logger.info("Skipping unit %s completed in earlier run.", unit)
+            return
+        self._statsLock.acquire()
+        try:
+            self._units.pop(unit, None)
+            self._unitOutputs[unit] = []
+        finally:
+            self._statsLock.release()
+        self._unitLocal.unit = unit
+        try:
+            func(*args)
+        finally:
+            self._unitLocal.unit = None
+        if self._dryRun:
+            return
+        job_path = self._conf['job_path']
+        self._statsLock.acquire()
+        try:
+            self._units[unit] = [(os.path.relpath(path, job_path), digest, size)
+                                 for (path, digest, size)
+                                 in sorted(self._unitOutputs.pop(unit))]
+            try:
+                fsutils.writeCheckpoint(self._checkpointPath, self._units)
+            except EnvironmentError, e:
+                raise errors.BackupError("Writing of checkpoint failed: %s" 
+                                         % self._checkpointPath,
+                                         "Error Message: %s" % str(e))
+        finally:
+            self._statsLock.release()
+    
+    def _waitThrottle(self, desc):
+        """Delays the start of task while the load is above the thresholds
+        defined by the throttle options.
+        
+        @param desc: Description of the task for log messages.
+        
+        """
+        if self._throttle is not None and not self._dryRun:
+            self._throttle.wait(desc)
+    
+    @classmethod
+    def getCmdOpts(cls):
+        """Returns the options for the paths of the executables of the 
+        commands used by the plugin. (cmd_* options)
+        
+        @return: Dictionary mapping options to default values.
+        
+        """
+        cmd_opts = {}
+        for k in cls._globalReqOptList:
+            if k.startswith('cmd_'):
+                cmd_opts[k] = None
+        for (k, v) in cls._extDefaults.items():
+            if k.startswith('cmd_'):
+                cmd_opts[k] = v
+        return cmd_opts
+    
     @classmethod
     def getHelpText(cls):
         """Returns help text for plugin.
@@ -296,78 +732,721 @@ class BackupPluginBase:
         for opt in sorted(cls._extOpts.keys()):
             desc = cls._extOpts[opt]
             lines.append("    %-24s: %s" % (opt, desc))
+        lines.append("")
+        lines.append("Plugin Command Options")
+        for (opt, default) in sorted(cls.getCmdOpts().items()):
+            if default is not None:
+                desc = "Path for command executable. (Default: %s)" % default
+            else:
+                desc = ("Path for command executable. (Defaults to the value "
+                        "of the general option.)")
+            lines.append("    %-24s: %s" % (opt, desc))
         return "\n".join(lines)
+    
+    @classmethod
+    def startWorkers(cls, global_conf, jobs_conf):
+        """Starts the worker processes shared by the jobs of the plugin. The
+        Job Manager calls the method from the main thread before the threads
+        running the jobs are started, so that the workers are not forked while
+        other threads hold locks. (No shared workers by default.)
         
-    def _execBackupCmd(self, args, env=None, out_path=None, out_compress=False, 
-                       force_exec=False):
-        """Executes backup command.
+        @param global_conf: Dictionary of general configuration options.
+        @param jobs_conf:   List of dictionaries of job configuration options
+                            for the jobs of the plugin that are run.
+        @return:            True if workers were started.
         
-        @param args:         List of command arguments. The executable path must
-                             be passed as first argument.
-        @param env:          Dictionary of environment variables for running
-                             backup command. The execution environment is not 
-                             modified by default. 
-        @param out_path:     Redirect output to file with path out_path if defined.
-        @param out_compress: The output to file will be compressed if True.
-        @param force_exec:   Force execution of command even for dry-run.
-        @return:             Tuple of return code, standard output text,
-                             standard error text.
+        """
+        return False
+    
+    @classmethod
+    def stopWorkers(cls):
+        """Stops the worker processes started by startWorkers.
         
         """
-        out_fp = None
-        if out_path is not None:
+        pass
+    
+    @classmethod
+    def collectGarbage(cls, global_conf, jobs_conf):
+        """Removes the data of the storage shared by the jobs of the plugin 
+        that is no longer referenced by any backup. (No shared storage by 
+        default.)
+        
+        @param global_conf: Dictionary of general configuration options.
+        @param jobs_conf:   List of dictionaries of job configuration options
+                            for the jobs of the plugin.
+        
+        """
+        pass
+        
+    def _getPosIntOpt(self, opt, default=1):
+        """Returns the value of option opt that must be a positive integer, 
+        like the number of workers for parallel tasks.
+        
+        @param opt:     Name of the configuration option.
+        @param default: Default value if the option is not defined.
+        @return:        Positive integer.
+        
+        """
+        val = self._conf.get(opt, default)
+        try:
+            num = int(val)
+        except ValueError:
+            num = 0
+        if num < 1:
+            raise errors.BackupConfigError("Invalid value for job option %s: %s" 
+                                           % (opt, val))
+        return num
+    
+    def _runWorkerPool(self, func, arg_list, num_workers):
+        """Runs func for each item in arg_list using a bounded pool of worker
+        threads. The errors in execution of func are collected for each item, 
+        so a failure does not stop the processing of the remaining items. No 
+        new items are processed after a fatal error, the error is raised once 
+        the workers are finished.
+        
+        @param func:        Function to be called with each item as argument.
+        @param arg_list:    List of items.
+        @param num_workers: Maximum number of items processed in parallel.
+        @return:            List of (item, error) tuples for the failed items,
+                            in the same order as arg_list.
+        
+        """
+        context = logmgr.getContext()
+        unit = getattr(self._unitLocal, 'unit', None)
+        queue = Queue.Queue()
+        for (idx, arg) in enumerate(arg_list):
+            queue.put((idx, arg))
+        failed = []
+        fatal = []
+        
+        def worker():
+            logmgr.setContext(context)
+            self._unitLocal.unit = unit
+            while not fatal:
                 try:
-                    out_fp = os.open(out_path, os.O_WRONLY | os.O_CREAT, 0666)
-                except Exception, e:
-                    raise errors.BackupFileCreateError(
-                        "Failed creation of backup file: %s" % out_path,
-                        "Error Message: %s" % str(e))
-        if not force_exec and self._dryRun:
-            logger.debug("Fake execution of command: %s", ' '.join(args))
-            return (0, '', '')
-        logger.debug("Executing command: %s", ' '.join(args))
-        if out_path is not None and out_compress:
+                    (idx, arg) = queue.get_nowait()
+                except Queue.Empty:
+                    return
+                try:
+                    func(arg)
+                except errors.BackupError, e:
+                    if e.fatal or e.trace:
+                        fatal.append(sys.exc_info())
+                    else:
+                        failed.append((idx, arg, e))
+                except:
+                    fatal.append(sys.exc_info())
+        
+        if num_workers > 1 and len(arg_list) > 1:
+            threads = []
+            for i in range(min(num_workers, len(arg_list))):
+                thread = threading.Thread(target=worker, 
+                                          name="worker-%s-%d" % (context, i))
+                thread.setDaemon(True)
+                thread.start()
+                threads.append(thread)
+            for thread in threads:
+                thread.join()
+        else:
+            worker()
+        if fatal:
+            (exc_type, exc_value, exc_tb) = fatal[0]
+            raise exc_type, exc_value, exc_tb
+        failed.sort()
+        return [(arg, e) for (idx, arg, e) in failed] #@UnusedVariable
+    
+    def _checkFailedItems(self, failed, num_items, desc):
+        """Raises an error listing the errors for all failed items returned
+        by _runWorkerPool.
+        
+        @param failed:    List of (item, error) tuples for failed items.
+        @param num_items: Total number of items processed.
+        @param desc:      Description of the processed items for messages.
+        
+        """
+        if failed:
+            lines = []
+            for (item, e) in failed:
+                lines.append("%s:" % item)
+                lines.extend(["    %s" % line for line in e])
+            raise errors.BackupError("Backup failed for %d of %d %s: %s" 
+                                     % (len(failed), num_items, desc,
+                                        ', '.join([str(item) 
+                                                   for (item, e) in failed])), #@UnusedVariable
+                                     *lines)
+
+    def _sortBySize(self, items, sizes):
+        """Returns the items sorted by size, largest first, so the longest
+        tasks of a worker pool are started first. Items of unknown size are
+        started before the others, keeping their order.
+
+        @param items: List of items.
+        @param sizes: Dictionary mapping items to sizes in bytes.
+        @return:      Sorted list of items.
+
+        """
+        return sorted(items, key=lambda item: -sizes.get(item, sys.maxint))
+
+    def _getPrevOutputSizes(self, prefixes):
+        """Returns the total size of the backup files of each item in the
+        newest previous backup of the job. The sizes are read from the
+        checksum manifest of the job, the job directory is walked for backups
+        without manifest.
+
+        @param prefixes: Dictionary mapping items to tuples of prefixes of the
+                         paths of their backup files relative to the job
+                         directory.
+        @return:         Dictionary mapping items to sizes in bytes for the
+                         items with backup files in the previous backup.
+
+        """
+        if not (self._conf.has_key('backup_base')
+                and self._conf.has_key('backup_path')):
+            return {}
+        backup_path = self._conf['backup_path']
+        prev_path = utils.findPrevBackupPath(self._conf['backup_base'],
+                                             os.path.basename(backup_path),
+                                             os.path.relpath(
+                                                 self._conf['job_path'],
+                                                 backup_path))
+        if prev_path is None:
+            return {}
+        file_sizes = []
+        manifest_path = os.path.join(prev_path, fsutils.checksumManifestName)
+        try:
+            if os.path.isfile(manifest_path):
+                file_sizes = [(path, size) for (path, digest, size) #@UnusedVariable
+                              in fsutils.readChecksumManifest(manifest_path)]
+            else:
+                for (dirpath, dirnames, filenames) in os.walk(prev_path): #@UnusedVariable
+                    for filename in filenames:
+                        path = os.path.join(dirpath, filename)
+                        file_sizes.append((os.path.relpath(path, prev_path),
+                                           os.lstat(path).st_size))
+        except (EnvironmentError, ValueError), e:
+            logger.debug("Reading sizes of previous backup failed: %s  "
+                         "Error Message: %s", prev_path, str(e))
+            return {}
+        sizes = {}
+        for (item, item_prefixes) in prefixes.items():
+            for (path, size) in file_sizes:
+                if path.startswith(item_prefixes):
+                    sizes[item] = sizes.get(item, 0) + size
+        return sizes
+
+    def _recordInputBytes(self, num_bytes):
+        """Records the size of the source data processed by the backup, for 
+        predicting the duration of later runs of the job.
+        
+        @param num_bytes: Size in bytes.
+        
+        """
+        self._statsLock.acquire()
+        try:
+            self._inputBytes = (self._inputBytes or 0) + num_bytes
+        finally:
+            self._statsLock.release()
+    
+    def _recordBytesWritten(self, num_bytes):
+        """Records the size of the data written by the backup. The size of the
+        backup files is recorded by _recordOutput, plugins record the data
+        written by other means, like the files transferred by rsync.
+        
+        @param num_bytes: Size in bytes.
+        
+        """
+        if self._dryRun:
+            return
+        self._statsLock.acquire()
+        try:
+            self._bytesWritten += num_bytes
+        finally:
+            self._statsLock.release()
+    
+    def _getPrevThroughput(self):
+        """Returns the throughput of the newest previous successful runs of
+        the job, read from the run reports in the dated backup directories.
+        
+        @return: Tuple of (number of runs, throughput in bytes per second) or
+                 None if no runs with recorded input size are found.
+        
+        """
+        if not (self._conf.has_key('backup_base') 
+                and self._conf.has_key('filename_report')):
+            return None
+        num_runs = 0
+        total_bytes = 0
+        total_time = 0
+        for name in utils.getBackupDateDirs(self._conf['backup_base']):
+            report_path = os.path.join(self._conf['backup_base'], name,
+                                       self._conf['filename_report'])
+            try:
+                fp = open(report_path, 'r')
+                try:
+                    report = json.load(fp)
+                finally:
+                    fp.close()
+            except (IOError, ValueError):
+                continue
+            for job_stats in report.get('jobs', []):
+                if (job_stats.get('job') == self._conf.get('job_name')
+                    and job_stats.get('status') == 'success'
+                    and job_stats.get('input_bytes') 
+                    and job_stats.get('wall_time') > 0):
+                    num_runs += 1
+                    total_bytes += job_stats['input_bytes']
+                    total_time += job_stats['wall_time']
+            if num_runs >= estimateHistoryRuns:
+                break
+        if num_runs == 0:
+            return None
+        return (num_runs, total_bytes / total_time)
+    
+    def _logEstimate(self, num_files, num_dirs, num_bytes):
+        """Logs the size of the source data of the backup and the duration 
+        of the backup predicted from the throughput of previous runs. Used in
+        dry-run mode.
+        
+        @param num_files: Number of files.
+        @param num_dirs:  Number of directories.
+        @param num_bytes: Size in bytes.
+        
+        """
+        logger.info("Dry run estimate - Files: %d   Directories: %d   "
+                    "Bytes: %d (%.1f MB)", num_files, num_dirs, num_bytes, 
+                    num_bytes / 1048576.0)
+        prev = self._getPrevThroughput()
+        if prev is None:
+            logger.info("Dry run estimate - No statistics of previous runs "
+                        "for predicting the duration of the backup.")
+        else:
+            (num_runs, throughput) = prev
+            logger.info("Dry run estimate - Predicted time: %.1f s   "
+                        "(Throughput: %.1f MB/s in %d previous runs.)",
+                        num_bytes / throughput, throughput / 1048576.0, 
+                        num_runs)
+    
+    def _estimateScan(self, path_list, base_dir=None, exclude_patterns=None):
+        """Scans the source paths of the backup with a pool of worker 
+        threads (scan_workers option) and logs the estimate for the backup.
+        Used in dry-run mode.
+        
+        @param path_list:        List of paths. Relative paths are relative 
+                                 to base_dir.
+        @param base_dir:         Base directory for relative paths.
+        @param exclude_patterns: List of filename patterns to exclude.
+        
+        """
+        num_workers = self._getPosIntOpt('scan_workers', 
+                                         fsutils.defaultScanWorkers)
+        start = time.time()
+        (num_files, num_dirs, num_bytes) = fsutils.scanPaths(
+            path_list, base_dir, exclude_patterns, num_workers,
+            lambda path, e: logger.warning("Scanning of path %s failed: %s", 
+                                           path, str(e)))
+        logger.debug("Scanned source paths in %.1f s with %d workers.", 
+                     time.time() - start, num_workers)
+        self._logEstimate(num_files, num_dirs, num_bytes)
+        
+    def _getOutputTail(self, args, stream):
+        """Returns file object for output stream of command that keeps the 
+        tail of the output and logs each line in debug mode.
+        
+        @param args:   List of command arguments.
+        @param stream: Name of output stream. (stdout / stderr)
+        @return:       OutputTail instance.
+        
+        """
+        name = os.path.basename(args[0])
+        return utils.OutputTail(line_func=lambda line: 
+                                logger.debug("%s %s: %s", name, stream, line))
+    
+    def _getOutputBuffer(self, args, stream):
+        """Returns file object for output stream of command that keeps the 
+        complete output and logs each line in debug mode.
+        
+        @param args:   List of command arguments.
+        @param stream: Name of output stream. (stdout / stderr)
+        @return:       OutputBuffer instance.
+        
+        """
+        name = os.path.basename(args[0])
+        return utils.OutputBuffer(line_func=lambda line: 
+                                  logger.debug("%s %s: %s", name, stream, line))
+    
+    def _hashOutput(self, path, out):
+        """Returns file object wrapper that hashes the data written to backup
+        file. The hash and the size of the file are recorded for the checksum
+        manifest of the job once the wrapper is closed.
+        
+        @param path: Path for backup file.
+        @param out:  Output file object.
+        @return:     HashingWriter instance.
+        
+        """
+        return utils.HashingWriter(out, lambda writer: 
+                                   self._recordOutput(path, writer.hexdigest(),
+                                                      writer.size))
+    
+    def _recordOutput(self, path, digest, size):
+        """Records the hash and the size of backup file for the checksum 
+        manifest of the job.
+        
+        @param path:   Path for backup file.
+        @param digest: SHA-256 hash of the file in hexadecimal.
+        @param size:   Size of the file in bytes.
+        
+        """
+        if self._dryRun:
+            # Only temporary files like listings are written in dry-run mode.
+            return
+        self._outputHashes[path] = (digest, size)
+        self._recordBytesWritten(size)
+        unit = getattr(self._unitLocal, 'unit', None)
+        if unit is not None:
+            self._statsLock.acquire()
+            try:
+                self._unitOutputs[unit].append((path, digest, size))
+            finally:
+                self._statsLock.release()
+        
+    def _hashOutputDir(self, path, num_workers=1):
+        """Hashes the files in a directory written by a backup command for 
+        the checksum manifest of the job. Used for outputs that cannot be
+        passed through the backup process, like directory format dumps.
+        
+        @param path:        Path for directory.
+        @param num_workers: Number of files hashed in parallel.
+        
+        """
+        file_list = []
+        for (dirpath, dirnames, filenames) in os.walk(path): #@UnusedVariable
+            for filename in filenames:
+                file_list.append(os.path.join(dirpath, filename))
+        def hash_file(file_path):
+            try:
+                (digest, size) = utils.hashFile(file_path)
+            except IOError, e:
+                raise errors.BackupError("Hashing of backup file failed: %s" 
+                                         % file_path,
+                                         "Error Message: %s" % str(e))
+            self._recordOutput(file_path, digest, size)
+        failed = self._runWorkerPool(hash_file, file_list, num_workers)
+        self._checkFailedItems(failed, len(file_list), 'backup files')
+        
+    def _openOutputFile(self, path):
+        """Opens backup file for writing by the plugin. The data written to 
+        the file is hashed for the checksum manifest of the job.
+        
+        @param path: Path for backup file.
+        @return:     HashingWriter instance.
+        
+        """
+        try:
+            fp = open(path, 'wb')
+        except IOError, e:
+            raise errors.BackupFileCreateError(
+                "Failed creation of backup file: %s" % path,
+                "Error Message: %s" % str(e))
+        return self._hashOutput(path, fp)
+    
+    def _execPipeCmd(self, args, env, out_sink, cmd_info, index_sink=None,
+                     compress_args=None):
+        """Executes backup command passing the output to a file object in the 
+        backup process, like the internal multi-threaded compression engine.
+        
+        @param args:          List of command arguments. The executable path 
+                              must be passed as first argument.
+        @param env:           Dictionary of environment variables for running
+                              backup command.
+        @param out_sink:      File object receiving the output. (Must implement 
+                              write and close methods.)
+        @param cmd_info:      Dictionary for accounting of resource usage 
+                              (rusage) and output bytes (bytes).
+        @param index_sink:    File object receiving the data that the command
+                              writes to its standard input descriptor, which 
+                              is connected to a pipe. (/dev/stdin can be 
+                              passed to commands as path for secondary output
+                              like the index of tar.)
+        @param compress_args: List of arguments for external compression 
+                              command. The output of the backup command is
+                              passed through the compression command if 
+                              defined.
+        @return:              Tuple of return code, standard output text,
+                              standard error text.
+        
+        """
+        index_pipe = None
+        index_wfd = None
+        if index_sink is not None:
+            (index_rfd, index_wfd) = os.pipe()
+            index_pipe = os.fdopen(index_rfd, 'rb')
+        try:
             try:
-                cmd = subprocess.Popen(args, 
+                cmd = subprocess.Popen(self._priority.getCmdPrefix() + args, 
+                                       stdin=index_wfd,
                                        stdout=subprocess.PIPE,
                                        stderr=subprocess.PIPE, 
                                        bufsize=bufferSize,
+                                       close_fds=True,
                                        env=env)
             except Exception, e:
+                if index_pipe is not None:
+                    index_pipe.close()
                 raise errors.BackupCmdError("Backup command execution failed.",
                                             "Command: %s" % ' '.join(args),
                                             "Error Message: %s" % str(e))
-            args_comp = [self._conf['cmd_compress'], '-c']
+        finally:
+            if index_wfd is not None:
+                os.close(index_wfd)
+        cmd_list = [cmd,]
+        err_tail = self._getOutputTail(args, 'stderr')
+        streams = [(cmd.stdout, out_sink), 
+                   (cmd.stderr, err_tail), 
+                   (index_pipe, index_sink),]
+        if compress_args is not None:
             try:
-                cmd_comp = subprocess.Popen(args_comp,
+                cmd_comp = subprocess.Popen(self._priority.getCmdPrefix() 
+                                            + compress_args,
                                             stdin=cmd.stdout,
-                                            stdout=out_fp,
+                                            stdout=subprocess.PIPE,
                                             stderr=subprocess.PIPE,
-                                            bufsize=bufferSize)
-                cmd.stdout.close()
+                                            bufsize=bufferSize,
+                                            close_fds=True)
             except Exception, e:
+                # The backup command is already running; it is killed and
+                # reaped and its pipes and the sinks are closed.
+                try:
+                    cmd.kill()
+                except OSError:
+                    pass
+                for (pipe, sink) in streams:
+                    if pipe is not None:
+                        pipe.close()
+                        sink.close()
+                cmd_info['rusage'].append(utils.waitCmd(cmd))
                 raise errors.BackupCmdError("Backup compression command failed.",
-                                            "Command: %s" % ' '.join(args_comp),
+                                            "Command: %s" % ' '.join(compress_args),
                                             "Error Message: %s" % str(e))
-            comp_out, comp_err = cmd_comp.communicate(None) #@UnusedVariable
-            err = cmd.stderr.read()
-            cmd.wait()
-            if cmd_comp.returncode == 0:
-                return (cmd.returncode, '', err)
+            finally:
+                cmd.stdout.close()
+            cmd_list.insert(0, cmd_comp)
+            comp_err_tail = self._getOutputTail(compress_args, 'stderr')
+            streams[0] = (cmd_comp.stdout, out_sink)
+            streams.append((cmd_comp.stderr, comp_err_tail))
+        try:
+            try:
+                counts = utils.pumpStreams(streams, self._compressBlockSize)
+                cmd_info['bytes'] = counts[0]
+            finally:
+                for (pipe, sink) in streams:
+                    if pipe is not None:
+                        pipe.close()
+                        sink.close()
+        except EnvironmentError, e:
+            for cmd_item in cmd_list:
+                cmd_info['rusage'].append(utils.waitCmd(cmd_item))
+            raise errors.BackupError("Processing of backup command output "
+                                     "failed.",
+                                     "Error Message: %s" % str(e))
+        except errors.BackupError:
+            for cmd_item in cmd_list:
+                cmd_info['rusage'].append(utils.waitCmd(cmd_item))
+            raise
+        for cmd_item in cmd_list:
+            cmd_info['rusage'].append(utils.waitCmd(cmd_item))
+        if compress_args is not None and cmd_comp.returncode != 0:
+            raise errors.BackupError("Compression of backup failed "
+                                     "with error code: %s" % cmd_comp.returncode,
+                                     *utils.splitMsg(comp_err_tail.getText()))
+        return (cmd.returncode, '', err_tail.getText())
+    
+    def _recordCmdStats(self, args, out_path, cmd_info):
+        """Records the resource usage statistics for execution of backup 
+        command.
+        
+        @param args:     List of command arguments.
+        @param out_path: Path for output file or None.
+        @param cmd_info: Dictionary with start time (start), list of resource
+                         usage results (rusage) and output bytes (bytes).
+        
+        """
+        wall_time = time.time() - cmd_info['start']
+        stats = {'command': ' '.join(args),
+                 'output': out_path,
+                 'wall_time': wall_time,
+                 'bytes_written': cmd_info['bytes'],}
+        stats.update(utils.getRusageStats(cmd_info['rusage']))
+        if wall_time > 0:
+            stats['throughput'] = cmd_info['bytes'] / wall_time
+        else:
+            stats['throughput'] = None
+        self._cmdStats.append(stats)
+        logger.debug("Command %s finished in %.1f s. CPU user/system: "
+                     "%.1f / %.1f s   Max RSS: %d KB   Bytes written: %d", 
+                     args[0], wall_time, stats['cpu_user'], 
+                     stats['cpu_system'], stats['max_rss_kb'], 
+                     stats['bytes_written'])
+    
+    def getStats(self):
+        """Returns the resource usage statistics for the backup commands 
+        executed by the plugin.
+        
+        @return: Dictionary of statistics. The hashes and sizes of the backup
+                 files are included as list of (path, sha256, size) tuples.
+                 The size of the backed up data is included as input_bytes 
+                 for plugins that record it, the size of the data written in
+                 this run as bytes_written.
+        
+        """
+        outputs = [(path, digest, size) 
+                   for (path, (digest, size)) in sorted(self._outputHashes.items())]
+        return {'commands': list(self._cmdStats),
+                'outputs': outputs,
+                'input_bytes': self._inputBytes,
+                'bytes_written': self._bytesWritten,}
+    
+    def _execBackupCmd(self, args, env=None, out_path=None, out_compress=False, 
+                       force_exec=False, out_sink=None, index_path=None,
+                       throttle=True, out_tail=True):
+        """Executes backup command. The resource usage of the command is 
+        recorded for the statistics of the job and the output files are hashed
+        while they are written for the checksum manifest of the job.
+        
+        @param args:         List of command arguments. The executable path must
+                             be passed as first argument.
+        @param env:          Dictionary of environment variables for running
+                             backup command. The execution environment is not 
+                             modified by default. 
+        @param out_path:     Redirect output to file with path out_path if defined.
+        @param out_compress: The output to file will be compressed if True.
+        @param force_exec:   Force execution of command even for dry-run.
+        @param out_sink:     Pass output to file object out_sink if defined.
+                             (Must implement write and close methods.)
+        @param index_path:   Store the data that the command writes to its 
+                             standard input descriptor in file with path 
+                             index_path if defined. (Secondary output like the
+                             index of tar can be written to /dev/stdin.)
+        @param throttle:     Delay the start of the command while the load is
+                             above the thresholds of the throttle options if
+                             True.
+        @param out_tail:     Only keep the last lines of the standard output 
+                             (utils.tailMaxLines) if True and the output is 
+                             neither redirected to a file nor passed to 
+                             out_sink. Callers parsing the complete output 
+                             must pass False; the output is buffered in 
+                             memory without limit.
+        @return:             Tuple of return code, standard output text,
+                             standard error text.
+        
+        """
+        out_fp = None
+        index_fp = None
+        out_writer = None
+        index_writer = None
+        cmd_info = {'start': time.time(), 'rusage': [], 'bytes': 0}
+        if not force_exec and self._dryRun:
+            # Existing backup files must not be opened or truncated.
+            logger.debug("Fake execution of command: %s", ' '.join(args))
+            return (0, '', '')
+        try:
+            for path in (out_path, index_path):
+                if path is not None:
+                    try:
+                        fp = os.open(path, 
+                                     os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 
+                                     0666)
+                    except Exception, e:
+                        raise errors.BackupFileCreateError(
+                            "Failed creation of backup file: %s" % path,
+                            "Error Message: %s" % str(e))
+                    if path is out_path:
+                        out_fp = fp
+                    else:
+                        index_fp = fp
+            if throttle and not force_exec:
+                self._waitThrottle("command: %s" % os.path.basename(args[0]))
+                cmd_info['start'] = time.time()
+            logger.debug("Executing command: %s", ' '.join(args))
+            if out_fp is not None:
+                out_writer = self._hashOutput(out_path, 
+                                              utils.FileDescWriter(out_fp))
+            if index_fp is not None:
+                index_writer = self._hashOutput(index_path, 
+                                                utils.FileDescWriter(index_fp))
+            compress_args = None
+            if out_sink is not None:
+                pass
+            elif out_writer is not None and out_compress:
+                if self._conf['compress_engine'] == 'internal':
+                    out_sink = self._getCompressor(out_writer)
+                else:
+                    out_sink = out_writer
+                    compress_args = [self._conf['cmd_compress'], '-c']
+                    if self._conf.has_key('compress_level'):
+                        compress_args.append('-%d' % self._compressLevel)
+            elif out_writer is not None:
+                out_sink = out_writer
             else:
-                raise errors.BackupError("Compression of backup failed "
-                                         "with error code: %s" % cmd_comp.returncode,
-                                         utils.splitMsg(comp_err))
+                if out_tail:
+                    out_buf = self._getOutputTail(args, 'stdout')
+                else:
+                    out_buf = self._getOutputBuffer(args, 'stdout')
+                (returncode, out, err) = self._execPipeCmd(args, env, out_buf, #@UnusedVariable
+                                                           cmd_info, 
+                                                           index_writer)
+                return (returncode, out_buf.getText(), err)
+            return self._execPipeCmd(args, env, out_sink, cmd_info, 
+                                     index_writer, compress_args)
+        finally:
+            for writer in (out_writer, index_writer):
+                if writer is not None:
+                    writer.close()
+            if out_writer is not None:
+                cmd_info['bytes'] = out_writer.size
+            for fp in (out_fp, index_fp):
+                if fp is not None:
+                    os.close(fp)
+            if cmd_info['rusage']:
+                self._recordCmdStats(args, out_path, cmd_info)
+
+
+class BackupPathsMixin:
+    """Mixin for plugins backing up the files and directories selected by the
+    base_dir, exclude_patterns and exclude_patterns_file options. The plugin
+    must initialize _pathErrors with an empty list; failures of individual
+    paths are collected in the list.
+    
+    """
+    
+    def _onPathError(self, path, e):
+        logger.warning("Backup of path %s failed: %s", path, str(e))
+        self._pathErrors.append("%s: %s" % (path, str(e)))
+    
+    def _getExcludePatterns(self):
+        if self._conf.has_key('exclude_patterns'):
+            return re.split('\s*,\s*|\s+', self._conf['exclude_patterns'])
         else:
-            try:
-                cmd = subprocess.Popen(args,
-                                       stdout=(out_fp or subprocess.PIPE), 
-                                       stderr=subprocess.PIPE, 
-                                       bufsize=bufferSize,
-                                       env = env)
-            except Exception, e:
-                raise errors.BackupCmdError("Backup command execution failed.",
-                                            "Command: %s" % ' '.join(args),
-                                            "Error Message: %s" % str(e))
-            out, err = cmd.communicate(None)
-            return (cmd.returncode, out, err)
\ No newline at end of file
+            return None
+        
+    def _getAllExcludePatterns(self):
+        exclude_patterns = self._getExcludePatterns() or []
+        exclude_patterns_file = self._checkExcludePatternsFile()
+        if exclude_patterns_file is not None:
+            exclude_patterns.extend(fsutils.readExcludeFile(exclude_patterns_file))
+        return exclude_patterns
+        
+    def _checkExcludePatternsFile(self):
+        exclude_patterns_file = self._conf.get('exclude_patterns_file')
+        if (exclude_patterns_file is not None 
+            and not os.path.isfile(exclude_patterns_file)):
+            raise errors.BackupConfigError("Invalid exclude patterns file: %s"
+                                           % exclude_patterns_file)
+        return exclude_patterns_file
+    
+    def _checkBaseDir(self):
+        base_dir = self._conf.get('base_dir')
+        if base_dir is not None and not os.path.isdir(base_dir):
+            raise errors.BackupConfigError("Invalid base directory "
+                                           "(base_dir): %s"% base_dir)
+        return base_dir
@@ -4,10 +4,16 @@
 
 import os
 import re
+import stat
+import hashlib
+import tarfile
+import tempfile
+from datetime import datetime
 from pybackup import errors
 from pybackup import utils
+from pybackup import fsutils
 from pybackup.logmgr import logger
-from pybackup.plugins import BackupPluginBase
+from pybackup.plugins import BackupPluginBase, BackupPathsMixin
 from pysysinfo.util import parse_value
 
 
@@ -22,7 +28,7 @@ __status__ = "Development"
 
 
 
-class PluginArchive(BackupPluginBase):
+class PluginArchive(BackupPluginBase, BackupPathsMixin):
     """Class for archival based on tar.
     
     """
@@ -36,10 +42,34 @@ class PluginArchive(BackupPluginBase):
                                     'the backup.', 
                 'exclude_patterns_file': 'Path for file that stores list of '
                                         'filename patterns to exclude from '
-                                        'the backup.',}
+                                        'the backup.',
+                'archive_engine': 'Engine for generation of archives. (tar: '
+                                  'cmd_tar, native: in-process tar stream '
+                                  'compressed with compress_codec on '
+                                  'compress_threads threads.) (Default: tar)',
+                'mode': 'Backup mode. (full, incremental or differential) The '
+                        'state of files is saved between runs only if the mode '
+                        'is set.',
+                'full_interval': 'Interval in days for automatic full backups '
+                                 'in incremental and differential modes. '
+                                 '(0 for no automatic full backups.) '
+                                 '(Default: 7)',
+                'scan_workers': 'Number of worker threads for scanning the '
+                                'source paths for the estimate of dry runs. '
+                                '(Default: 8)',
+                'shards': 'Number of archives generated in parallel. The '
+                          'source paths are split in groups of roughly equal '
+                          'size, each archive has its own index and the '
+                          'archive of each path is listed in the shard list. '
+                          '(Default: 1)',}
     _extReqOptList = ('filename_archive', 'path_list')
     _extDefaults = {'backup_index': 'yes', 
-                    'suffix_index': 'list'}
+                    'archive_engine': 'tar',
+                    'full_interval': 7,
+                    'suffix_index': 'list',
+                    'suffix_index_native': 'index',
+                    'suffix_deleted': 'deleted',
+                    'suffix_shards': 'shards',}
     
     def __init__(self, global_conf, job_conf):
         """Constructor
@@ -49,6 +79,7 @@ class PluginArchive(BackupPluginBase):
         
         """
         BackupPluginBase.__init__(self, global_conf, job_conf)
+        self._pathErrors = []
         
     def _checkSrcPaths(self, path_list):
         for path in path_list:
@@ -56,56 +87,404 @@ class PluginArchive(BackupPluginBase):
             if not os.path.exists(os.path.join(base_dir, path)):
                 raise errors.BackupConfigError("Invalid source path: %s" % path)
         
+    def _getArchivePath(self, filename_archive=None):
+        filename_archive = filename_archive or self._conf['filename_archive']
+        if self._conf['compress_codec'] != 'zlib':
+            archive_filename = "%s.%s.%s" % (filename_archive,
+                                             self._conf['suffix_tar'],
+                                             self._conf['suffix_compress'])
+        else:
+            archive_filename = "%s.%s" % (filename_archive, 
+                                          self._conf['suffix_tgz'])
+        return os.path.join(self._conf['job_path'], archive_filename)
+    
+    def _getIndexPath(self, filename_archive=None):
+        filename_archive = filename_archive or self._conf['filename_archive']
+        if self._conf['archive_engine'] == 'native':
+            suffix = self._conf['suffix_index_native']
+        else:
+            suffix = self._conf['suffix_index']
+        index_filename = "%s.%s" % (filename_archive, suffix)
+        return os.path.join(self._conf['job_path'], index_filename)
+    
+    def _getStatePath(self):
+        return os.path.join(self._conf['state_dir'], self._conf['job_name'])
+    
+    def _getBackupDate(self):
+        return os.path.basename(os.path.normpath(self._conf['backup_path']))
+    
+    def _checkMode(self, mode):
+        """Returns the effective backup mode. Incremental and differential 
+        backups fall back to full backups if there is no previous full backup
+        or the full backup is older than full_interval days.
+        
+        """
+        if mode not in ('full', 'incremental', 'differential'):
+            raise errors.BackupConfigError("Invalid backup mode: %s" % mode)
+        if mode == 'full':
+            return mode
+        full_manifest = os.path.join(self._getStatePath(), 'manifest.full')
+        if not os.path.isfile(full_manifest):
+            logger.info("No previous full backup found. Running full backup.")
+            return 'full'
+        try:
+            full_interval = int(self._conf['full_interval'])
+        except ValueError:
+            raise errors.BackupConfigError("Invalid value for job option "
+                                           "full_interval: %s" 
+                                           % self._conf['full_interval'])
+        if full_interval > 0:
+            (info, states) = fsutils.readManifest(full_manifest) #@UnusedVariable
+            try:
+                full_date = datetime.strptime(info.get('date'), '%Y-%m-%d')
+                backup_date = datetime.strptime(self._getBackupDate(), 
+                                                '%Y-%m-%d')
+                age = (backup_date - full_date).days
+            except (TypeError, ValueError):
+                age = full_interval
+            if age >= full_interval:
+                logger.info("Last full backup is %d days old. "
+                            "Running full backup.", age)
+                return 'full'
+        return mode
+    
+    def _scanChanges(self, path_list, mode):
+        """Scans source paths and compares the state of files with the state 
+        saved in the previous full (differential mode) or last backup 
+        (incremental mode).
+        
+        @return: Tuple of (entries, deleted, states), where entries is the 
+                 list of entries to be archived, deleted is the list of paths
+                 deleted since the reference backup and states is the list of
+                 (path, state) tuples for the manifest.
+        
+        """
+        base_dir = self._checkBaseDir()
+        exclude_patterns = self._getAllExcludePatterns()
+        if mode == 'full':
+            ref_states = {}
+        else:
+            if mode == 'differential':
+                ref_name = 'manifest.full'
+            else:
+                ref_name = 'manifest.last'
+            ref_path = os.path.join(self._getStatePath(), ref_name)
+            try:
+                (ref_info, ref_states) = fsutils.readManifest(ref_path)
+            except (IOError, ValueError), e:
+                raise errors.BackupError("Reading of file state manifest "
+                                         "failed: %s" % ref_path,
+                                         "Error Message: %s" % str(e))
+            self._refDate = ref_info.get('date')
+        entries = []
+        states = []
+        for (path, fs_path, st) in fsutils.walkPaths(path_list, base_dir,
+                                                     exclude_patterns,
+                                                     self._onPathError):
+            state = fsutils.getFileState(st)
+            states.append((path, state))
+            ref_state = ref_states.pop(path, None)
+            if mode == 'full' or state[4] == 'd' or ref_state != state:
+                entries.append((path, fs_path, st))
+        deleted = sorted(ref_states.keys())
+        return (entries, deleted, states)
+    
+    def _saveState(self, mode, states, deleted):
+        state_path = self._getStatePath()
+        info = {'date': self._getBackupDate(), 'mode': mode}
+        deleted_path = os.path.join(self._conf['job_path'], "%s.%s" 
+                                    % (self._conf['filename_archive'], 
+                                       self._conf['suffix_deleted']))
+        try:
+            if not os.path.isdir(state_path):
+                os.makedirs(state_path)
+            if mode == 'full':
+                fsutils.writeManifest(os.path.join(state_path, 'manifest.full'),
+                                      states, info)
+            else:
+                fp = self._openOutputFile(deleted_path)
+                try:
+                    fp.write("## mode: %s\n## reference: %s\n" 
+                             % (mode, self._refDate))
+                    for path in deleted:
+                        fp.write("%s\n" % fsutils.escapePath(path))
+                finally:
+                    fp.close()
+            fsutils.writeManifest(os.path.join(state_path, 'manifest.last'),
+                                  states, info)
+        except EnvironmentError, e:
+            raise errors.BackupError("Saving of file state manifest failed.",
+                                     "Error Message: %s" % str(e))
+        
     def backupDirs(self):
-        archive_filename = "%s.%s" % (self._conf['filename_archive'], 
-                                      self._conf['suffix_tgz'])
-        index_filename = "%s.%s" % (self._conf['filename_archive'], 
-                                      self._conf['suffix_index'])
-        archive_path = os.path.join(self._conf['job_path'], archive_filename)
+        archive_path = self._getArchivePath()
         backup_index = parse_value(self._conf.get('backup_index'), True)
-        index_path = os.path.join(self._conf['job_path'], index_filename)
-        base_dir = self._conf.get('base_dir')
+        index_path = self._getIndexPath()
         path_list = [os.path.normpath(path) 
                      for path in re.split('\s*,\s*|\s+', self._conf['path_list'])]
-        if self._conf.has_key('exclude_patterns'):
-            exclude_patterns = re.split('\s*,\s*|\s+', 
-                                        self._conf['exclude_patterns'])
-        else:
-            exclude_patterns = None
-        exclude_patterns_file = self._conf.get('exclude_patterns_file')
+        archive_engine = self._conf['archive_engine']
+        if archive_engine not in ('tar', 'native'):
+            raise errors.BackupConfigError("Invalid archive engine: %s" 
+                                           % archive_engine)
+        num_shards = self._getPosIntOpt('shards')
         logger.info("Starting backup of paths: %s", ', '.join(path_list))
+        self._checkSrcPaths(path_list)
+        mode = self._conf.get('mode')
+        if mode is not None:
+            mode = self._checkMode(mode)
+            (entries, deleted, states) = self._scanChanges(path_list, mode)
+            logger.info("Running %s backup. Entries: %d / %d    Deleted: %d",
+                        mode, len(entries), len(states), len(deleted))
+        else:
+            entries = None
+        if self._dryRun:
+            self._estimate(path_list, entries)
+        if num_shards > 1:
+            if entries is None:
+                entries = list(fsutils.walkPaths(path_list, 
+                                                 self._checkBaseDir(),
+                                                 self._getAllExcludePatterns(),
+                                                 self._onPathError))
+            self._archiveShards(path_list, entries, num_shards, backup_index)
+        elif archive_engine == 'tar':
+            self._archiveTar(archive_path, path_list, 
+                             backup_index and index_path or None, entries)
+        else:
+            self._archiveNative(archive_path, path_list, 
+                                backup_index and index_path or None, entries)
+        if self._pathErrors:
+            raise errors.BackupError("Backup of %d paths failed." 
+                                     % len(self._pathErrors), 
+                                     *self._pathErrors)
+        if mode is not None and not self._dryRun:
+            self._saveState(mode, states, deleted)
+        logger.info("Finished backup of paths: %s", ', '.join(path_list))
+            
+    def _estimate(self, path_list, entries=None):
+        """Logs the estimate for the backup in dry-run mode. The source paths
+        are scanned unless the list of entries is already known.
+        
+        """
+        if entries is None:
+            self._estimateScan(path_list, self._checkBaseDir(), 
+                               self._getAllExcludePatterns())
+        else:
+            num_dirs = 0
+            num_bytes = 0
+            for (path, fs_path, st) in entries: #@UnusedVariable
+                if stat.S_ISDIR(st.st_mode):
+                    num_dirs += 1
+                elif stat.S_ISREG(st.st_mode):
+                    num_bytes += st.st_size
+            self._logEstimate(len(entries) - num_dirs, num_dirs, num_bytes)
+    
+    def _archiveShards(self, path_list, entries, num_shards, backup_index):
+        """Splits the entries in groups of roughly equal size and generates 
+        an archive for each group in parallel. The archive of each path is 
+        listed in the shard list of the job.
+        
+        """
+        groups = fsutils.splitEntries(entries, num_shards)
+        shard_names = ["%s.shard%d" % (self._conf['filename_archive'], num + 1) 
+                       for num in range(len(groups))]
+        logger.info("Splitting backup in %d archive shards.", len(groups))
+        
+        def archive_shard(num):
+            archive_path = self._getArchivePath(shard_names[num])
+            if backup_index:
+                index_path = self._getIndexPath(shard_names[num])
+            else:
+                index_path = None
+            logger.debug("Starting archive shard %d. Entries: %d  Backup: %s",
+                         num + 1, len(groups[num]), archive_path)
+            if self._conf['archive_engine'] == 'tar':
+                self._archiveTar(archive_path, path_list, index_path, 
+                                 groups[num])
+            else:
+                self._archiveNative(archive_path, path_list, index_path, 
+                                    groups[num])
+            logger.debug("Finished archive shard %d. Backup: %s", 
+                         num + 1, archive_path)
+            
+        # The units of resumed runs are only skipped if the paths of the 
+        # shards did not change.
+        units = ["%s:%s" % (shard_names[num], 
+                            hashlib.sha1('\0'.join([path for (path, fs_path, st) #@UnusedVariable
+                                                    in group])).hexdigest()[:16])
+                 for (num, group) in enumerate(groups)]
+        failed = self._runWorkerPool(lambda num: 
+                                     self._runUnit(units[num], 
+                                                   archive_shard, num), 
+                                     range(len(groups)), len(groups))
+        self._checkFailedItems([(shard_names[num], e) for (num, e) in failed],
+                               len(groups), 'archive shards')
+        if self._dryRun:
+            return
+        shards_path = os.path.join(self._conf['job_path'], "%s.%s" 
+                                   % (self._conf['filename_archive'],
+                                      self._conf['suffix_shards']))
+        fp = self._openOutputFile(shards_path)
+        try:
+            try:
+                fp.write("# archive\tpath\n")
+                for (num, group) in enumerate(groups):
+                    archive_filename = os.path.basename(
+                        self._getArchivePath(shard_names[num]))
+                    for (path, fs_path, st) in group: #@UnusedVariable
+                        fp.write("%s\t%s\n" % (archive_filename, 
+                                                fsutils.escapePath(path)))
+            finally:
+                fp.close()
+        except EnvironmentError, e:
+            raise errors.BackupError("Writing of archive shard list failed: %s"
+                                     % shards_path,
+                                     "Error Message: %s" % str(e))
+    
+    def _archiveTar(self, archive_path, path_list, index_path=None, 
+                    entries=None):
+        base_dir = self._checkBaseDir()
+        exclude_patterns = self._getExcludePatterns()
+        exclude_patterns_file = self._checkExcludePatternsFile()
         args = [self._conf['cmd_tar'],]
         if base_dir is not None:
-            if os.path.isdir(base_dir):
-                args.extend(['-C', base_dir])
-            else:
-                raise errors.BackupConfigError("Invalid base directory "
-                                               "(base_dir): %s"% base_dir)
-        if backup_index:
-            args.append('-v')
+            args.extend(['-C', base_dir])
+        if index_path is not None:
+            args.extend(['-v', '--index-file=/dev/stdin'])
         if exclude_patterns is not None:
             for pattern in exclude_patterns:
                 args.append("--exclude=%s" % pattern)
         if exclude_patterns_file is not None:
-            if os.path.isfile(exclude_patterns_file):
-                args.append("--exclude-from=%s" % exclude_patterns_file)
-            else:
-                raise errors.BackupConfigError("Invalid exclude patterns file: %s"
-                                               % exclude_patterns_file)
-        args.extend(['-zcf', archive_path])
-        self._checkSrcPaths(path_list)
-        args.extend(path_list)
-        if backup_index:
-            returncode, out, err = self._execBackupCmd(args, #@UnusedVariable
-                                                       out_path=index_path) 
-        else:
-            returncode, out, err = self._execBackupCmd(args) #@UnusedVariable
-        if returncode == 0:
-            logger.info("Finished backup of paths: %s", ', '.join(path_list))
+            args.append("--exclude-from=%s" % exclude_patterns_file)
+        args.extend(['--totals', '-cf', '-'])
+        list_path = None
+        if entries is not None:
+            try:
+                (list_fd, list_path) = tempfile.mkstemp(prefix='.files.', 
+                                                        dir=self._conf['job_path'])
+                list_fp = os.fdopen(list_fd, 'w')
+                try:
+                    for (path, fs_path, st) in entries: #@UnusedVariable
+                        list_fp.write("%s\0" % path)
+                finally:
+                    list_fp.close()
+            except EnvironmentError, e:
+                raise errors.BackupFileCreateError(
+                    "Failed creation of file list for archive.",
+                    "Error Message: %s" % str(e))
+            args.extend(['--null', '--no-recursion', '-T', list_path])
         else:
+            args.extend(path_list)
+        try:
+            returncode, out, err = self._execBackupCmd(args, #@UnusedVariable
+                                                       out_path=archive_path,
+                                                       out_compress=True,
+                                                       index_path=index_path)
+        finally:
+            if list_path is not None:
+                os.unlink(list_path)
+        if returncode != 0:
             raise errors.BackupError("Backup of paths failed with error code: %s" 
                                      % returncode,
                                      *utils.splitMsg(err))
+        mobj = re.search('^Total bytes written: (\d+)', err, re.MULTILINE)
+        if mobj is not None:
+            self._recordInputBytes(int(mobj.group(1)))
+        
+    def _archiveNative(self, archive_path, path_list, index_path=None, 
+                       entries=None):
+        base_dir = self._checkBaseDir()
+        if entries is None:
+            entries = fsutils.walkPaths(path_list, base_dir, 
+                                        self._getAllExcludePatterns(),
+                                        self._onPathError)
+        if self._dryRun:
+            logger.debug("Fake generation of archive: %s", archive_path)
+            return
+        logger.debug("Generating archive with native engine: %s", archive_path)
+        archive_fp = self._openOutputFile(archive_path)
+        index_fp = None
+        try:
+            if index_path is not None:
+                index_fp = self._openOutputFile(index_path)
+                index_fp.write(fsutils.indexHeader + "\n")
+            compressor = self._getCompressor(archive_fp)
+            try:
+                tar = tarfile.open(fileobj=compressor, mode='w|', 
+                                   bufsize=self._compressBlockSize)
+                for (path, fs_path, st) in entries:
+                    offset = tar.offset
+                    tarinfo = self._addArchiveEntry(tar, path, fs_path)
+                    if tarinfo is not None and index_fp is not None:
+                        index_fp.write(fsutils.formatIndexEntry(
+                            offset, tarinfo.size, tarinfo.mtime,
+                            fsutils.getEntryType(st.st_mode), path))
+                tar.close()
+                self._recordInputBytes(tar.offset)
+            finally:
+                compressor.close()
+        except EnvironmentError, e:
+            raise errors.BackupError("Generation of archive failed: %s" 
+                                     % archive_path,
+                                     "Error Message: %s" % str(e))
+        finally:
+            archive_fp.close()
+            if index_fp is not None:
+                index_fp.close()
+        
+    def _addArchiveEntry(self, tar, path, fs_path):
+        """Adds filesystem entry to tar stream. Regular files that shrink while
+        being archived are padded with zeros to keep the stream consistent.
+        
+        @return: TarInfo object for the entry or None if the entry was not 
+                 added to the archive.
+        
+        """
+        try:
+            tarinfo = tar.gettarinfo(fs_path, path)
+        except EnvironmentError, e:
+            self._onPathError(path, e)
+            return None
+        if tarinfo is None:
+            logger.debug("Skipping unsupported file type: %s", path)
+            return None
+        if tarinfo.isreg():
+            try:
+                fp = open(fs_path, 'rb')
+            except IOError, e:
+                self._onPathError(path, e)
+                return None
+            try:
+                tar.addfile(tarinfo, _PaddedReader(fp, path, self._onPathError))
+            finally:
+                fp.close()
+        else:
+            tar.addfile(tarinfo)
+        tar.members = []
+        return tarinfo
+
+
+class _PaddedReader:
+    """File object wrapper that pads data with zeros when the file shrinks 
+    while it is being read.
+    
+    """
+    
+    def __init__(self, fp, path, onerror):
+        self._fp = fp
+        self._path = path
+        self._onerror = onerror
+        self._short = False
+        
+    def read(self, size):
+        data = self._fp.read(size)
+        if len(data) < size:
+            if not self._short:
+                self._short = True
+                self._onerror(self._path, IOError("File shrank while being "
+                                                  "archived."))
+            data += tarfile.NUL * (size - len(data))
+        return data
+
 
 description = "Plugin for backups using tar archives."        
 methodList = (('archive', PluginArchive, 'backupDirs'),)
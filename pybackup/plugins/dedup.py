@@ -0,0 +1,367 @@
+"""pybackup - Backup Plugin for Deduplicated Storage of Backups
+
+The output of backup commands and the contents of files are split in
+content-defined chunks that are stored once in a chunk repository shared by
+all backup jobs. A recipe file listing the chunks of each stream is written to
+the job directory.
+
+"""
+
+import os
+import re
+import time
+import shlex
+from pybackup import errors
+from pybackup import utils
+from pybackup import fsutils
+from pybackup import compress
+from pybackup import chunkstore
+from pybackup.logmgr import logger
+from pybackup.plugins import BackupPluginBase, BackupPathsMixin
+
+
+__author__ = "Ali Onur Uyar"
+__copyright__ = "Copyright 2011, Ali Onur Uyar"
+__credits__ = []
+__license__ = "GPL"
+__version__ = "0.5"
+__maintainer__ = "Ali Onur Uyar"
+__email__ = "aouyar at gmail.com"
+__status__ = "Development"
+
+
+
+class PluginDedup(BackupPluginBase, BackupPathsMixin):
+    """Class for deduplicated backups in chunk repository.
+
+    """
+
+    _extOpts = {'source_cmd': 'Command line for backup command whose output is'
+                              ' stored. (Method dedup_cmd.)',
+                'path_list': 'List of paths to be included in the backup.'
+                             ' (Method dedup_files.)',
+                'base_dir': 'Base directory for list of paths to be included '
+                            ' the backup. (Absolute paths are used by default.)',
+                'exclude_patterns': 'List of filename patterns to exclude from '
+                                    'the backup.',
+                'exclude_patterns_file': 'Path for file that stores list of '
+                                        'filename patterns to exclude from '
+                                        'the backup.',
+                'dedup_repo': 'Path for chunk repository shared by jobs.'
+                              ' (Default: backup_root/dedup)',
+                'dedup_workers': 'Number of worker processes for chunking and '
+                                 'storage of chunks. (Number of CPUs by '
+                                 'default.)',
+                'chunk_min_size': 'Minimum size of chunks in bytes.'
+                                  ' (Default: 262144)',
+                'chunk_avg_size': 'Average size of chunks in bytes, must be a'
+                                  ' power of 2. (Default: 1048576)',
+                'chunk_max_size': 'Maximum size of chunks in bytes.'
+                                  ' (Default: 4194304)',
+                'filename_recipe': 'Filename for recipe file.'
+                                   ' (Without extension.)',}
+    _extReqOptList = ()
+    _extDefaults = {'filename_recipe': 'dedup',
+                    'suffix_recipe': 'recipe',}
+
+    def __init__(self, global_conf, job_conf):
+        """Constructor
+
+        @param global_conf: Dictionary of general configuration options.
+        @param job_conf:    Dictionary of job configuration options.
+
+        """
+        BackupPluginBase.__init__(self, global_conf, job_conf)
+        self._pathErrors = []
+
+    @classmethod
+    def startWorkers(cls, global_conf, jobs_conf):
+        """Starts the pool of worker processes shared by the chunk stores of
+        the jobs. The size of the pool is the largest dedup_workers value of
+        the jobs; the pool is not resized for jobs added to the configuration
+        once the pool is running.
+        
+        @param global_conf: Dictionary of general configuration options.
+        @param jobs_conf:   List of dictionaries of job configuration options
+                            for the jobs of the plugin that are run.
+        @return:            True if workers were started.
+        
+        """
+        if global_conf.get('dry_run', False) or not jobs_conf:
+            return False
+        num_workers = 0
+        for job_conf in jobs_conf:
+            val = job_conf.get('dedup_workers')
+            if val is None:
+                num_workers = max(num_workers, compress.getNumCPUs())
+            elif re.match('\d+$', val) and int(val) > 0:
+                num_workers = max(num_workers, int(val))
+        if num_workers == 0:
+            return False
+        return chunkstore.workerPool.start(num_workers)
+    
+    @classmethod
+    def stopWorkers(cls):
+        """Stops the pool of worker processes started by startWorkers.
+        
+        """
+        chunkstore.workerPool.stop()
+    
+    @classmethod
+    def collectGarbage(cls, global_conf, jobs_conf):
+        """Removes the chunks of the repositories of the jobs that are no 
+        longer referenced by any recipe. Repositories that do not exist or are 
+        in use by running backups are skipped.
+        
+        @param global_conf: Dictionary of general configuration options.
+        @param jobs_conf:   List of dictionaries of job configuration options
+                            for the jobs of the plugin.
+        
+        """
+        dry_run = global_conf.get('dry_run', False)
+        repo_paths = set()
+        for job_conf in jobs_conf:
+            conf = dict(global_conf)
+            conf.update(job_conf)
+            repo_paths.add(getRepoPath(conf))
+        for repo_path in sorted(repo_paths):
+            if not os.path.isdir(repo_path):
+                continue
+            start_time = time.time()
+            try:
+                result = chunkstore.collectGarbage(repo_path, dry_run)
+            except (EnvironmentError, errors.BackupError), e:
+                logger.error("Collection of unreferenced chunks of repository "
+                             "%s failed: %s", repo_path, str(e))
+                continue
+            if result is None:
+                logger.info("Collection of unreferenced chunks skipped for "
+                            "repository in use or without registered recipes: "
+                            "%s", repo_path)
+            else:
+                logger.info("Removed %d unreferenced chunks (%d bytes) from "
+                            "repository %s. Time: %.1f s", result[0], 
+                            result[1], repo_path, time.time() - start_time)
+
+    def _getRepoPath(self):
+        return getRepoPath(self._conf)
+
+    def _getRecipePath(self):
+        return os.path.join(self._conf['job_path'],
+                            "%s.%s" % (self._conf['filename_recipe'],
+                                       self._conf['suffix_recipe']))
+
+    def _lockRepo(self):
+        """Creates the chunk repository if it does not exist yet and acquires
+        a shared lock on it, so that the chunks are not collected while they 
+        are stored.
+
+        @return: Tuple of repository path and lock file object.
+
+        """
+        repo_path = self._getRepoPath()
+        try:
+            chunkstore.initRepo(repo_path)
+            lock_fp = chunkstore.lockRepo(repo_path)
+        except EnvironmentError, e:
+            raise errors.BackupFileCreateError(
+                "Failed creation of chunk repository: %s" % repo_path,
+                "Error Message: %s" % str(e))
+        return (repo_path, lock_fp)
+
+    def _openStore(self, repo_path, recipe_fp):
+        """Returns chunk store configured by the options of the job.
+
+        @param repo_path: Path for chunk repository.
+        @param recipe_fp: File object for recipe file.
+        @return:          ChunkStore instance.
+
+        """
+        min_size = self._getPosIntOpt('chunk_min_size',
+                                      chunkstore.defaultMinChunkSize)
+        avg_size = self._getPosIntOpt('chunk_avg_size',
+                                      chunkstore.defaultAvgChunkSize)
+        max_size = self._getPosIntOpt('chunk_max_size',
+                                      chunkstore.defaultMaxChunkSize)
+        chunkstore.checkChunkSizes(min_size, avg_size, max_size)
+        num_workers = self._getPosIntOpt('dedup_workers',
+                                         compress.getNumCPUs())
+        level = compress.checkCodec('zlib', self._conf.get('compress_level'))
+        recipe_fp.write("## repo: %s\n" % repo_path)
+        return chunkstore.ChunkStore(repo_path, recipe_fp, num_workers,
+                                     min_size, avg_size, max_size,
+                                     level=level)
+
+    def _runStore(self, func, desc):
+        """Executes func passing a chunk store as argument and writes the recipe
+        file atomically once func finishes successfully.
+
+        @param func: Function that writes the streams to the chunk store.
+        @param desc: Description of the backup for log messages.
+
+        """
+        recipe_path = self._getRecipePath()
+        tmp_path = "%s.tmp" % recipe_path
+        (repo_path, lock_fp) = self._lockRepo()
+        try:
+            try:
+                recipe_fp = utils.HashingWriter(open(tmp_path, 'w'))
+            except IOError, e:
+                raise errors.BackupFileCreateError(
+                    "Failed creation of recipe file: %s" % recipe_path,
+                    "Error Message: %s" % str(e))
+            try:
+                try:
+                    store = self._openStore(repo_path, recipe_fp)
+                    try:
+                        func(store)
+                        store.close()
+                    except:
+                        store.abort()
+                        raise
+                finally:
+                    recipe_fp.close()
+                try:
+                    chunkstore.registerRecipe(repo_path, recipe_path)
+                except EnvironmentError, e:
+                    raise errors.BackupFileCreateError(
+                        "Registration of recipe in chunk repository failed: %s"
+                        % recipe_path, "Error Message: %s" % str(e))
+            except:
+                os.unlink(tmp_path)
+                raise
+            os.rename(tmp_path, recipe_path)
+        finally:
+            lock_fp.close()
+        self._recordOutput(recipe_path, recipe_fp.hexdigest(), recipe_fp.size)
+        logger.info("Stored %s: %d bytes in %d chunks, %d new chunks "
+                    "(%d bytes after compression).", desc, store.bytesIn,
+                    store.numChunks, store.numNewChunks, store.bytesStored)
+
+    def dedupCmd(self):
+        """Stores the output of backup command in chunk repository.
+
+        """
+        if not self._conf.has_key('source_cmd'):
+            raise errors.BackupConfigError("Required job configuration "
+                                           "option source_cmd not defined.")
+        args = shlex.split(self._conf['source_cmd'])
+        logger.info("Starting deduplicated backup of command output: %s",
+                    args[0])
+        if self._dryRun:
+            self._execBackupCmd(args)
+            return
+        result = []
+        def store_output(store):
+            stream = store.openStream(os.path.basename(args[0]))
+            result.extend(self._execBackupCmd(args, out_sink=stream))
+            if result[0] != 0:
+                raise errors.BackupError("Backup command failed with error "
+                                         "code: %s" % result[0],
+                                         "Command: %s" % ' '.join(args),
+                                         *utils.splitMsg(result[2]))
+        self._runStore(store_output, "output of command %s" % args[0])
+        logger.info("Finished deduplicated backup of command output: %s",
+                    args[0])
+
+    def dedupFiles(self):
+        """Stores the files in the list of source paths in chunk repository.
+
+        """
+        if not self._conf.has_key('path_list'):
+            raise errors.BackupConfigError("Required job configuration "
+                                           "option path_list not defined.")
+        path_list = [os.path.normpath(path)
+                     for path in re.split('\s*,\s*|\s+',
+                                          self._conf['path_list'])]
+        base_dir = self._checkBaseDir()
+        exclude_patterns = self._getAllExcludePatterns()
+        logger.info("Starting deduplicated backup of paths: %s",
+                    ', '.join(path_list))
+        if self._dryRun:
+            logger.debug("Fake generation of recipe: %s",
+                         self._getRecipePath())
+            return
+        def store_files(store):
+            for (path, fs_path, st) in fsutils.walkPaths(path_list, base_dir,
+                                                         exclude_patterns,
+                                                         self._onPathError):
+                if fsutils.getEntryType(st.st_mode) == 'f':
+                    self._storeFile(store, path, fs_path)
+        self._runStore(store_files, "paths")
+        if self._pathErrors:
+            raise errors.BackupError("Backup of %d paths failed."
+                                     % len(self._pathErrors),
+                                     *self._pathErrors)
+        logger.info("Finished deduplicated backup of paths: %s",
+                    ', '.join(path_list))
+
+    def _storeFile(self, store, path, fs_path):
+        try:
+            fp = open(fs_path, 'rb')
+        except IOError, e:
+            self._onPathError(path, e)
+            return
+        stream = store.openStream(path)
+        try:
+            try:
+                while True:
+                    data = fp.read(compress.defaultBlockSize)
+                    if not data:
+                        break
+                    stream.write(data)
+            except IOError, e:
+                self._onPathError(path, e)
+        finally:
+            fp.close()
+            stream.close()
+
+
+def getRepoPath(conf):
+    """Returns the path for the chunk repository of a job.
+
+    @param conf: Dictionary of job configuration options including the general
+                 options.
+    @return:     Path for chunk repository.
+
+    """
+    repo_path = conf.get('dedup_repo')
+    if repo_path is None:
+        repo_path = os.path.join(conf['backup_root'], 'dedup')
+    return os.path.normpath(repo_path)
+
+
+def restoreRecipe(recipe_path, out_dir, repo_path=None):
+    """Restores the streams in recipe file from chunk repository.
+
+    @param recipe_path: Path for recipe file.
+    @param out_dir:     Directory for restored files. The streams are restored
+                        to paths relative to out_dir.
+    @param repo_path:   Path for chunk repository. (The repository in the
+                        header of the recipe by default.)
+
+    """
+    (info, streams) = chunkstore.readRecipe(recipe_path)
+    repo_path = repo_path or info.get('repo')
+    if repo_path is None:
+        raise errors.BackupError("Chunk repository not defined for recipe: %s"
+                                 % recipe_path)
+    for (path, size, digest, chunks) in streams:
+        out_path = os.path.join(out_dir, path.lstrip('/'))
+        out_subdir = os.path.dirname(out_path)
+        if not os.path.isdir(out_subdir):
+            os.makedirs(out_subdir)
+        fp = open(out_path, 'wb')
+        try:
+            restored_digest = chunkstore.restoreStream(repo_path, chunks, fp)
+            restored_size = fp.tell()
+        finally:
+            fp.close()
+        if restored_digest != digest or restored_size != size:
+            raise errors.BackupError("Verification of restored file failed: %s"
+                                     % out_path)
+
+
+description = "Plugin for deduplicated storage of backups in chunk repository."
+methodList = (('dedup_cmd', PluginDedup, 'dedupCmd'),
+              ('dedup_files', PluginDedup, 'dedupFiles'),)
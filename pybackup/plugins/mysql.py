@@ -3,11 +3,16 @@
 """
 
 import os
+import re
+import time
+import select
+import subprocess
 from pybackup import errors
 from pybackup import utils
+from pybackup import compress
 from pybackup.logmgr import logger
 from pybackup.plugins import BackupPluginBase
-from pysysinfo.mysql import MySQLinfo
+from pysysinfo.util import parse_value
 
 
 __author__ = "Ali Onur Uyar"
@@ -20,6 +25,14 @@ __email__ = "aouyar at gmail.com"
 __status__ = "Development"
 
 
+lockKillDelay = 10
+"""Seconds the mysql client holding the global read lock is waited for beyond
+lock_wait_timeout before it is killed."""
+
+skipLockDbs = ('information_schema', 'mysql', 'performance_schema')
+"""System databases dumped without table locks. (LOCK TABLES fails on the
+tables of information_schema and performance_schema.)"""
+
 
 class PluginMySQL(BackupPluginBase):
     """Class for backups of MySQL Database.
@@ -31,9 +44,42 @@ class PluginMySQL(BackupPluginBase):
                 'db_port': 'MySQL Database Server Port.', 
                 'db_user': 'MySQL Database Server User.', 
                 'db_password': 'MySQL Database Server Password.',
-                'db_list': 'List of databases. (All databases by default.)',}
+                'db_list': 'List of databases. (All databases by default.)',
+                'dump_workers': 'Number of databases dumped in parallel. '
+                                '(Default: 1)',
+                'dump_per_table': 'Dump each table of the databases to a '
+                                  'separate file with a pool of workers, '
+                                  'largest tables first. Unless '
+                                  'table_snapshot is enabled, each table is '
+                                  'consistent by itself but the tables of a '
+                                  'database are dumped at different points in '
+                                  'time. (Default: no)',
+                'table_workers': 'Number of tables of each database dumped '
+                                 'in parallel in per table mode. (Number of '
+                                 'CPUs by default.)',
+                'table_snapshot': 'Hold global read lock (FLUSH TABLES WITH '
+                                  'READ LOCK) while the tables of a database '
+                                  'are dumped in per table mode, for a '
+                                  'snapshot consistent across tables. Writes '
+                                  'are blocked during the whole dump. '
+                                  'Otherwise InnoDB tables are dumped in a '
+                                  'transaction and other tables with table '
+                                  'locks. (Default: no)',
+                'lock_wait_timeout': 'Seconds waited for acquiring the global '
+                                     'read lock of table_snapshot before the '
+                                     'dump fails. (Default: 60)',
+                'dump_order': 'Order of parallel database dumps. (size: '
+                              'largest databases first, by size on the '
+                              'server or in the previous backup, list: order '
+                              'of db_list) (Default: size)',}
     _extReqOptList = ()
     _extDefaults = {'cmd_mysqldump': 'mysqldump',
+                    'cmd_mysql': 'mysql',
+                    'dump_workers': 1,
+                    'dump_per_table': 'no',
+                    'dump_order': 'size',
+                    'table_snapshot': 'no',
+                    'lock_wait_timeout': 60,
                     'filename_dump_db': 'mysql_dump',}
     
     def __init__(self, global_conf, job_conf):
@@ -44,6 +90,9 @@ class PluginMySQL(BackupPluginBase):
         
         """
         BackupPluginBase.__init__(self, global_conf, job_conf)
+        if self._conf['dump_order'] not in ('size', 'list'):
+            raise errors.BackupConfigError("Invalid dump order: %s" 
+                                           % self._conf['dump_order'])
         self._connArgs = []
         for (opt, key) in (('-h', 'db_host'),
                            ('-P', 'db_port'),
@@ -69,7 +118,7 @@ class PluginMySQL(BackupPluginBase):
         dump_path = os.path.join(self._conf['job_path'], dump_filename)
         args = [self._conf['cmd_mysqldump'],]
         args.extend(self._connArgs)
-        if db in ('information_schema', 'mysql'):
+        if db in skipLockDbs:
             args.append('--skip-lock-tables')
         if not data:
             args.extend(['--no-create-info', '--no-data' ,'--databases'])
@@ -89,8 +138,250 @@ class PluginMySQL(BackupPluginBase):
                                      % (dump_desc, db, returncode),
                                      *utils.splitMsg(err))    
     
+    def _execQuery(self, query, db=None):
+        """Executes query with the mysql client.
+        
+        @param query: SQL query.
+        @param db:    Database for executing query.
+        @return:      List of rows, each row a list of column values.
+        
+        """
+        args = [self._conf['cmd_mysql'],]
+        args.extend(self._connArgs)
+        args.extend(['-N', '-B', '-e', query])
+        if db is not None:
+            args.append(db)
+        rows = []
+        out_sink = utils.OutputTail(line_func=lambda line: 
+                                    rows.append(line.split('\t')))
+        returncode, out, err = self._execBackupCmd(args, #@UnusedVariable
+                                                   self._env,
+                                                   force_exec=True,
+                                                   out_sink=out_sink)
+        if returncode != 0:
+            raise errors.BackupError("MySQL query failed with error code: %s" 
+                                     % returncode,
+                                     "Query: %s" % query,
+                                     *utils.splitMsg(err))
+        return rows
+    
+    def _getTables(self, db):
+        """Returns the list of tables and views in database sorted by size,
+        largest first.
+        
+        @param db: Database name.
+        @return:   List of (name, engine, size) tuples. The engine is None for
+                   views.
+        
+        """
+        query = ("SELECT TABLE_NAME, TABLE_TYPE, IFNULL(ENGINE, ''), "
+                 "IFNULL(DATA_LENGTH, 0) + IFNULL(INDEX_LENGTH, 0) "
+                 "FROM information_schema.TABLES WHERE TABLE_SCHEMA = '%s'" 
+                 % db.replace('\\', '\\\\').replace("'", "\\'"))
+        tables = []
+        for row in self._execQuery(query):
+            if len(row) != 4:
+                continue
+            (name, table_type, engine, size) = row
+            if table_type == 'VIEW':
+                tables.append((name, None, 0))
+            else:
+                tables.append((name, engine, int(size)))
+        # Views are dumped last, they depend on the tables.
+        tables.sort(key=lambda table: (table[1] is None, -table[2]))
+        return tables
+    
+    def _getDatabaseSizes(self):
+        """Returns the sizes of the databases.
+        
+        @return: Dictionary mapping database names to sizes in bytes.
+        
+        """
+        query = ("SELECT TABLE_SCHEMA, "
+                 "SUM(IFNULL(DATA_LENGTH, 0) + IFNULL(INDEX_LENGTH, 0)) "
+                 "FROM information_schema.TABLES GROUP BY TABLE_SCHEMA")
+        sizes = {}
+        for row in self._execQuery(query):
+            if len(row) == 2:
+                sizes[row[0]] = int(row[1])
+        return sizes
+    
+    def _lockTables(self):
+        """Acquires global read lock in a separate session of the mysql 
+        client. The lock is held until the session is closed by 
+        _unlockTables. The wait for the lock is limited by lock_wait_timeout
+        on the server; the client is killed if it does not respond within 
+        lockKillDelay seconds more.
+        
+        @return: Popen instance for the mysql client.
+        
+        """
+        timeout = self._getPosIntOpt('lock_wait_timeout')
+        args = [self._conf['cmd_mysql'],]
+        args.extend(self._connArgs)
+        args.extend(['-N', '-B'])
+        try:
+            cmd = subprocess.Popen(self._priority.getCmdPrefix() + args, 
+                                   stdin=subprocess.PIPE,
+                                   stdout=subprocess.PIPE,
+                                   stderr=subprocess.PIPE, 
+                                   close_fds=True,
+                                   env=self._env)
+        except Exception, e:
+            raise errors.BackupCmdError("Backup command execution failed.",
+                                        "Command: %s" % ' '.join(args),
+                                        "Error Message: %s" % str(e))
+        line = ''
+        timed_out = False
+        try:
+            cmd.stdin.write("SET SESSION lock_wait_timeout = %d;\n"
+                            "FLUSH TABLES WITH READ LOCK;\n"
+                            "SELECT 'locked';\n" % timeout)
+            cmd.stdin.flush()
+            deadline = time.time() + timeout + lockKillDelay
+            fd = cmd.stdout.fileno()
+            while not line.endswith('\n'):
+                wait = deadline - time.time()
+                if wait <= 0 or not select.select([fd], [], [], wait)[0]:
+                    timed_out = True
+                    break
+                data = os.read(fd, 4096)
+                if not data:
+                    break
+                line += data
+        except (IOError, OSError, select.error):
+            pass
+        if timed_out:
+            cmd.kill()
+            utils.waitCmd(cmd)
+            for fp in (cmd.stdin, cmd.stdout, cmd.stderr):
+                try:
+                    fp.close()
+                except IOError:
+                    pass
+            raise errors.BackupError("Global read lock for MySQL snapshot "
+                                     "failed.",
+                                     "The mysql client did not respond in %d "
+                                     "seconds and was killed." 
+                                     % (timeout + lockKillDelay))
+        if line.strip() != 'locked':
+            try:
+                cmd.stdin.close()
+            except IOError:
+                pass
+            err = cmd.stderr.read()
+            utils.waitCmd(cmd)
+            raise errors.BackupError("Global read lock for MySQL snapshot "
+                                     "failed.", *utils.splitMsg(err))
+        logger.debug("Acquired global read lock for MySQL snapshot.")
+        return cmd
+    
+    def _unlockTables(self, cmd):
+        """Releases global read lock acquired by _lockTables.
+        
+        @param cmd: Popen instance returned by _lockTables.
+        
+        """
+        try:
+            cmd.stdin.write("UNLOCK TABLES;\n")
+            cmd.stdin.close()
+        except IOError:
+            pass
+        cmd.stdout.close()
+        cmd.stderr.close()
+        utils.waitCmd(cmd)
+        logger.debug("Released global read lock for MySQL snapshot.")
+    
+    def dumpTable(self, db, table, locked=False):
+        """Dumps table of database to compressed file.
+        
+        @param db:     Database name.
+        @param table:  Tuple of (name, engine, size) returned by _getTables.
+        @param locked: Tables are protected by global read lock if True.
+        
+        """
+        (name, engine, size) = table #@UnusedVariable
+        dump_dir = os.path.join(self._conf['job_path'], 
+                                "%s_%s_tables" % (self._conf['filename_dump_db'], 
+                                                  db))
+        dump_filename = "%s.dump.%s" % (re.sub('[^\w.-]', lambda mobj: 
+                                               "@%04x" % ord(mobj.group(0)), 
+                                               name), 
+                                        self._conf['suffix_compress'])
+        dump_path = os.path.join(dump_dir, dump_filename)
+        args = [self._conf['cmd_mysqldump'],]
+        args.extend(self._connArgs)
+        if locked or engine is None or db in skipLockDbs:
+            args.append('--skip-lock-tables')
+        elif engine.lower() == 'innodb':
+            args.append('--single-transaction')
+        args.extend([db, name])
+        logger.debug("Starting dump of MySQL Table: %s.%s  Backup: %s", 
+                     db, name, dump_path)
+        returncode, out, err = self._execBackupCmd(args, #@UnusedVariable
+                                                   self._env,
+                                                   out_path=dump_path,
+                                                   out_compress=True,
+                                                   throttle=not locked)
+        if returncode != 0:
+            raise errors.BackupError("Dump of MySQL Table %s.%s failed "
+                                     "with error code: %s" 
+                                     % (db, name, returncode),
+                                     *utils.splitMsg(err))
+    
+    def dumpDatabaseTables(self, db):
+        """Dumps the tables of database to separate files in parallel.
+        
+        @param db: Database name.
+        
+        """
+        tables = self._getTables(db)
+        num_workers = self._getPosIntOpt('table_workers', compress.getNumCPUs())
+        snapshot = (parse_value(self._conf['table_snapshot'], True) 
+                    and db not in ('information_schema', 'performance_schema'))
+        dump_dir = os.path.join(self._conf['job_path'], 
+                                "%s_%s_tables" % (self._conf['filename_dump_db'], 
+                                                  db))
+        if not os.path.isdir(dump_dir):
+            os.makedirs(dump_dir)
+        logger.info("Starting dump of %d tables of MySQL Database: %s"
+                    "  Backup: %s", len(tables), db, dump_dir)
+        lock_cmd = None
+        if snapshot and not self._dryRun:
+            # Writes are blocked while the lock is held, the table dumps are
+            # not delayed by throttling once the lock is acquired.
+            self._waitThrottle("dump of tables of MySQL Database: %s" % db)
+            lock_cmd = self._lockTables()
+        try:
+            failed = self._runWorkerPool(lambda table: 
+                                         self.dumpTable(db, table, 
+                                                        lock_cmd is not None),
+                                         tables, num_workers)
+        finally:
+            if lock_cmd is not None:
+                self._unlockTables(lock_cmd)
+        self._checkFailedItems([("%s.%s" % (db, table[0]), e) 
+                                for (table, e) in failed], 
+                               len(tables), 'MySQL Tables')
+        logger.info("Finished dump of tables of MySQL Database: %s", db)
+    
+    def dumpDatabaseFull(self, db):
+        self.dumpDatabase(db, False)
+        if parse_value(self._conf['dump_per_table'], True):
+            self.dumpDatabaseTables(db)
+        else:
+            self.dumpDatabase(db, True)
+    
     def dumpDatabases(self):
         if not self._conf.has_key('db_list'):
+            # The client library is only imported by jobs querying the server.
+            try:
+                from pysysinfo.mysql import MySQLinfo
+            except ImportError, e:
+                raise errors.BackupEnvironmentError("Loading of MySQL client "
+                                                    "library failed.",
+                                                    "Error Message: %s" 
+                                                    % str(e))
             try:
                 my = MySQLinfo(host=self._conf.get('db_host'),
                                port=self._conf.get('db_port'),
@@ -102,11 +393,36 @@ class PluginMySQL(BackupPluginBase):
                 raise errors.BackupError("Connection to MySQL Server "
                                          "for querying database list failed.",
                                          "Error Message: %s" % str(e))
+        elif isinstance(self._conf['db_list'], basestring):
+            self._conf['db_list'] = re.split('\s*,\s*|\s+', 
+                                             self._conf['db_list'].strip())
+        num_workers = self._getPosIntOpt('dump_workers')
+        db_list = self._conf['db_list']
+        if (self._conf['dump_order'] == 'size' 
+            and num_workers > 1 and len(db_list) > 1):
+            try:
+                sizes = self._getDatabaseSizes()
+            except errors.BackupError, e:
+                logger.warning("Sizing of database dumps by database size "
+                               "failed: %s", ' '.join(e))
+                sizes = {}
+            if not sizes:
+                prefix = self._conf['filename_dump_db']
+                sizes = self._getPrevOutputSizes(
+                    dict([(db, ("%s_%s_data.dump." % (prefix, db),
+                                "%s_%s_tables/" % (prefix, db))) 
+                          for db in db_list]))
+            self._conf['db_list'] = self._sortBySize(db_list, sizes)
+            logger.debug("Order of MySQL Database dumps: %s",
+                         ', '.join(self._conf['db_list']))
         logger.info("Starting dump of %d MySQL Databases.",
                     len(self._conf['db_list']))
-        for db in self._conf['db_list']:
-            self.dumpDatabase(db, False)
-            self.dumpDatabase(db, True)
+        failed = self._runWorkerPool(lambda db: 
+                                     self._runUnit("db:%s" % db, 
+                                                   self.dumpDatabaseFull, db), 
+                                     self._conf['db_list'], num_workers)
+        self._checkFailedItems(failed, len(self._conf['db_list']), 
+                               'MySQL Databases')
         logger.info("Finished dump of MySQL Databases.")
 
     def dumpFull(self):
@@ -3,11 +3,13 @@
 """
 
 import os
+import re
+import shutil
 from pybackup import errors
 from pybackup import utils
+from pybackup import compress
 from pybackup.logmgr import logger
 from pybackup.plugins import BackupPluginBase
-from pysysinfo.postgresql import PgInfo
 
 
 __author__ = "Ali Onur Uyar"
@@ -20,6 +22,10 @@ __email__ = "aouyar at gmail.com"
 __status__ = "Development"
 
 
+# Defaults
+defaultDumpJobSize = 10737418240
+"""Database size in bytes per parallel job for directory format dumps."""
+
 
 class PluginPostgreSQL(BackupPluginBase):
     """Class for backups of PostgreSQL Database.
@@ -33,9 +39,28 @@ class PluginPostgreSQL(BackupPluginBase):
                 'db_user': 'Postgres Database Server User.', 
                 'db_password': 'Postgres Database Server Password.',
                 'db_database': 'Postgres Database for initial connection.',
-                'db_list': 'List of databases. (All databases by default.)',}
+                'db_list': 'List of databases. (All databases by default.)',
+                'dump_workers': 'Number of databases dumped in parallel. '
+                                '(Default: 1)',
+                'dump_format': 'Format for database dumps. (custom: single '
+                               'file, directory: directory with one file per '
+                               'table, dumped in parallel) (Default: custom)',
+                'dump_jobs': 'Number of parallel jobs for dump of each '
+                             'database in directory format. (Sized by the '
+                             'number of CPUs and the database size by '
+                             'default.)',
+                'dump_job_size': 'Database size in bytes per parallel job for '
+                                 'automatic sizing of dump_jobs. '
+                                 '(Default: 10737418240)',
+                'dump_order': 'Order of parallel database dumps. (size: '
+                              'largest databases first, by size on the '
+                              'server or in the previous backup, list: order '
+                              'of db_list) (Default: size)',}
     _extReqOptList = ()
     _extDefaults = {'cmd_pg_dump': 'pg_dump','cmd_pg_dumpall': 'pg_dumpall',
+                    'dump_workers': 1,
+                    'dump_format': 'custom',
+                    'dump_order': 'size',
                     'filename_dump_globals': 'pg_dump_globals',
                     'filename_dump_db': 'pg_dump_db',}
     
@@ -47,6 +72,13 @@ class PluginPostgreSQL(BackupPluginBase):
         
         """
         BackupPluginBase.__init__(self, global_conf, job_conf)
+        if self._conf['dump_format'] not in ('custom', 'directory'):
+            raise errors.BackupConfigError("Invalid dump format: %s" 
+                                           % self._conf['dump_format'])
+        if self._conf['dump_order'] not in ('size', 'list'):
+            raise errors.BackupConfigError("Invalid dump order: %s" 
+                                           % self._conf['dump_order'])
+        self._dbSizes = {}
         self._connArgs = []
         for (opt, key) in (('-h', 'db_host'),
                            ('-p', 'db_port'),
@@ -80,17 +112,106 @@ class PluginPostgreSQL(BackupPluginBase):
                                      % returncode,
                                      *utils.splitMsg(err))
         
+    def _getPgInfo(self):
+        # The client library is only imported by jobs querying the server.
+        try:
+            from pysysinfo.postgresql import PgInfo
+        except ImportError, e:
+            raise errors.BackupEnvironmentError("Loading of PostgreSQL client "
+                                                "library failed.",
+                                                "Error Message: %s" % str(e))
+        try:
+            return PgInfo(host=self._conf.get('db_host'),
+                          port=self._conf.get('db_port'),
+                          database=self._conf.get('db_database'),
+                          user=self._conf.get('db_user'),
+                          password=self._conf.get('db_password'))
+        except Exception, e:
+            raise errors.BackupError("Connection to PostgreSQL Server "
+                                     "failed.",
+                                     "Error Message: %s" % str(e))
+            
+    def _getDatabaseSizes(self):
+        """Returns the sizes of the databases.
+        
+        @return: Dictionary mapping database names to sizes in bytes.
+        
+        """
+        pg = self._getPgInfo()
+        try:
+            stats = pg.getDatabaseStats()
+        except Exception, e:
+            raise errors.BackupError("Query of PostgreSQL database sizes "
+                                     "failed.",
+                                     "Error Message: %s" % str(e))
+        return dict([(db, int(db_stats['disk_size'])) 
+                     for (db, db_stats) in stats['databases'].items()])
+    
+    def _getDumpJobs(self, db):
+        """Returns the number of parallel jobs for directory format dump of
+        database. The number of jobs is proportional to the size of the 
+        database and limited by the number of CPUs available to each of the
+        databases dumped in parallel, unless dump_jobs is set.
+        
+        @param db: Database name.
+        @return:   Number of jobs.
+        
+        """
+        if self._conf.has_key('dump_jobs'):
+            return self._getPosIntOpt('dump_jobs')
+        max_jobs = max(1, compress.getNumCPUs() 
+                          // self._getPosIntOpt('dump_workers'))
+        size = self._dbSizes.get(db)
+        if size is None:
+            return max_jobs
+        job_size = self._getPosIntOpt('dump_job_size', defaultDumpJobSize)
+        return max(1, min(max_jobs, (size + job_size - 1) // job_size))
+        
     def dumpDatabase(self, db):
+        if self._conf['dump_format'] == 'directory':
+            return self.dumpDatabaseDir(db)
         dump_filename = "%s_%s.dump" % (self._conf['filename_dump_db'], 
                                         db)
         dump_path = os.path.join(self._conf['job_path'], dump_filename)
         args = [self._conf['cmd_pg_dump'], '-w', '-Fc']
         args.extend(self._connArgs)
-        args.extend(['-f', dump_path, db])
+        args.append(db)
         logger.info("Starting dump of PostgreSQL Database: %s"
                     "  Backup: %s", db, dump_path)
+        returncode, out, err = self._execBackupCmd(args, #@UnusedVariable
+                                                   self._env,
+                                                   out_path=dump_path) 
+        if returncode == 0:
+            logger.info("Finished dump of PostgreSQL Database: %s"
+                        "  Backup: %s", db, dump_path)
+        else:
+            raise errors.BackupError("Dump of PostgreSQL database %s failed "
+                                     "with error code %s." % (db, returncode),
+                                     *utils.splitMsg(err))
+    
+    def dumpDatabaseDir(self, db):
+        """Dumps database in directory format with parallel jobs.
+        
+        @param db: Database name.
+        
+        """
+        dump_dirname = "%s_%s.dir" % (self._conf['filename_dump_db'], db)
+        dump_path = os.path.join(self._conf['job_path'], dump_dirname)
+        num_jobs = self._getDumpJobs(db)
+        args = [self._conf['cmd_pg_dump'], '-w', '-Fd', '-j', str(num_jobs)]
+        if self._conf.has_key('compress_level'):
+            args.extend(['-Z', str(self._compressLevel)])
+        args.extend(self._connArgs)
+        args.extend(['-f', dump_path, db])
+        logger.info("Starting dump of PostgreSQL Database: %s  Jobs: %d"
+                    "  Backup: %s", db, num_jobs, dump_path)
+        if os.path.isdir(dump_path) and not self._dryRun:
+            # pg_dump requires a new directory.
+            shutil.rmtree(dump_path)
         returncode, out, err = self._execBackupCmd(args, self._env) #@UnusedVariable
         if returncode == 0:
+            if not self._dryRun:
+                self._hashOutputDir(dump_path, num_jobs)
             logger.info("Finished dump of PostgreSQL Database: %s"
                         "  Backup: %s", db, dump_path)
         else:
@@ -100,30 +221,54 @@ class PluginPostgreSQL(BackupPluginBase):
     
     def dumpDatabases(self):
         if not self._conf.has_key('db_list'):
+            pg = self._getPgInfo()
             try:
-                pg = PgInfo(host=self._conf.get('db_host'),
-                            port=self._conf.get('db_port'),
-                            database=self._conf.get('db_database'),
-                            user=self._conf.get('db_user'),
-                            password=self._conf.get('db_password'))
                 self._conf['db_list'] = pg.getDatabases()
-                del pg
             except Exception, e:
                 raise errors.BackupError("Connection to PostgreSQL Server "
                                          "for querying database list failed.",
                                          "Error Message: %s" % str(e))
+            del pg
+        elif isinstance(self._conf['db_list'], basestring):
+            self._conf['db_list'] = re.split('\s*,\s*|\s+', 
+                                             self._conf['db_list'].strip())
         try:
             self._conf['db_list'].remove('template0')
         except ValueError:
             pass
+        num_workers = self._getPosIntOpt('dump_workers')
+        db_list = self._conf['db_list']
+        by_size = (self._conf['dump_order'] == 'size' 
+                   and num_workers > 1 and len(db_list) > 1)
+        if by_size or (self._conf['dump_format'] == 'directory' 
+                       and not self._conf.has_key('dump_jobs')):
+            try:
+                self._dbSizes = self._getDatabaseSizes()
+            except errors.BackupError, e:
+                logger.warning("Sizing of database dumps by database size "
+                               "failed: %s", ' '.join(e))
+        if by_size:
+            sizes = self._dbSizes
+            if not sizes:
+                sizes = self._getPrevOutputSizes(
+                    dict([(db, ("%s_%s." % (self._conf['filename_dump_db'], 
+                                            db),)) 
+                          for db in db_list]))
+            self._conf['db_list'] = self._sortBySize(db_list, sizes)
+            logger.debug("Order of PostgreSQL Database dumps: %s",
+                         ', '.join(self._conf['db_list']))
         logger.info("Starting dump of %d PostgreSQL Databases.",
                     len(self._conf['db_list']))
-        for db in self._conf['db_list']:
-            self.dumpDatabase(db)
+        failed = self._runWorkerPool(lambda db: 
+                                     self._runUnit("db:%s" % db, 
+                                                   self.dumpDatabase, db), 
+                                     self._conf['db_list'], num_workers)
+        self._checkFailedItems(failed, len(self._conf['db_list']), 
+                               'PostgreSQL Databases')
         logger.info("Finished dump of PostgreSQL Databases.")
 
     def dumpFull(self):
-        self.dumpGlobals()
+        self._runUnit('globals', self.dumpGlobals)
         self.dumpDatabases()
         
 description = "Plugin for backups of PostgreSQL Database." 
@@ -4,8 +4,10 @@
 
 import os
 import re
+import tempfile
 from pybackup import errors
 from pybackup import utils
+from pybackup import fsutils
 from pybackup.logmgr import logger
 from pybackup.plugins import BackupPluginBase
 from pysysinfo.util import parse_value
@@ -46,7 +48,14 @@ class PluginRsync(BackupPluginBase):
                 'exclude_patterns_file': 'Path for file that stores list of '
                                         'filename patterns to exclude from '
                                         'the backup.',
-                'index_filename': 'Filename for index of synchronized files.',}
+                'index_filename': 'Filename for index of synchronized files.',
+                'snapshot': 'Enable / disable snapshot mode; unchanged files '
+                            'are hardlinked to the newest previous backup of '
+                            'the job. (Not supported with dst_dir.) '
+                            '(Default: no)',
+                'scan_workers': 'Number of worker threads for scanning the '
+                                'source paths for the estimate of dry runs. '
+                                '(Default: 8)',}
     _extReqOptList = ('path_list',)
     _extDefaults = {'cmd_rsync': 'rsync',
                     'filename_index': 'rsync', 
@@ -109,6 +118,69 @@ class PluginRsync(BackupPluginBase):
             else:
                 self._archive_path = os.path.join(self._conf['job_path'], 
                                                   'localhost')
+    
+    def _getLinkDest(self):
+        """Returns the path of the newest previous backup of the job for use 
+        as hardlink reference in snapshot mode.
+        
+        @return: Path or None if there is no previous backup.
+        
+        """
+        if self._conf.get('dst_dir') is not None:
+            raise errors.BackupConfigError("Snapshot mode is not supported with "
+                                           "destination directory (dst_dir).")
+        backup_path = self._conf['backup_path']
+        rel_path = os.path.relpath(self._archive_path, backup_path)
+        return utils.findPrevBackupPath(self._conf['backup_base'],
+                                        os.path.basename(backup_path), 
+                                        rel_path)
+    
+    def _estimate(self, exclude_patterns, exclude_patterns_file):
+        """Logs the estimate for the backup in dry-run mode. Only local 
+        source paths are scanned.
+        
+        """
+        if self._remote is not None:
+            logger.info("Dry run estimate not available for remote source "
+                        "paths.")
+            return
+        patterns = list(exclude_patterns or [])
+        if exclude_patterns_file is not None:
+            patterns.extend(fsutils.readExcludeFile(exclude_patterns_file))
+        self._estimateScan(self._path_list, self._conf.get('base_dir'), 
+                           patterns)
+    
+    def _recordStats(self, text):
+        """Records the total size of the synchronized files and the size of
+        the transferred files from the statistics printed by rsync.
+        
+        @param text: Output text including the statistics.
+        
+        """
+        mobj = re.search('^Total file size: ([\d,.]+) bytes', text, 
+                         re.MULTILINE)
+        if mobj is not None:
+            self._recordInputBytes(int(re.sub('[,.]', '', mobj.group(1))))
+        mobj = re.search('^Total transferred file size: ([\d,.]+) bytes', 
+                         text, re.MULTILINE)
+        if mobj is not None:
+            self._recordBytesWritten(int(re.sub('[,.]', '', mobj.group(1))))
+    
+    def _readIndexTail(self, index_path, size=4096):
+        """Returns the tail of the index file, with the statistics printed 
+        by rsync.
+        
+        """
+        try:
+            fp = open(index_path, 'rb')
+            try:
+                fp.seek(0, os.SEEK_END)
+                fp.seek(max(0, fp.tell() - size))
+                return fp.read()
+            finally:
+                fp.close()
+        except IOError:
+            return ''
                 
     def syncDirs(self):
         self._initSrc()
@@ -116,6 +188,11 @@ class PluginRsync(BackupPluginBase):
         compress = parse_value(self._conf.get('compress'), True)
         delete = parse_value(self._conf.get('delete'), False)
         backup_index = parse_value(self._conf.get('backup_index'), True)
+        snapshot = parse_value(self._conf.get('snapshot'), True)
+        if snapshot:
+            link_dest = self._getLinkDest()
+        else:
+            link_dest = None
         if self._conf.has_key('exclude_patterns'):
             exclude_patterns = re.split('\s*,\s*|\s+', 
                                         self._conf['exclude_patterns'])
@@ -131,9 +208,15 @@ class PluginRsync(BackupPluginBase):
             args.append('-z')
         if backup_index:
             args.append('-v')
-            args.append('--stats')
+        args.append('--stats')
         if delete:
             args.append('--delete')
+        if link_dest is not None:
+            logger.info("Snapshot mode, hardlinking unchanged files to: %s", 
+                        link_dest)
+            args.append("--link-dest=%s" % os.path.abspath(link_dest))
+        elif snapshot:
+            logger.info("Snapshot mode, no previous backup found for job.")
         if exclude_patterns is not None:
             for pattern in exclude_patterns:
                 args.append("--exclude=%s" % pattern)
@@ -148,13 +231,34 @@ class PluginRsync(BackupPluginBase):
         else:
             raise errors.BackupConfigError("No valid source paths defined for backup.")
         args.append(self._archive_path)         
+        if self._dryRun:
+            self._estimate(exclude_patterns, exclude_patterns_file)
         if backup_index:
-            returncode, out, err = self._execBackupCmd(args, #@UnusedVariable
-                                                       out_path=self._index_path, 
-                                                       force_exec=True) 
+            if self._dryRun:
+                # The listing of the dry-run must not replace the index of 
+                # an existing backup.
+                try:
+                    (index_fd, index_path) = tempfile.mkstemp(prefix='.rsync.',
+                                                              suffix='.list')
+                    os.close(index_fd)
+                except EnvironmentError, e:
+                    raise errors.BackupFileCreateError(
+                        "Failed creation of temporary index file.",
+                        "Error Message: %s" % str(e))
+            else:
+                index_path = self._index_path
+            try:
+                returncode, out, err = self._execBackupCmd(args, #@UnusedVariable
+                                                           out_path=index_path, 
+                                                           force_exec=True) 
+                out = self._readIndexTail(index_path)
+            finally:
+                if self._dryRun:
+                    os.unlink(index_path)
         else:
             returncode, out, err = self._execBackupCmd(args, force_exec=True) #@UnusedVariable
         if returncode == 0:
+            self._recordStats(out)
             logger.info("Finished backup of paths: %s", ', '.join(self._path_list))
         else:
             raise errors.BackupError("Backup of paths failed with error code: %s" 
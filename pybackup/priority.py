@@ -0,0 +1,292 @@
+"""pybackup - Scheduling priority of backup commands and throttling by load.
+
+The nice level, the I/O scheduling class and the CPU affinity of the backup
+commands started by the plugins are set by prefixing the commands with nice,
+ionice and taskset, so the backup process itself and the other jobs are not
+affected. (No Python code is run in the child processes between fork and exec,
+which is not safe in the multi-threaded backup process, and the settings are
+in effect before the commands start any threads or processes of their own.)
+The start of new tasks is delayed while the load average or the average latency
+of disk I/O is above the configured thresholds.
+
+"""
+
+import os
+import time
+import threading
+from pybackup import errors
+from pybackup.logmgr import logger
+
+__author__ = "Ali Onur Uyar"
+__copyright__ = "Copyright 2011, Ali Onur Uyar"
+__credits__ = []
+__license__ = "GPL"
+__version__ = "0.5"
+__maintainer__ = "Ali Onur Uyar"
+__email__ = "aouyar at gmail.com"
+__status__ = "Development"
+
+
+# Defaults
+defaultThrottleInterval = 10
+"""Interval in seconds between checks of the load while new tasks are
+delayed."""
+
+defaultThrottleMaxWait = 3600
+"""Maximum delay in seconds for the start of a task."""
+
+ioniceClasses = {'realtime': 1, 'best-effort': 2, 'idle': 3}
+"""Dictionary mapping I/O scheduling classes to class numbers of ionice."""
+
+maxCpus = 1024
+"""Maximum number of CPUs in CPU lists."""
+
+defaultCmdNice = 'nice'
+"""Default path for nice command executable."""
+
+defaultCmdIonice = 'ionice'
+"""Default path for ionice command executable."""
+
+defaultCmdTaskset = 'taskset'
+"""Default path for taskset command executable."""
+
+diskStatsPath = '/proc/diskstats'
+"""Path for disk I/O statistics of the kernel."""
+
+
+def parseCpuList(spec):
+    """Parses list of CPUs in the format of taskset. (Example: 0-3,6)
+
+    @param spec: Comma separated list of CPU numbers and ranges.
+    @return:     Sorted list of CPU numbers.
+
+    """
+    cpus = set()
+    try:
+        for item in spec.split(','):
+            (start, sep, end) = item.strip().partition('-')
+            if sep:
+                cpus.update(range(int(start), int(end) + 1))
+            else:
+                cpus.add(int(start))
+    except ValueError:
+        cpus = set()
+    if not cpus or min(cpus) < 0 or max(cpus) >= maxCpus:
+        raise errors.BackupConfigError("Invalid list of CPUs: %s" % spec)
+    return sorted(cpus)
+
+def readDiskStats():
+    """Returns the totals of the I/O statistics of the disks. Partitions, loop
+    and RAM devices are not included.
+
+    @return: Tuple of (number of completed reads and writes, time spent in
+             reads and writes in milliseconds) or None if the statistics are
+             not available.
+
+    """
+    try:
+        disks = set([name for name in os.listdir('/sys/block')
+                     if not name.startswith(('loop', 'ram'))])
+        fp = open(diskStatsPath, 'r')
+        try:
+            lines = fp.readlines()
+        finally:
+            fp.close()
+    except EnvironmentError:
+        return None
+    ios = 0
+    ms = 0
+    for line in lines:
+        fields = line.split()
+        if len(fields) >= 11 and fields[2] in disks:
+            ios += int(fields[3]) + int(fields[7])
+            ms += int(fields[6]) + int(fields[10])
+    return (ios, ms)
+
+
+class ProcessPriority:
+    """Scheduling priority settings for backup commands. The settings are
+    applied by the command prefix returned by getCmdPrefix.
+
+    """
+
+    def __init__(self, nice_level=None, ionice_class=None, ionice_level=None,
+                 cpu_list=None, cmd_nice=None, cmd_ionice=None, 
+                 cmd_taskset=None):
+        """Constructor
+
+        @param nice_level:   Nice level. (-20 - 19)
+        @param ionice_class: I/O scheduling class. (realtime, best-effort or
+                             idle)
+        @param ionice_level: Priority level within the I/O scheduling class.
+                             (0 - 7)
+        @param cpu_list:     List of CPU numbers for CPU affinity.
+        @param cmd_nice:     Path for nice command executable.
+        @param cmd_ionice:   Path for ionice command executable.
+        @param cmd_taskset:  Path for taskset command executable.
+
+        """
+        self._niceLevel = nice_level
+        self._cmdNice = cmd_nice or defaultCmdNice
+        self._ioniceArgs = None
+        self._tasksetArgs = None
+        if nice_level is not None and not -20 <= nice_level <= 19:
+            raise errors.BackupConfigError("Invalid nice level: %s"
+                                           % nice_level)
+        if ionice_class is not None:
+            if not ioniceClasses.has_key(ionice_class):
+                raise errors.BackupConfigError("Invalid I/O scheduling "
+                                               "class: %s" % ionice_class)
+            self._ioniceArgs = [cmd_ionice or defaultCmdIonice, 
+                                '-c', str(ioniceClasses[ionice_class])]
+            if ionice_class == 'idle':
+                pass
+            elif ionice_level is None:
+                self._ioniceArgs.extend(['-n', '0'])
+            elif 0 <= ionice_level <= 7:
+                self._ioniceArgs.extend(['-n', str(ionice_level)])
+            else:
+                raise errors.BackupConfigError("Invalid I/O scheduling "
+                                               "priority level: %s"
+                                               % ionice_level)
+        if cpu_list:
+            self._tasksetArgs = [cmd_taskset or defaultCmdTaskset, '-c', 
+                                 ','.join([str(cpu) for cpu in cpu_list])]
+
+    def isSet(self):
+        """Returns True if any of the settings is defined.
+
+        @return: Boolean
+
+        """
+        return (self._niceLevel is not None or self._ioniceArgs is not None
+                or self._tasksetArgs is not None)
+
+    def getCmdPrefix(self):
+        """Returns the arguments to prepend to the arguments of backup 
+        commands for applying the settings.
+
+        @return: List of arguments. (Empty if no settings are defined.)
+
+        """
+        prefix = []
+        if self._niceLevel is not None:
+            # The nice command adjusts the nice level of the backup process.
+            prefix.extend([self._cmdNice, '-n', 
+                           str(self._niceLevel - os.nice(0))])
+        if self._ioniceArgs is not None:
+            prefix.extend(self._ioniceArgs)
+        if self._tasksetArgs is not None:
+            prefix.extend(self._tasksetArgs)
+        return prefix
+
+
+class Throttle:
+    """Delays the start of new tasks while the system is loaded. The load
+    average of the last minute and the average latency of the disk I/O
+    operations completed since the previous check are compared with the
+    thresholds.
+
+    """
+
+    def __init__(self, max_load=None, max_latency=None,
+                 interval=defaultThrottleInterval,
+                 max_wait=defaultThrottleMaxWait):
+        """Constructor
+
+        @param max_load:    Threshold for load average.
+        @param max_latency: Threshold for average latency of disk I/O in
+                            milliseconds.
+        @param interval:    Interval in seconds between checks while tasks
+                            are delayed.
+        @param max_wait:    Maximum delay in seconds for a task. (No limit if
+                            0.)
+
+        """
+        self._maxLoad = max_load
+        self._maxLatency = max_latency
+        self._interval = interval
+        self._maxWait = max_wait
+        self._lock = threading.Lock()
+        self._diskSample = None
+        self._latency = None
+        if max_latency is not None:
+            stats = readDiskStats()
+            if stats is None:
+                raise errors.BackupConfigError("Throttling by disk latency "
+                                               "requires disk statistics: %s"
+                                               % diskStatsPath)
+            self._diskSample = (time.time(), stats)
+
+    def getDiskLatency(self):
+        """Returns the average latency of the disk I/O operations completed
+        since the previous call. The previous value is returned for calls less
+        than a second apart.
+
+        @return: Latency in milliseconds or None if no operations completed.
+
+        """
+        self._lock.acquire()
+        try:
+            now = time.time()
+            (prev_time, (prev_ios, prev_ms)) = self._diskSample
+            if now - prev_time >= 1:
+                stats = readDiskStats()
+                if stats is not None:
+                    (ios, ms) = stats
+                    if ios > prev_ios:
+                        self._latency = float(ms - prev_ms) / (ios - prev_ios)
+                    else:
+                        self._latency = None
+                    self._diskSample = (now, stats)
+            return self._latency
+        finally:
+            self._lock.release()
+
+    def check(self):
+        """Checks the load against the thresholds.
+
+        @return: List of messages for exceeded thresholds.
+
+        """
+        msgs = []
+        if self._maxLoad is not None:
+            try:
+                load = os.getloadavg()[0]
+            except OSError:
+                load = None
+            if load is not None and load > self._maxLoad:
+                msgs.append("Load average %.2f > %.2f" % (load, self._maxLoad))
+        if self._maxLatency is not None:
+            latency = self.getDiskLatency()
+            if latency is not None and latency > self._maxLatency:
+                msgs.append("Disk latency %.1f ms > %.1f ms"
+                            % (latency, self._maxLatency))
+        return msgs
+
+    def wait(self, desc):
+        """Blocks while the load is above the thresholds.
+
+        @param desc: Description of the delayed task for log messages.
+        @return:     Delay in seconds.
+
+        """
+        start = time.time()
+        msgs = self.check()
+        if msgs:
+            logger.info("Delaying start of %s: %s", desc, ', '.join(msgs))
+        while msgs:
+            delay = time.time() - start
+            if self._maxWait and delay >= self._maxWait:
+                logger.warning("Starting %s after maximum delay of %d s: %s",
+                               desc, self._maxWait, ', '.join(msgs))
+                return delay
+            time.sleep(self._interval)
+            msgs = self.check()
+            if msgs:
+                logger.debug("Delaying start of %s: %s", desc,
+                             ', '.join(msgs))
+        delay = time.time() - start
+        if delay >= self._interval:
+            logger.info("Starting %s after delay of %d s.", desc, delay)
+        return delay
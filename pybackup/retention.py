@@ -0,0 +1,227 @@
+"""pybackup - Retention policy for dated backup directories.
+
+The backups to retain are selected from the names of the dated backup
+directories (YYYY-MM-DD) and the job directories they contain, so no walk of
+the backup trees is needed for deciding what expires. Expired trees are removed
+by a pool of worker threads.
+
+"""
+
+import os
+import errno
+import threading
+import Queue
+from datetime import date
+from pybackup import errors
+
+__author__ = "Ali Onur Uyar"
+__copyright__ = "Copyright 2011, Ali Onur Uyar"
+__credits__ = []
+__license__ = "GPL"
+__version__ = "0.5"
+__maintainer__ = "Ali Onur Uyar"
+__email__ = "aouyar at gmail.com"
+__status__ = "Development"
+
+
+retentionOpts = ('retain_daily', 'retain_weekly', 'retain_monthly')
+"""Configuration options for retention policy. (Number of daily, weekly and
+monthly backups to retain.)"""
+
+
+def parseDate(name):
+    """Converts name of dated backup directory to date.
+
+    @param name: Directory name. (YYYY-MM-DD)
+    @return:     Date object.
+
+    """
+    (year, month, day) = name.split('-')
+    return date(int(year), int(month), int(day))
+
+def selectRetained(dates, daily=0, weekly=0, monthly=0):
+    """Selects the backups to retain. The newest daily backups are retained
+    and the newest backup of each of the newest weekly and monthly periods.
+
+    @param dates:   List of backup dates. (YYYY-MM-DD)
+    @param daily:   Number of daily backups to retain.
+    @param weekly:  Number of weekly backups to retain.
+    @param monthly: Number of monthly backups to retain.
+    @return:        Set of dates of retained backups.
+
+    """
+    dates = sorted(dates, reverse=True)
+    retained = set(dates[:daily])
+    weeks = set()
+    months = set()
+    for name in dates:
+        day = parseDate(name)
+        week = day.isocalendar()[:2]
+        if len(weeks) < weekly and week not in weeks:
+            weeks.add(week)
+            retained.add(name)
+        month = (day.year, day.month)
+        if len(months) < monthly and month not in months:
+            months.add(month)
+            retained.add(name)
+    return retained
+
+def getReferenceDates(job_path):
+    """Returns the dates of the backups that the backup in the job directory
+    depends on. (Reference backups of incremental and differential archives.)
+
+    @param job_path: Path for job directory.
+    @return:         List of backup dates.
+
+    """
+    refs = []
+    try:
+        names = os.listdir(job_path)
+    except OSError:
+        return refs
+    for name in names:
+        if name.endswith('.deleted'):
+            try:
+                fp = open(os.path.join(job_path, name), 'r')
+                try:
+                    for line in fp:
+                        if not line.startswith('## '):
+                            break
+                        if line.startswith('## reference: '):
+                            ref = line[len('## reference: '):].strip()
+                            if ref and ref != 'None':
+                                refs.append(ref)
+                finally:
+                    fp.close()
+            except IOError:
+                pass
+    return refs
+
+def removeTree(path):
+    """Removes directory tree. Entries are unlinked without stat calls;
+    directories are detected by the failure of unlink.
+
+    @param path: Path for file or directory.
+
+    """
+    try:
+        os.unlink(path)
+        return
+    except OSError, e:
+        if e.errno == errno.ENOENT:
+            return
+        if e.errno not in (errno.EISDIR, errno.EPERM):
+            raise
+    for name in os.listdir(path):
+        removeTree(os.path.join(path, name))
+    os.rmdir(path)
+
+def removeTrees(paths, num_workers=1):
+    """Removes the directory trees in parallel. The work is split at the
+    entries of the top-level directories, so large trees are removed in
+    parallel too.
+
+    @param paths:       List of paths for directories.
+    @param num_workers: Number of worker threads.
+    @return:            List of (path, error message) tuples for failures.
+
+    """
+    queue = Queue.Queue()
+    failed = []
+    for path in paths:
+        try:
+            names = os.listdir(path)
+        except OSError, e:
+            if e.errno != errno.ENOENT:
+                failed.append((path, str(e)))
+            continue
+        for name in names:
+            queue.put(os.path.join(path, name))
+
+    def worker():
+        while True:
+            try:
+                path = queue.get_nowait()
+            except Queue.Empty:
+                return
+            try:
+                removeTree(path)
+            except OSError, e:
+                failed.append((path, str(e)))
+
+    threads = []
+    for i in range(max(1, min(num_workers, queue.qsize()))):
+        thread = threading.Thread(target=worker, name="prune-%d" % i)
+        thread.setDaemon(True)
+        thread.start()
+        threads.append(thread)
+    for thread in threads:
+        thread.join()
+    failed_paths = set()
+    for (path, msg) in failed: #@UnusedVariable
+        failed_paths.add(path)
+        failed_paths.add(os.path.dirname(path))
+    for path in paths:
+        if path in failed_paths:
+            continue
+        try:
+            os.rmdir(path)
+        except OSError, e:
+            if e.errno != errno.ENOENT:
+                failed.append((path, str(e)))
+    return sorted(failed)
+
+def getExpired(backup_base, date_dirs, policies):
+    """Returns the expired dated backup directories and job directories.
+
+    @param backup_base: Base backup directory.
+    @param date_dirs:   List of dated backup directories.
+    @param policies:    Function returning the retention policy as tuple of
+                        (daily, weekly, monthly) for job name or None if
+                        backups of the job are retained indefinitely.
+    @return:            Tuple of (expired dated directories, expired job
+                        directories in retained dated directories).
+
+    """
+    job_dates = {}
+    date_jobs = {}
+    for name in date_dirs:
+        date_path = os.path.join(backup_base, name)
+        try:
+            entries = os.listdir(date_path)
+        except OSError, e:
+            raise errors.BackupEnvironmentError("Listing of backup directory "
+                                                "failed: %s" % date_path,
+                                                "Error Message: %s" % str(e))
+        jobs = [job for job in entries
+                if os.path.isdir(os.path.join(date_path, job))]
+        date_jobs[name] = jobs
+        for job in jobs:
+            job_dates.setdefault(job, []).append(name)
+    expired_jobs = set()
+    for (job, dates) in job_dates.items():
+        policy = policies(job)
+        if policy is None:
+            continue
+        retained = selectRetained(dates, *policy)
+        pending = list(retained)
+        while pending:
+            name = pending.pop()
+            for ref in getReferenceDates(os.path.join(backup_base, name, job)):
+                if ref in dates and ref not in retained:
+                    retained.add(ref)
+                    pending.append(ref)
+        for name in dates:
+            if name not in retained:
+                expired_jobs.add((name, job))
+    expired_dirs = []
+    expired_paths = []
+    for name in sorted(date_dirs):
+        jobs = date_jobs[name]
+        expired = [job for job in jobs if (name, job) in expired_jobs]
+        if jobs and len(expired) == len(jobs):
+            expired_dirs.append(os.path.join(backup_base, name))
+        else:
+            expired_paths.extend([os.path.join(backup_base, name, job)
+                                  for job in sorted(expired)])
+    return (expired_dirs, expired_paths)
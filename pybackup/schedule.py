@@ -0,0 +1,162 @@
+"""pybackup - Cron-style schedules for backup jobs.
+
+Schedules use the five fields of crontab entries (minute, hour, day of month,
+month and day of week) with lists, ranges and steps, or one of the shortcuts
+@hourly, @daily, @weekly and @monthly.
+
+"""
+
+import re
+from datetime import timedelta
+from pybackup import errors
+
+__author__ = "Ali Onur Uyar"
+__copyright__ = "Copyright 2011, Ali Onur Uyar"
+__credits__ = []
+__license__ = "GPL"
+__version__ = "0.5"
+__maintainer__ = "Ali Onur Uyar"
+__email__ = "aouyar at gmail.com"
+__status__ = "Development"
+
+
+scheduleShortcuts = {'@hourly': '0 * * * *',
+                     '@daily': '0 0 * * *',
+                     '@midnight': '0 0 * * *',
+                     '@weekly': '0 0 * * 0',
+                     '@monthly': '0 0 1 * *',}
+"""Dictionary mapping schedule shortcuts to crontab fields."""
+
+monthNames = ('jan', 'feb', 'mar', 'apr', 'may', 'jun',
+              'jul', 'aug', 'sep', 'oct', 'nov', 'dec')
+"""Abbreviated month names for the month field. (1 - 12)"""
+
+dayNames = ('sun', 'mon', 'tue', 'wed', 'thu', 'fri', 'sat')
+"""Abbreviated day names for the day of week field. (0 - 6)"""
+
+maxCatchUpMinutes = 24 * 60
+"""Maximum number of missed minutes checked for due jobs after the scheduler
+has been delayed. (System suspend, clock changes.)"""
+
+
+def parseField(field, low, high, names=None):
+    """Parses field of crontab entry.
+
+    @param field: Comma separated list of values, ranges (a-b), steps (*/n or
+                  a-b/n) or *.
+    @param low:   Minimum value.
+    @param high:  Maximum value.
+    @param names: Names for values starting at low.
+    @return:      Set of values or None if the field is *.
+
+    """
+    if field == '*':
+        return None
+    values = set()
+    for item in field.split(','):
+        mobj = re.match('(\*|[\w]+(?:-[\w]+)?)(?:/(\d+))?$', item)
+        if mobj is None:
+            raise ValueError(item)
+        (rng, step) = mobj.groups()
+        step = int(step or 1)
+        if rng == '*':
+            (start, end) = (low, high)
+        else:
+            bounds = []
+            for val in rng.split('-'):
+                if names is not None and val.lower() in names:
+                    bounds.append(low + list(names).index(val.lower()))
+                else:
+                    bounds.append(int(val))
+            start = bounds[0]
+            if len(bounds) > 1:
+                end = bounds[1]
+            elif mobj.group(2):
+                end = high
+            else:
+                end = start
+        if step < 1 or start < low or end > high or start > end:
+            raise ValueError(item)
+        values.update(range(start, end + 1, step))
+    return values
+
+
+class CronSchedule:
+    """Schedule defined by crontab fields. As in cron, if both the day of
+    month and the day of week are restricted, days matching either of the
+    fields are selected.
+
+    """
+
+    def __init__(self, spec):
+        """Constructor
+
+        @param spec: Crontab fields or shortcut. (Example: 30 2 * * 1-5)
+
+        """
+        self._spec = spec
+        fields = scheduleShortcuts.get(spec.strip().lower(), spec).split()
+        if len(fields) != 5:
+            raise errors.BackupConfigError("Invalid schedule: %s" % spec,
+                                           "The schedule must have 5 fields: "
+                                           "minute hour day month weekday")
+        try:
+            self._minutes = parseField(fields[0], 0, 59)
+            self._hours = parseField(fields[1], 0, 23)
+            self._days = parseField(fields[2], 1, 31)
+            self._months = parseField(fields[3], 1, 12, monthNames)
+            weekdays = parseField(fields[4], 0, 7, dayNames)
+        except ValueError, e:
+            raise errors.BackupConfigError("Invalid schedule: %s" % spec,
+                                           "Invalid field value: %s" % str(e))
+        if weekdays is not None and 7 in weekdays:
+            weekdays.discard(7)
+            weekdays.add(0)
+        self._weekdays = weekdays
+
+    def __str__(self):
+        return self._spec
+
+    def _matchesDay(self, dt):
+        if self._months is not None and dt.month not in self._months:
+            return False
+        day_ok = self._days is None or dt.day in self._days
+        weekday_ok = (self._weekdays is None
+                      or (dt.weekday() + 1) % 7 in self._weekdays)
+        if self._days is not None and self._weekdays is not None:
+            return day_ok or weekday_ok
+        return day_ok and weekday_ok
+
+    def matches(self, dt):
+        """Returns True if the schedule selects the minute.
+
+        @param dt: Datetime object.
+        @return:   Boolean
+
+        """
+        return ((self._minutes is None or dt.minute in self._minutes)
+                and (self._hours is None or dt.hour in self._hours)
+                and self._matchesDay(dt))
+
+    def getNextTime(self, after, max_days=366 * 5):
+        """Returns the first minute selected by the schedule after a point in
+        time. Days and hours that are not selected are skipped as a whole.
+
+        @param after:    Datetime object.
+        @param max_days: Maximum number of days searched.
+        @return:         Datetime object or None if no minute is selected
+                         within the limit. (Example: 30th of February.)
+
+        """
+        dt = after.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        end = dt + timedelta(days=max_days)
+        while dt < end:
+            if not self._matchesDay(dt):
+                dt = dt.replace(hour=0, minute=0) + timedelta(days=1)
+            elif self._hours is not None and dt.hour not in self._hours:
+                dt = dt.replace(minute=0) + timedelta(hours=1)
+            elif self._minutes is not None and dt.minute not in self._minutes:
+                dt += timedelta(minutes=1)
+            else:
+                return dt
+        return None
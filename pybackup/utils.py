@@ -3,7 +3,12 @@
 """
 
 import os
+import re
 import pwd
+import hashlib
+import errno
+import select
+from collections import deque
 
 __author__ = "Ali Onur Uyar"
 __copyright__ = "Copyright 2011, Ali Onur Uyar"
@@ -15,6 +20,17 @@ __email__ = "aouyar at gmail.com"
 __status__ = "Development"
 
 
+# Defaults
+streamBlockSize = 65536
+"""Maximum size of data read from output pipes of child processes at once."""
+
+tailMaxLines = 100
+"""Default number of lines kept in tail of output of child processes."""
+
+tailMaxLineLength = 4096
+"""Maximum length of lines kept in tail of output; longer lines are split."""
+
+
 
 def splitMsg(msg):
     """Returns the list of lines in msg breaking at line boundaries and skipping
@@ -33,3 +49,358 @@ def checkUser(user):
     
     """
     return pwd.getpwnam(user).pw_uid == os.getuid()
+
+def getBackupDateDirs(backup_base):
+    """Returns the list of dated backup directories (YYYY-MM-DD) in the base 
+    backup directory sorted from newest to oldest.
+    
+    @param backup_base: Base backup directory. (Backup root directory or 
+                        hostname subdirectory of backup root.)
+    @return:            List of directory names.
+    
+    """
+    try:
+        names = os.listdir(backup_base)
+    except OSError:
+        return []
+    return sorted([name for name in names 
+                   if re.match('\d{4}-\d{2}-\d{2}$', name)
+                   and os.path.isdir(os.path.join(backup_base, name))], 
+                  reverse=True)
+
+def findPrevBackupPath(backup_base, backup_date, rel_path):
+    """Returns the path in the newest dated backup directory preceding 
+    backup_date that contains the relative path rel_path.
+    
+    @param backup_base: Base backup directory.
+    @param backup_date: Date of the current backup. (YYYY-MM-DD)
+    @param rel_path:    Path relative to dated backup directory.
+    @return:            Path or None if no previous backup is found.
+    
+    """
+    for name in getBackupDateDirs(backup_base):
+        if name < backup_date:
+            path = os.path.join(backup_base, name, rel_path)
+            if os.path.isdir(path):
+                return path
+    return None
+
+def waitCmd(cmd):
+    """Waits for termination of child process started with subprocess.Popen
+    and collects the resource usage of the process.
+    
+    @param cmd: Popen instance.
+    @return:    Resource usage as returned by os.wait4 or None if the process 
+                has already been reaped.
+    
+    """
+    if cmd.returncode is not None:
+        return None
+    while True:
+        try:
+            (pid, status, rusage) = os.wait4(cmd.pid, 0) #@UnusedVariable
+            break
+        except OSError, e:
+            if e.errno == errno.EINTR:
+                continue
+            elif e.errno == errno.ECHILD:
+                cmd.wait()
+                return None
+            raise
+    if os.WIFSIGNALED(status):
+        cmd.returncode = -os.WTERMSIG(status)
+    else:
+        cmd.returncode = os.WEXITSTATUS(status)
+    return rusage
+
+def pumpStreams(streams, block_size=None):
+    """Copies data from the output pipes of child processes to file objects 
+    as it arrives, using poll to wait for data on all pipes at once. The pipes
+    and the file objects are closed on EOF.
+    
+    @param streams:    List of (pipe, sink) tuples, where pipe is the file 
+                       object for the pipe and sink is a file object that 
+                       implements write and close methods. Entries with None
+                       as pipe are skipped.
+    @param block_size: Maximum size of data read from pipe at once.
+    @return:           List of number of bytes read from each pipe.
+    
+    """
+    block_size = block_size or streamBlockSize
+    counts = [0] * len(streams)
+    fd_map = {}
+    for (idx, (pipe, sink)) in enumerate(streams):
+        if pipe is not None:
+            fd_map[pipe.fileno()] = (idx, pipe, sink)
+    if hasattr(select, 'poll'):
+        poller = select.poll()
+        for fd in fd_map:
+            poller.register(fd, select.POLLIN | select.POLLPRI 
+                                | select.POLLHUP | select.POLLERR)
+        wait = lambda: [fd for (fd, event) in poller.poll()] #@UnusedVariable
+    else:
+        poller = None
+        wait = lambda: select.select(fd_map.keys(), [], [])[0]
+    while fd_map:
+        try:
+            ready = wait()
+        except select.error, e:
+            if e.args[0] == errno.EINTR:
+                continue
+            raise
+        for fd in ready:
+            (idx, pipe, sink) = fd_map[fd]
+            try:
+                data = os.read(fd, block_size)
+            except OSError, e:
+                if e.errno == errno.EINTR:
+                    continue
+                raise
+            if data:
+                counts[idx] += len(data)
+                sink.write(data)
+            else:
+                if poller is not None:
+                    poller.unregister(fd)
+                del fd_map[fd]
+                pipe.close()
+                sink.close()
+    return counts
+
+def getRusageStats(rusage_list):
+    """Returns the combined resource usage statistics for a list of processes.
+    
+    @param rusage_list: List of resource usage results of os.wait4.
+    @return:            Dictionary of statistics. (CPU times in seconds, peak
+                        resident set size of the largest process in KB.)
+    
+    """
+    rusage_list = [rusage for rusage in rusage_list if rusage is not None]
+    return {'cpu_user': sum([rusage.ru_utime for rusage in rusage_list]),
+            'cpu_system': sum([rusage.ru_stime for rusage in rusage_list]),
+            'max_rss_kb': max([rusage.ru_maxrss for rusage in rusage_list]
+                              or [0]),}
+
+def getDirSize(path):
+    """Returns the total size of the files in directory tree.
+    
+    @param path: Directory path.
+    @return:     Size in bytes.
+    
+    """
+    total = 0
+    for (dirpath, dirnames, filenames) in os.walk(path): #@UnusedVariable
+        for filename in filenames:
+            try:
+                total += os.lstat(os.path.join(dirpath, filename)).st_size
+            except OSError:
+                pass
+    return total
+
+def hashFile(path, block_size=4194304):
+    """Computes the SHA-256 hash of file with large sequential reads.
+    
+    @param path:       Path for file.
+    @param block_size: Size of reads in bytes.
+    @return:           Tuple of (SHA-256 hash in hexadecimal, size in bytes).
+    
+    """
+    hasher = hashlib.sha256()
+    size = 0
+    fp = open(path, 'rb', 0)
+    try:
+        while True:
+            data = fp.read(block_size)
+            if not data:
+                break
+            hasher.update(data)
+            size += len(data)
+    finally:
+        fp.close()
+    return (hasher.hexdigest(), size)
+
+
+class FileDescWriter:
+    """File object wrapper for writing to a file descriptor without buffering.
+    
+    """
+    
+    def __init__(self, fd):
+        """Constructor
+        
+        @param fd: File descriptor.
+        
+        """
+        self._fd = fd
+        
+    def write(self, data):
+        """Writes all data to file descriptor.
+        
+        @param data: Data string.
+        
+        """
+        while data:
+            written = os.write(self._fd, data)
+            data = data[written:]
+            
+    def close(self):
+        """The file descriptor is not closed; it is owned by the caller.
+        
+        """
+        pass
+
+
+class HashingWriter:
+    """File object wrapper that computes the SHA-256 hash and the size of the
+    data while it is being written.
+    
+    """
+    
+    def __init__(self, out, close_func=None):
+        """Constructor
+        
+        @param out:        Output file object. (Must implement write method.)
+        @param close_func: Function called with the HashingWriter instance as
+                           argument once the writer is closed.
+        
+        """
+        self._out = out
+        self._closeFunc = close_func
+        self._hash = hashlib.sha256()
+        self._closed = False
+        self.size = 0
+        
+    def write(self, data):
+        """Writes data to output file.
+        
+        @param data: Data string.
+        
+        """
+        self._hash.update(data)
+        self.size += len(data)
+        self._out.write(data)
+        
+    def hexdigest(self):
+        """Returns the hash of the data written so far.
+        
+        @return: SHA-256 hash in hexadecimal.
+        
+        """
+        return self._hash.hexdigest()
+        
+    def close(self):
+        """Closes the output file object.
+        
+        """
+        if self._closed:
+            return
+        self._closed = True
+        if hasattr(self._out, 'close'):
+            self._out.close()
+        if self._closeFunc is not None:
+            self._closeFunc(self)
+
+
+class OutputTail:
+    """File object that splits the output of a child process in lines, keeps a
+    bounded number of trailing lines for error reports and optionally passes 
+    each line to a function, for example for logging.
+    
+    """
+    
+    def __init__(self, max_lines=None, line_func=None):
+        """Constructor
+        
+        @param max_lines: Number of lines kept. (Default: tailMaxLines)
+        @param line_func: Function called with each line of output.
+        
+        """
+        self._lines = deque(maxlen=max_lines or tailMaxLines)
+        self._lineFunc = line_func
+        self._partial = ''
+        self.numLines = 0
+        
+    def _addLine(self, line):
+        self.numLines += 1
+        self._lines.append(line)
+        if self._lineFunc is not None:
+            self._lineFunc(line)
+        
+    def write(self, data):
+        """Writes output data.
+        
+        @param data: Data string.
+        
+        """
+        lines = (self._partial + data).split('\n')
+        self._partial = lines.pop()
+        for line in lines:
+            self._addLine(line)
+        while len(self._partial) > tailMaxLineLength:
+            self._addLine(self._partial[:tailMaxLineLength])
+            self._partial = self._partial[tailMaxLineLength:]
+            
+    def close(self):
+        """Processes the last line if it is not terminated by newline.
+        
+        """
+        if self._partial:
+            self._addLine(self._partial)
+            self._partial = ''
+            
+    def getText(self):
+        """Returns the tail of the output.
+        
+        @return: Multi-line text. The number of skipped lines is noted on the
+                 first line if output has been discarded.
+        
+        """
+        lines = list(self._lines)
+        skipped = self.numLines - len(lines)
+        if skipped > 0:
+            lines.insert(0, "(%d lines skipped)" % skipped)
+        return "\n".join(lines)
+
+
+class OutputBuffer:
+    """File object that keeps the complete output of a child process and 
+    optionally passes each line to a function, for example for logging.
+    
+    """
+    
+    def __init__(self, line_func=None):
+        """Constructor
+        
+        @param line_func: Function called with each line of output.
+        
+        """
+        self._chunks = []
+        if line_func is not None:
+            self._lineSplitter = OutputTail(1, line_func)
+        else:
+            self._lineSplitter = None
+            
+    def write(self, data):
+        """Writes output data.
+        
+        @param data: Data string.
+        
+        """
+        self._chunks.append(data)
+        if self._lineSplitter is not None:
+            self._lineSplitter.write(data)
+            
+    def close(self):
+        """Processes the last line if it is not terminated by newline.
+        
+        """
+        if self._lineSplitter is not None:
+            self._lineSplitter.close()
+            
+    def getText(self):
+        """Returns the output.
+        
+        @return: Output text.
+        
+        """
+        return ''.join(self._chunks)
@@ -0,0 +1,170 @@
+"""pybackup - Verification of backup files.
+
+The backup files in the job directories of dated backup directories are checked
+against the checksum manifests written by the backup jobs. The compressed files
+in job directories without checksum manifest are test-decompressed instead.
+The files are checked in parallel by a pool of worker processes.
+
+"""
+
+import os
+import re
+import gzip
+import zlib
+import multiprocessing
+from pybackup import errors
+from pybackup import utils
+from pybackup import fsutils
+from pybackup import compress
+
+__author__ = "Ali Onur Uyar"
+__copyright__ = "Copyright 2011, Ali Onur Uyar"
+__credits__ = []
+__license__ = "GPL"
+__version__ = "0.5"
+__maintainer__ = "Ali Onur Uyar"
+__email__ = "aouyar at gmail.com"
+__status__ = "Development"
+
+
+# Defaults
+readBlockSize = 4194304
+"""Size of sequential reads from backup files in bytes."""
+
+testSuffixes = ('.gz', '.tgz')
+"""Filename suffixes of files that are test-decompressed when the job
+directory has no checksum manifest."""
+
+
+def parseDateRanges(date_specs, date_dirs):
+    """Returns the dated backup directories selected by the list of dates and
+    date ranges.
+
+    @param date_specs: List of dates (YYYY-MM-DD) and date ranges
+                       (YYYY-MM-DD:YYYY-MM-DD). Either end of a range can be
+                       left empty for an open range.
+    @param date_dirs:  List of existing dated backup directories.
+    @return:           Sorted list of selected directory names.
+
+    """
+    selected = set()
+    for spec in date_specs:
+        mobj = re.match('(\d{4}-\d{2}-\d{2})?(:)?(\d{4}-\d{2}-\d{2})?$', spec)
+        if mobj is None or not (mobj.group(1) or mobj.group(2)):
+            raise errors.BackupStartupError("Invalid date or date range for "
+                                            "verification: %s" % spec)
+        (start, sep, end) = mobj.groups()
+        if sep is None:
+            end = start
+        for name in date_dirs:
+            if (start is None or name >= start) and (end is None or name <= end):
+                selected.add(name)
+    return sorted(selected)
+
+def getVerifyTasks(date_path):
+    """Returns the list of checks for the backup files in the job directories
+    of a dated backup directory.
+
+    @param date_path: Path for dated backup directory.
+    @return:          List of (type, path, sha256, size) tuples. The type is
+                      sha256 for files listed in checksum manifests and gzip
+                      for compressed files in job directories without
+                      checksum manifest.
+
+    """
+    tasks = []
+    for job_name in sorted(os.listdir(date_path)):
+        job_path = os.path.join(date_path, job_name)
+        if not os.path.isdir(job_path):
+            continue
+        manifest_path = os.path.join(job_path, fsutils.checksumManifestName)
+        if os.path.isfile(manifest_path):
+            for (path, digest, size) in fsutils.readChecksumManifest(manifest_path):
+                tasks.append(('sha256', os.path.join(job_path, path),
+                              digest, size))
+        else:
+            for (dirpath, dirnames, filenames) in os.walk(job_path): #@UnusedVariable
+                for filename in sorted(filenames):
+                    if filename.endswith(testSuffixes):
+                        tasks.append(('gzip', os.path.join(dirpath, filename),
+                                      None, None))
+    return tasks
+
+def verifyFile(task):
+    """Checks backup file. Executed by the worker processes.
+
+    @param task: Tuple of (type, path, sha256, size) as returned by
+                 getVerifyTasks.
+    @return:     Tuple of (path, size, error), where size is the number of
+                 bytes read and error is the error message or None if the
+                 check succeeded.
+
+    """
+    (check, path, digest, size) = task
+    read_size = 0
+    try:
+        if check == 'sha256':
+            (read_digest, read_size) = utils.hashFile(path, readBlockSize)
+            if read_size != size:
+                return (path, read_size, "Size mismatch: %d bytes, "
+                        "expected %d bytes." % (read_size, size))
+            if read_digest != digest:
+                return (path, read_size, "Checksum mismatch.")
+        else:
+            fp = open(path, 'rb', 0)
+            try:
+                gzfp = gzip.GzipFile(fileobj=fp, mode='rb')
+                while True:
+                    data = gzfp.read(readBlockSize)
+                    if not data:
+                        break
+                read_size = fp.tell()
+            finally:
+                fp.close()
+    except (EnvironmentError, EOFError, zlib.error), e:
+        return (path, read_size, str(e) or e.__class__.__name__)
+    return (path, read_size, None)
+
+def verifyBackups(date_paths, num_workers=None, log_func=None):
+    """Verifies the backup files in the dated backup directories.
+
+    @param date_paths:  List of paths for dated backup directories.
+    @param num_workers: Number of worker processes. (Number of CPUs by
+                        default.)
+    @param log_func:    Function called with (path, size, error) arguments for
+                        each checked file.
+    @return:            Tuple of (number of files, bytes read, list of
+                        (path, error) tuples for failed checks).
+
+    """
+    tasks = []
+    for date_path in date_paths:
+        tasks.extend(getVerifyTasks(date_path))
+    # Largest files first for better distribution of work among workers.
+    tasks.sort(key=lambda task: -_getFileSize(task[1]))
+    failures = []
+    total_size = 0
+    if not tasks:
+        return (0, 0, failures)
+    pool = multiprocessing.Pool(min(num_workers or compress.getNumCPUs(),
+                                    len(tasks)))
+    try:
+        for (path, size, error) in pool.imap_unordered(verifyFile, tasks):
+            total_size += size
+            if error is not None:
+                failures.append((path, error))
+            if log_func is not None:
+                log_func(path, size, error)
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+    return (len(tasks), total_size, sorted(failures))
+
+def _getFileSize(path):
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
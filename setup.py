@@ -46,6 +46,7 @@ setup(
         'Operating System :: OS Independent',
     ],
     long_description=read_file('README.markdown'),
-    entry_points={'console_scripts': u"pybackup = pybackup.jobmgr:main"},
+    entry_points={'console_scripts': [u"pybackup = pybackup.jobmgr:main",
+                                      u"pybackup-catalog = pybackup.catalog:main",]},
     install_requires=["PyMunin",],
 )
@@ -0,0 +1,93 @@
+"""pybackup - Unit tests for the lookup of paths in the backup catalog.
+
+"""
+
+import os
+import re
+import shutil
+import tempfile
+import unittest
+from pybackup import catalog
+
+__author__ = "Ali Onur Uyar"
+__copyright__ = "Copyright 2011, Ali Onur Uyar"
+__credits__ = []
+__license__ = "GPL"
+__version__ = "0.5"
+__maintainer__ = "Ali Onur Uyar"
+__email__ = "aouyar at gmail.com"
+__status__ = "Development"
+
+
+class FindEntriesTest(unittest.TestCase):
+
+    paths = ('etc', 'etc/passwd', 'etc/ssh', 'etc/ssh/sshd_config',
+             'etc-old/passwd', 'etc.d/hosts', 'etc0', 'etcetera', 'var/etc')
+
+    def setUp(self):
+        self._base = tempfile.mkdtemp(prefix='pybackup-test-')
+        job_path = os.path.join(self._base, '2021-01-01', 'files')
+        os.makedirs(job_path)
+        list_path = os.path.join(job_path, 'files.list')
+        fp = open(list_path, 'w')
+        try:
+            fp.write("sending incremental file list\n")
+            for path in self.paths:
+                fp.write("%s\n" % path)
+        finally:
+            fp.close()
+        self._catalog = catalog.BackupCatalog(os.path.join(self._base,
+                                                           'catalog.sqlite'))
+        self._catalog.addRun({'backup_path': self._base, 'num_jobs': 1,
+                              'jobs': [{'job': 'files', 'job_path': job_path,
+                                        'status': 'success',
+                                        'outputs': [{'path': list_path}]}]})
+
+    def tearDown(self):
+        self._catalog.close()
+        shutil.rmtree(self._base)
+
+    def findPaths(self, path, job_name=None):
+        return [entry[3] for entry in self._catalog.findEntries(path, job_name)]
+
+    def getQueryPlan(self, path):
+        (query, params) = self._catalog._getFindQuery(path)
+        return [row[-1] for row in self._catalog._conn.execute(
+                                   "EXPLAIN QUERY PLAN %s" % query, params)]
+
+    def testPathAndSubtree(self):
+        self.assertEqual(self.findPaths('/etc/'),
+                         ['etc', 'etc/passwd', 'etc/ssh',
+                          'etc/ssh/sshd_config'])
+        self.assertEqual(self.findPaths('etc/ssh'),
+                         ['etc/ssh', 'etc/ssh/sshd_config'])
+
+    def testFile(self):
+        self.assertEqual(self.findPaths('etc/passwd'), ['etc/passwd'])
+        self.assertEqual(self.findPaths('etc/shadow'), [])
+
+    def testJobName(self):
+        self.assertEqual(self.findPaths('etc/passwd', 'files'), ['etc/passwd'])
+        self.assertEqual(self.findPaths('etc/passwd', 'db'), [])
+
+    def testPattern(self):
+        self.assertEqual(self.findPaths('*/passwd'),
+                         ['etc-old/passwd', 'etc/passwd'])
+
+    def testPathUsesIndex(self):
+        for path in ('etc', 'etc/ssh/sshd_config'):
+            plan = self.getQueryPlan(path)
+            self.assertTrue([row for row in plan if 'entries_path' in row],
+                            plan)
+            self.assertFalse([row for row in plan
+                              if re.match('SCAN (TABLE entries|e\\b)', row)],
+                             plan)
+
+    def testLeadingWildcardScans(self):
+        plan = self.getQueryPlan('*/passwd')
+        self.assertTrue([row for row in plan
+                         if re.match('SCAN (TABLE entries|e\\b)', row)], plan)
+
+
+if __name__ == '__main__':
+    unittest.main()
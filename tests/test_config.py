@@ -0,0 +1,88 @@
+"""pybackup - Unit tests for the cache of parsed configuration files.
+
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+from pybackup import config
+from pybackup import jobmgr
+
+__author__ = "Ali Onur Uyar"
+__copyright__ = "Copyright 2011, Ali Onur Uyar"
+__credits__ = []
+__license__ = "GPL"
+__version__ = "0.5"
+__maintainer__ = "Ali Onur Uyar"
+__email__ = "aouyar at gmail.com"
+__status__ = "Development"
+
+
+def getTypes(obj):
+    """Returns the types of the strings in nested dictionaries and lists.
+
+    @param obj: Dictionary, list or value.
+    @return:    Set of types.
+
+    """
+    if isinstance(obj, dict):
+        return getTypes(obj.keys()) | getTypes(obj.values())
+    elif isinstance(obj, list):
+        types = set()
+        for item in obj:
+            types |= getTypes(item)
+        return types
+    elif isinstance(obj, basestring):
+        return set([type(obj)])
+    return set()
+
+
+class ConfCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self._base = tempfile.mkdtemp(prefix='pybackup-test-')
+        self._confPath = os.path.join(self._base, 'pybackup.conf')
+        fp = open(self._confPath, 'w')
+        try:
+            fp.write("[general]\nbackup_root: %s\ninclude_dir: conf.d\n"
+                     % os.path.join(self._base, 'backup'))
+        finally:
+            fp.close()
+        os.mkdir(os.path.join(self._base, 'conf.d'))
+        fp = open(os.path.join(self._base, 'conf.d', 'files.conf'), 'w')
+        try:
+            fp.write("[files]\nmethod: archive_tar\n"
+                     "path_list: /srv/d\xc3\xa9p\xc3\xb4t /srv/data\n")
+        finally:
+            fp.close()
+
+    def tearDown(self):
+        shutil.rmtree(self._base)
+
+    def readConf(self):
+        mgr = jobmgr.JobManager({'config_path': [self._confPath,]}, [])
+        conf = config.readConfFile([self._confPath,], mgr.readConfCache)
+        if conf['cache_changed']:
+            mgr.writeConfCache()
+        return conf
+
+    def testColdAndWarmCache(self):
+        cold = self.readConf()
+        self.assertTrue(cold['cache_changed'])
+        warm = self.readConf()
+        self.assertFalse(warm['cache_changed'])
+        self.assertEqual(warm['jobs'], cold['jobs'])
+        self.assertEqual(warm['sources'], cold['sources'])
+        self.assertEqual(getTypes(warm['jobs']), set([str]))
+        self.assertEqual(warm['jobs']['files']['path_list'],
+                         "/srv/d\xc3\xa9p\xc3\xb4t /srv/data")
+
+    def testEncodeStrings(self):
+        self.assertEqual(config.encodeStrings({u'k\xe9y': [u'v\xe0l', 1,
+                                                           None]}),
+                         {'k\xc3\xa9y': ['v\xc3\xa0l', 1, None]})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,207 @@
+"""pybackup - Unit tests for the retention policy of dated backup directories.
+
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+from datetime import date
+from pybackup import retention
+
+__author__ = "Ali Onur Uyar"
+__copyright__ = "Copyright 2011, Ali Onur Uyar"
+__credits__ = []
+__license__ = "GPL"
+__version__ = "0.5"
+__maintainer__ = "Ali Onur Uyar"
+__email__ = "aouyar at gmail.com"
+__status__ = "Development"
+
+
+def dateRange(first, last):
+    """Returns the consecutive backup dates between two dates.
+
+    @param first: First date. (YYYY-MM-DD)
+    @param last:  Last date. (YYYY-MM-DD)
+    @return:      List of backup dates.
+
+    """
+    start = retention.parseDate(first).toordinal()
+    end = retention.parseDate(last).toordinal()
+    return [date.fromordinal(day).isoformat()
+            for day in range(start, end + 1)]
+
+
+class SelectRetainedTest(unittest.TestCase):
+
+    def testNoPolicy(self):
+        dates = dateRange('2021-01-01', '2021-01-10')
+        self.assertEqual(retention.selectRetained(dates), set())
+
+    def testDaily(self):
+        dates = dateRange('2021-01-01', '2021-01-10')
+        self.assertEqual(retention.selectRetained(dates, daily=3),
+                         set(['2021-01-08', '2021-01-09', '2021-01-10']))
+
+    def testUnsortedDates(self):
+        dates = ['2021-01-09', '2021-01-01', '2021-01-10', '2021-01-05']
+        self.assertEqual(retention.selectRetained(dates, daily=2),
+                         set(['2021-01-09', '2021-01-10']))
+
+    def testMoreDailyThanDates(self):
+        dates = ['2021-01-01', '2021-01-02']
+        self.assertEqual(retention.selectRetained(dates, daily=7), set(dates))
+
+    def testWeeklyIsoWeekAcrossNewYear(self):
+        # 2020-12-28 - 2021-01-03 is ISO week 53 of 2020, 2021-01-04 starts
+        # ISO week 1 of 2021.
+        dates = dateRange('2020-12-20', '2021-01-05')
+        self.assertEqual(retention.selectRetained(dates, weekly=3),
+                         set(['2021-01-05', '2021-01-03', '2020-12-27']))
+
+    def testWeeklyFirstDayOfWeek(self):
+        dates = ['2021-01-03', '2021-01-04']
+        self.assertEqual(retention.selectRetained(dates, weekly=2),
+                         set(dates))
+        dates = ['2021-01-04', '2021-01-10']
+        self.assertEqual(retention.selectRetained(dates, weekly=2),
+                         set(['2021-01-10']))
+
+    def testWeeklySameWeekDifferentYears(self):
+        dates = ['2019-12-30', '2020-12-28']
+        self.assertEqual(retention.selectRetained(dates, weekly=2),
+                         set(dates))
+
+    def testMonthlyBoundaries(self):
+        dates = ['2021-01-31', '2021-02-01', '2021-02-28', '2021-03-01']
+        self.assertEqual(retention.selectRetained(dates, monthly=2),
+                         set(['2021-03-01', '2021-02-28']))
+        self.assertEqual(retention.selectRetained(dates, monthly=3),
+                         set(['2021-03-01', '2021-02-28', '2021-01-31']))
+
+    def testMonthlyAcrossYears(self):
+        dates = ['2020-01-15', '2020-12-31', '2021-01-01']
+        self.assertEqual(retention.selectRetained(dates, monthly=2),
+                         set(['2021-01-01', '2020-12-31']))
+
+    def testMonthlySkipsMissingMonths(self):
+        dates = ['2020-10-05', '2021-01-10', '2021-01-20']
+        self.assertEqual(retention.selectRetained(dates, monthly=2),
+                         set(['2021-01-20', '2020-10-05']))
+
+    def testCombinedPolicy(self):
+        dates = dateRange('2020-11-01', '2021-01-05')
+        self.assertEqual(retention.selectRetained(dates, daily=2, weekly=2,
+                                                  monthly=3),
+                         set(['2021-01-05', '2021-01-04', '2021-01-03',
+                              '2020-12-31', '2020-11-30']))
+
+
+class GetExpiredTest(unittest.TestCase):
+
+    def setUp(self):
+        self._base = tempfile.mkdtemp(prefix='pybackup-test-')
+
+    def tearDown(self):
+        shutil.rmtree(self._base)
+
+    def makeJob(self, name, job, mode=None, ref=None):
+        """Creates job directory in dated backup directory.
+
+        @param name: Backup date. (YYYY-MM-DD)
+        @param job:  Job name.
+        @param mode: Backup mode of archive. (incremental or differential)
+        @param ref:  Date of reference backup of incremental or differential
+                     archive.
+
+        """
+        job_path = os.path.join(self._base, name, job)
+        os.makedirs(job_path)
+        fp = open(os.path.join(job_path, 'data.tgz'), 'w')
+        fp.close()
+        if mode is not None:
+            fp = open(os.path.join(job_path, 'data.deleted'), 'w')
+            try:
+                fp.write("## mode: %s\n## reference: %s\n" % (mode, ref))
+                fp.write("## reference: 1999-01-01\n")
+                fp.write("removed/file\n")
+            finally:
+                fp.close()
+
+    def getExpired(self, policies):
+        date_dirs = sorted(os.listdir(self._base))
+        (dirs, paths) = retention.getExpired(self._base, date_dirs,
+                                             policies.get)
+        return ([os.path.basename(path) for path in dirs],
+                [os.path.relpath(path, self._base) for path in paths])
+
+    def testExpiredDateDirs(self):
+        for name in dateRange('2021-01-01', '2021-01-05'):
+            self.makeJob(name, 'db')
+            self.makeJob(name, 'files')
+        self.assertEqual(self.getExpired({'db': (2, 0, 0),
+                                          'files': (3, 0, 0)}),
+                         (['2021-01-01', '2021-01-02'],
+                          [os.path.join('2021-01-03', 'db')]))
+
+    def testRetainedIndefinitely(self):
+        for name in dateRange('2021-01-01', '2021-01-03'):
+            self.makeJob(name, 'db')
+            self.makeJob(name, 'files')
+        self.assertEqual(self.getExpired({'db': (1, 0, 0)}),
+                         ([], [os.path.join('2021-01-01', 'db'),
+                               os.path.join('2021-01-02', 'db')]))
+
+    def testEmptyDateDir(self):
+        os.mkdir(os.path.join(self._base, '2021-01-01'))
+        self.makeJob('2021-01-02', 'db')
+        self.assertEqual(self.getExpired({'db': (1, 0, 0)}), ([], []))
+
+    def testDifferentialReference(self):
+        self.makeJob('2021-01-01', 'files')
+        self.makeJob('2021-01-02', 'files', 'differential', '2021-01-01')
+        self.makeJob('2021-01-03', 'files', 'differential', '2021-01-01')
+        self.assertEqual(self.getExpired({'files': (1, 0, 0)}),
+                         (['2021-01-02'], []))
+
+    def testIncrementalReferenceChain(self):
+        self.makeJob('2021-01-01', 'files')
+        self.makeJob('2021-01-02', 'files', 'incremental', '2021-01-01')
+        self.makeJob('2021-01-03', 'files', 'incremental', '2021-01-02')
+        self.makeJob('2021-01-04', 'files', 'incremental', '2021-01-03')
+        self.makeJob('2021-01-04', 'db')
+        self.assertEqual(self.getExpired({'files': (1, 0, 0),
+                                          'db': (1, 0, 0)}), ([], []))
+
+    def testReferenceAcrossIsoWeek(self):
+        # The weekly backup of ISO week 53 of 2020 is an incremental archive
+        # based on a full archive of the previous week.
+        self.makeJob('2020-12-27', 'files')
+        self.makeJob('2020-12-28', 'files', 'incremental', '2020-12-27')
+        self.makeJob('2021-01-03', 'files', 'incremental', '2020-12-28')
+        self.makeJob('2021-01-04', 'files')
+        self.makeJob('2021-01-05', 'files', 'incremental', '2021-01-04')
+        self.assertEqual(self.getExpired({'files': (1, 2, 0)}),
+                         ([], []))
+        self.assertEqual(self.getExpired({'files': (1, 0, 0)}),
+                         (['2020-12-27', '2020-12-28', '2021-01-03'], []))
+
+    def testReferenceOfOtherJob(self):
+        self.makeJob('2021-01-01', 'db')
+        self.makeJob('2021-01-01', 'files')
+        self.makeJob('2021-01-02', 'db')
+        self.makeJob('2021-01-02', 'files', 'incremental', '2021-01-01')
+        self.assertEqual(self.getExpired({'db': (1, 0, 0),
+                                          'files': (1, 0, 0)}),
+                         ([], [os.path.join('2021-01-01', 'db')]))
+
+    def testReferenceWithoutDate(self):
+        self.makeJob('2021-01-01', 'files')
+        self.makeJob('2021-01-02', 'files', 'incremental', None)
+        self.assertEqual(self.getExpired({'files': (1, 0, 0)}),
+                         (['2021-01-01'], []))
+
+
+if __name__ == '__main__':
+    unittest.main()